@@ -3,7 +3,7 @@
 // ============================================================================
 
 #define PROJECT  "weatherbox3"
-#define VERSION    "1.812.171"
+#define VERSION    "2.610.191"
 #define EMAIL1   "bright.tiger"
 #define EMAIL2     "@gmail.com"
 
@@ -870,6 +870,60 @@ void JsonScaleInt(EthernetClient &client, const __FlashStringHelper * Key, int16
   client.print(Temp);
 }
 
+// ============================================================================
+// Compact binary frame.  The JSON reply runs to well over 1KB, which is a lot
+// of wire time for a handful of sensor values.  The frame is the raw image of
+// a LogRecord as stored in FRAM (so 16-bit words are big-endian) followed by
+// the log header fields the logger needs and a Fletcher-16 checksum:
+//
+//     'W' 'B' FRAME_VERSION FRAME_PAYLOAD | LogRecord | LogSize LogNext
+//     LogFull TauQueries TauReplies | Sum2 Sum1
+//
+// The checksum covers the payload only.  The frame is assembled in Buffer and
+// written in one go, since single-byte client writes each cost a packet.
+// ============================================================================
+
+#define FRAME_MAGIC1   'W'
+#define FRAME_MAGIC2   'B'
+#define FRAME_VERSION    1
+#define FRAME_PAYLOAD  (LOG_RECORD_SIZE + 9)
+
+bit8 FrameReply = 0; // nonzero if the binary frame was requested
+bit8 FrameLen   = 0; // bytes assembled in Buffer
+
+void FrameByte(bit8 Value) {
+  Buffer[FrameLen++] = Value;
+}
+
+void FrameWord(bit16 Value) {
+  FrameByte(Value >> 8  );
+  FrameByte(Value & 0xff);
+}
+
+void SendFrame(EthernetClient &client, bit16 LogOffset) {
+  bit8 Sum1 = 0, Sum2 = 0;
+  FrameLen = 0;
+  FrameByte(FRAME_MAGIC1 );
+  FrameByte(FRAME_MAGIC2 );
+  FrameByte(FRAME_VERSION);
+  FrameByte(FRAME_PAYLOAD);
+  for (bit8 Offset = 0; Offset < LOG_RECORD_SIZE; Offset++) {
+    FrameByte(FramReadByte(LogOffset + Offset));
+  }
+  FrameWord(LogSize                                   );
+  FrameWord(FramReadWord(offsetof(LogHeader, LogNext)));
+  FrameByte(FramReadByte(offsetof(LogHeader, LogFull)));
+  FrameWord(TauQueries                                );
+  FrameWord(TauReplies                                );
+  for (bit8 Index = 4; Index < FrameLen; Index++) {
+    Sum1 = ((bit16) Sum1 + (bit8) Buffer[Index]) % 255;
+    Sum2 = ((bit16) Sum2 + Sum1) % 255;
+  }
+  FrameByte(Sum2);
+  FrameByte(Sum1);
+  client.write((const bit8 *) Buffer, FrameLen);
+}
+
 // ============================================================================
 // Process HTTP GET requests.  We handle the following commands:
 //
@@ -881,6 +935,8 @@ void JsonScaleInt(EthernetClient &client, const __FlashStringHelper * Key, int16
 //    tau?xxx.xxx.xxx.xxx         set tau address
 //    now                         return current weather data
 //    log?index                   return weather data history
+//    bin                         current weather data, binary frame
+//    bin?index                   weather data history, binary frame
 // ============================================================================
 
 // Send back a list of valid endpoints.
@@ -895,7 +951,9 @@ cptr DoHelp() {
     "tau? [disable]\n"
     "tau?xxx.xxx.xxx.xxx\n"
     "now\n"
-    "log?index\n";
+    "log?index\n"
+    "bin\n"
+    "bin?index\n";
 }
 
 // Clear all that should be cleared.
@@ -1015,11 +1073,19 @@ cptr DoData(cptr Get) {
   return "error";
 }
 
+// As DoData, but ask for the reply to be sent as a binary frame.
+
+cptr DoFrame(cptr Get) {
+  FrameReply = 1;
+  return DoData(Get);
+}
+
 void EnetHandleServer() {
   if (EthernetClient client = EnetServer.available()) {
     Serial.println(F("server connection"));
     cptr Message = "bad.request";
     LogIndex = LOG_NONE;
+    FrameReply = 0;
     Buffer[BufferLen = 0] = 0;
     while (client.connected()) {
       if (client.available()) {
@@ -1043,8 +1109,23 @@ void EnetHandleServer() {
                 if (strncmp(Get, "tau?" ,   4) == 0) Message = DoTau  (Get + 4);
                 if (strcmp (Get, "now"       ) == 0) Message = DoData (NULL   ); // also sets LogIndex
                 if (strncmp(Get, "log?" ,   4) == 0) Message = DoData (Get + 4); // also sets LogIndex
+                if (strcmp (Get, "bin"       ) == 0) Message = DoFrame(NULL   ); // also sets LogIndex
+                if (strncmp(Get, "bin?" ,   4) == 0) Message = DoFrame(Get + 4); // also sets LogIndex
             } }
             Buffer[BufferLen = 0] = 0;
+          } else if (FrameReply && (LogIndex != LOG_NONE)) {
+            HttpGets++;
+            bit16 LogOffset = LOG_HEADER_SIZE;
+            if (LogIndex < LogSize) {
+              LogOffset += LOG_RECORD_SIZE * LogIndex;
+            }
+            client.println(F("HTTP/1.1 200 OK"));
+            client.println(F("Content-Type: application/octet-stream"));
+            client.println(F("Connection: close"));
+            client.println();
+            SendFrame(client, LogOffset);
+            Serial.println(F("  sending frame"));
+            client.stop();
           } else {
             HttpGets++;
             client.println(F("HTTP/1.1 200 OK"));
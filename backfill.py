@@ -3,7 +3,7 @@
 from __future__ import print_function
 
 PROGRAM = 'backfill.py'
-VERSION = '1.811.281'
+VERSION = '2.610.196'
 CONTACT = 'bright.tiger@mail.com' # michael nagy
 
 #==============================================================================
@@ -62,32 +62,42 @@ MASK_LOG_SUCCESS = 0x01 # quarter.log_mask, log data recovered
 MASK_LOG_MISSING = 0x02 # quarter.log_mask, log data unavailable
 
 #----------------------------------------------------------------------
-# database support.  we are currently using postgresql, but with minor
-# modifications to this single block of code we could alternately run
-# with sqlite3 or possibly other database engines.
+# database support.  postgresql or sqlite, as configured by WEATHER_DB
+# (see storage.py).
 #----------------------------------------------------------------------
 
-import psycopg2, psycopg2.extras
+import storage, metrics
+from observation import Observation, Columns, UpdateSql
 
 #----------------------------------------------------------------------
-# weatherbox3 base url
+# weatherbox3 base url.  this and the upstream urls can be pointed
+# elsewhere from the environment, for instance at simulate.py.
 #----------------------------------------------------------------------
 
-WB_URL_JSON = 'http://192.168.18.107'
+WB_URL_JSON = os.environ.get('WB3_URL', 'http://192.168.18.107')
+
+#----------------------------------------------------------------------
+# one http session for every request, so the connections to the wb3
+# and the weather services are kept alive.  run by scheduler.py we're
+# handed its session, which keeps them alive from one run to the next.
+#----------------------------------------------------------------------
+
+if 'Http' not in globals():
+  Http = requests.Session()
 
 #----------------------------------------------------------------------
 # weather underground parameters
 #----------------------------------------------------------------------
 
 WU_STATION_ID = 'KFLMYAKK20'
-WU_URL_GET    = 'http://weatherstation.wunderground.com/weatherstation/updateweatherstation.php'
+WU_URL_GET    = os.environ.get('WU_URL', 'http://weatherstation.wunderground.com/weatherstation/updateweatherstation.php')
 
 #----------------------------------------------------------------------
 # aeris parameters
 #----------------------------------------------------------------------
 
 PS_STATION_ID = 'KFLMYAKK20'
-PS_URL_GET    = 'https://www.pwsweather.com/pwsupdate/pwsupdate.php'
+PS_URL_GET    = os.environ.get('PS_URL', 'https://www.pwsweather.com/pwsupdate/pwsupdate.php')
 
 #----------------------------------------------------------------------
 # given a unix epoch value in seconds, return a quarter value, which
@@ -113,34 +123,23 @@ def Report(DbCursor, Quarter, Code, Url, StationId, Password):
     try:
       Epoch = QuarterToEpoch(Quarter) + 450 # center of quarter
       UtcTime = time.strftime(TimePattern, time.gmtime(time.time()))
-      Data = {
-        'ID'          :      StationId       ,
-        'PASSWORD'    :      Password        ,
-        'dateutc'     :      UtcTime         ,
-        'winddir'     : Row['wind_direction'],
-        'windspeedmph': Row['wind_mph'      ],
-        'rainin'      : Row['rain_in'       ],
-        'dailyrainin' : Row['rain_day_in'   ],
-        'humidity'    : Row['humidity_pct'  ],
-        'dewptf'      : Row['dewpoint_f'    ],
-        'UV'          : Row['tau_status'    ],
-        'tempf'       : Row['temp_f'        ],
-        'baromin'     : Row['pressure_inhg' ],
-        'action'      :     'updateraw'
-      }
+      Data = Observation.FromRow(Row).Upstream(StationId, Password, UtcTime)
       if DebugFlag:
         Print('  quarter %d %s update skip' % (Quarter, Code))
         return True
-      r = requests.get(Url, params=Data)
+      Start = time.time()
+      r = Http.get(Url, params=Data)
+      metrics.Timed('http %s' % (Code), Start)
+      metrics.Count('requests')
       if r.status_code == 200:
         Print('    quarter %d %s update ok' % (Quarter, Code))
         return True
       Print('    quarter %d %s update bad %d' % (Quarter, Code, r.status_code))
     except Exception as er:
       Print('    quarter %d %s update exception: %s' % (Quarter, Code, er.message))
-  except psycopg2.Error as er:
+  except storage.Error as er:
     Print('    quarter %d %s db read error: %s' % (Quarter, Code, er.message))
-    os._exit(1)
+    sys.exit(1)
   except Exception as er:
     Print('    quarter %d %s db write exception 1: %s' % (Quarter, Code, er.message))
   return False
@@ -152,9 +151,9 @@ def Report(DbCursor, Quarter, Code, Url, StationId, Password):
 
 def ReportNewData():
   Print('reporting newly available data')
-  DbConnection = psycopg2.connect('dbname=weather')
-  DbCursor = DbConnection.cursor(cursor_factory=psycopg2.extras.DictCursor)
-  DbCursor.execute('SELECT count(*) FROM quarter WHERE reported_mask = 3 and epochs > 0')
+  DbConnection = storage.Connect()
+  DbCursor = DbConnection.cursor()
+  DbCursor.execute('SELECT count(*) AS count FROM quarter WHERE reported_mask = 3 and epochs > 0')
   ReportedCount = DbCursor.fetchone()['count']
   Print('  reported %d quarters previously' % (ReportedCount))
   DbCursor.execute('SELECT * FROM quarter WHERE reported_mask <> 3 and epochs > 0')
@@ -172,7 +171,7 @@ def ReportNewData():
         sql = 'UPDATE quarter SET '
         sql += 'reported_mask = %d WHERE id = %d' % (ReportedMask, Quarter)
         DbCursor.execute(sql)
-      except psycopg2.Error as er:
+      except storage.Error as er:
         Print('    quarter %d db write error: %s' % (Quarter, er.message))
       except Exception as er:
         Print('    quarter %d db write exception 2: %s' % (Quarter, er.message))
@@ -181,7 +180,7 @@ def ReportNewData():
 
 #----------------------------------------------------------------------
 # attempt to pull data for the specified quarter from the wb3 log.  if
-# successful, return a dictionary with the data.  if anything blows up
+# successful, return an observation with the data.  if anything blows up
 # with the web requests, allow the exception to bubble up to the
 # routine that called us.  we do a binary search by epoch time to
 # find any matching records.
@@ -192,7 +191,10 @@ LogDict = {}
 def Wb3LogPull(Quarter):
   Target = QuarterToEpoch(Quarter)
   Print('  seeking data for quarter %d (epoch %d)' % (Quarter, Target))
-  r = requests.get('%s/now' % (WB_URL_JSON))
+  Start = time.time()
+  r = Http.get('%s/now' % (WB_URL_JSON))
+  metrics.Timed('http wb3 now', Start)
+  metrics.Count('requests')
   if r.status_code == 200:
     wb = r.json()
     LogSize = wb['log.size']
@@ -211,7 +213,10 @@ def Wb3LogPull(Quarter):
       else:
         time.sleep(0.5)
         Print('    query log %d [%d,%d]' % (WrapIndex, LogFirst, LogNext))
-        r = requests.get('%s/log?%d' % (WB_URL_JSON, WrapIndex))
+        Start = time.time()
+        r = Http.get('%s/log?%d' % (WB_URL_JSON, WrapIndex))
+        metrics.Timed('http wb3 log', Start)
+        metrics.Count('requests')
         if r.status_code == 200:
           wb = r.json()
           LogDict[WrapIndex] = wb
@@ -233,38 +238,24 @@ def Wb3LogPull(Quarter):
             return None
           LogFirst = LogIndex # seek foreward in log
       else:
-        wb['dewpoint.f'] = round((wb['dewpoint.c'] * 1.8) + 32.0, 1)
-        wb['temp.f'    ] = round((wb['temp.c'    ] * 1.8) + 32.0, 1)
-        Data = {
-          'boot_count'    : wb['boot.count'    ],
-          'uptime_minutes': wb['uptime.minutes'],
-          'temp_f'        : wb['temp.f'        ],
-          'dewpoint_f'    : wb['dewpoint.f'    ],
-          'humidity_pct'  : wb['humidity.pct'  ],
-          'pressure_inhg' : wb['pressure.inhg' ],
-          'wind_mph'      : wb['wind.mph'      ],
-          'wind_direction': wb['wind.direction'],
-          'rain_in'       : wb['rain.in'       ],
-          'rain_day_in'   : wb['rain.day.in'   ],
-          'power_volt'    : wb['power.volt'    ],
-          'tau_status'    : wb['tau.status'    ],
-          'tau_queries'   : wb['tau.queries'   ],
-          'tau_replies'   : wb['tau.replies'   ],
-          'log_next'      : wb['log.next'      ],
-          'log_full'      : wb['log.full'      ],
-        }
-        return Data
+        return Observation.FromWb(wb)
   return None # requested data is not available
 
 #----------------------------------------------------------------------
 # for any quarters with no data which have not already been marked as
-# hopeless, attempt to fetch log data from the wb3 system.
+# hopeless, attempt to fetch log data from the wb3 system.  a quarter
+# filled from the log gets every column the log holds, and is marked
+# unreported so it goes out in the next report pass.
 #----------------------------------------------------------------------
 
+LOG_COLUMNS = Columns('quarter')
+
+LogUpdateSql = UpdateSql('quarter', LOG_COLUMNS)
+
 def QueryWb3Log():
   Print('query missing data from wb3 log')
-  DbConnection = psycopg2.connect('dbname=weather')
-  DbCursor = DbConnection.cursor(cursor_factory=psycopg2.extras.DictCursor)
+  DbConnection = storage.Connect()
+  DbCursor = DbConnection.cursor()
   if DebugFlag:
     DbCursor.execute('SELECT * FROM quarter WHERE epochs < 14')
   else:
@@ -278,38 +269,21 @@ def QueryWb3Log():
       try:
         if Data:
           Print('    quarter %d data pulled from wb3 log' % (Quarter))
-          sql = 'UPDATE quarter SET '
-          sql += 'boot_count = %d,'        % (Data['boot_count'    ])
-          sql += 'uptime_minutes = %d,'    % (Data['uptime_minutes'])
-          sql += 'temp_f = %3.1f,'         % (Data['temp_f'        ])
-          sql += 'dewpoint_f = %3.1f,'     % (Data['dewpoint_f'    ])
-          sql += 'humidity_pct = %d,'      % (Data['humidity_pct'  ])
-          sql += 'pressure_inhg = %0.3f,'  % (Data['pressure_inhg' ])
-          sql += 'wind_mph = %d,'          % (Data['wind_mph'      ])
-          sql += 'wind_direction = %1.0f,' % (Data['wind_direction'])
-          sql += 'rain_in = %4.2f,'        % (Data['rain_in'       ])
-          sql += 'rain_day_in = %4.2f,'    % (Data['rain_day_in'   ])
-          sql += 'power_volt = %6.3f,'     % (Data['power_volt'    ])
-          sql += 'tau_status = %d,'        % (Data['tau_status'    ])
-          sql += 'tau_queries = %d,'       % (Data['tau_queries'   ])
-          sql += 'tau_replies = %d,'       % (Data['tau_replies'   ])
-          sql += 'log_next = %d,'          % (Data['log_next'      ])
-          sql += 'log_full = %d,'          % (Data['log_full'      ])
-          sql += 'reported_mask = 0,'
+          Data.reported_mask = 0
           if DebugFlag:
-            sql += 'log_mask = 0,'
-            sql += 'epochs = 0'
+            Data.log_mask = 0
+            Data.epochs = 0
           else:
-            sql += 'log_mask = %d,' % (MASK_LOG_SUCCESS)
-            sql += 'epochs = 1'
-          sql += ' WHERE id = %d' % (Quarter)
-          DbCursor.execute(sql)
+            Data.log_mask = MASK_LOG_SUCCESS
+            Data.epochs = 1
+          Data.expected = Row['expected']
+          DbCursor.execute(LogUpdateSql, Data.Update(LOG_COLUMNS, Quarter))
         else:
           Print('    quarter %d data not found in wb3 log' % (Quarter))
           sql = 'UPDATE quarter SET '
           sql += 'log_mask = %d WHERE id = %d' % (MASK_LOG_MISSING, Quarter)
           DbCursor.execute(sql)
-      except psycopg2.Error as er:
+      except storage.Error as er:
         Print('    quarter %d db write error: %s' % (Quarter, er.message))
       except Exception as er:
         Print('    quarter %d db write exception 3: %s' % (Quarter, er.message))
@@ -328,14 +302,19 @@ def QueryWb3Log():
 print()
 Print('%s %s' % (PROGRAM, VERSION))
 print()
+metrics.RunStart(PROGRAM, VERSION)
 for arg in sys.argv:
   if arg.lower().startswith('-d'):
     DebugFlag = True
     print('  debug mode')
     print()
+Start = time.time()
 QueryWb3Log()
+metrics.Timed('log pull', Start)
 print()
+Start = time.time()
 ReportNewData()
+metrics.Timed('report', Start)
 print()
 print('done')
 print()
@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+PROGRAM = 'battery.py'
+VERSION = '2.610.193'
+CONTACT = 'bright.tiger@mail.com' # michael nagy
+
+#==============================================================================
+# track the health of the weatherbox battery and solar charger from the
+# power_volt readings in the epoch table.
+#
+#   battery.py [-rebuild] [-days n]
+#
+# each run summarizes any new epoch rows into the battery_day table, one
+# row per local day, and flags days that break the recent trend.  the
+# newest epoch id summarized is kept in battery_mark, so a run only reads
+# the rows of the last (possibly partial) day and anything newer.
+# -rebuild discards the summaries and starts again from the first epoch,
+# and -days sets how many recent days are displayed.
+#==============================================================================
+
+import sys, time, collections, storage
+
+#----------------------------------------------------------------------
+# readings at or below VOLT_MIN are the weatherbox being offline rather
+# than a real voltage.  the overnight discharge slope is fitted over the
+# readings from midnight until NIGHT_HOURS, when the panel is dark, and
+# recovery is the time from the morning low until the voltage first gets
+# back to where it was at midnight, looking for the low before NOON_HOURS.
+#----------------------------------------------------------------------
+
+VOLT_MIN = 1.0
+NIGHT_HOURS = 6
+NOON_HOURS = 12
+
+#----------------------------------------------------------------------
+# trend breaks.  a complete day is compared with the mean and standard
+# deviation of the TREND_DAYS days before it, and flagged when its peak
+# (charge) voltage, overnight discharge slope or recovery time is more
+# than TREND_SIGMA deviations worse than usual.  a low voltage under
+# VOLT_LOW is flagged whatever the trend.
+#----------------------------------------------------------------------
+
+TREND_DAYS = 14
+TREND_SIGMA = 3.0
+VOLT_LOW = 11.8
+
+FLAG_LOW       = 0x01
+FLAG_CHARGE    = 0x02
+FLAG_DISCHARGE = 0x04
+FLAG_RECOVERY  = 0x08
+
+FlagNames = [
+  (FLAG_LOW      , 'low'      ),
+  (FLAG_CHARGE   , 'charge'   ),
+  (FLAG_DISCHARGE, 'discharge'),
+  (FLAG_RECOVERY , 'recovery' ),
+]
+
+DAYS_SHOW = 14
+FETCH_ROWS = 10000
+
+#----------------------------------------------------------------------
+# the standard utc and local time string format we use throughout
+#----------------------------------------------------------------------
+
+TimePattern = '%Y-%m-%d %H:%M:%S'
+
+def LocalTimeStr(Epoch):
+  return time.strftime(TimePattern, time.localtime(Epoch))
+
+#----------------------------------------------------------------------
+# write a timestamped message to the permanent log file
+#----------------------------------------------------------------------
+
+def PermaLog(Text):
+  Time = LocalTimeStr(time.time())
+  with open('/home/pi/weather/permanent.log', 'a') as f:
+    f.write('%s %s %s\n' % (Time, PROGRAM, Text))
+
+#----------------------------------------------------------------------
+# write a message to the console and the permanent log file
+#----------------------------------------------------------------------
+
+def Print(Text):
+  print('%s' % (Text))
+  PermaLog(Text.strip())
+
+#----------------------------------------------------------------------
+# database support.  postgresql or sqlite, as configured by WEATHER_DB
+# (see storage.py).
+#----------------------------------------------------------------------
+
+def DbExecute(Note, Sql):
+  try:
+    db = storage.Connect()
+    cursor = db.cursor()
+    cursor.execute(Sql)
+    db.commit()
+    db.close()
+  except storage.Error as er:
+    Print('db %s error: %s' % (Note, er.message))
+    sys.exit(1)
+
+def DbInit():
+  sql = 'CREATE TABLE IF NOT EXISTS battery_day ('
+  sql += 'day            INT PRIMARY KEY,' # local date as yyyymmdd
+  sql += 'volt_min       REAL,'
+  sql += 'volt_max       REAL,'
+  sql += 'discharge_vph  REAL,' # overnight slope, volts per hour
+  sql += 'recovery_min   INT ,' # minutes from morning low back to midnight voltage
+  sql += 'readings       INT ,'
+  sql += 'flags          INT );'
+  sql += 'CREATE TABLE IF NOT EXISTS battery_mark ('
+  sql += 'id             INT PRIMARY KEY,' # always zero, there is one row
+  sql += 'epoch          INT NOT NULL);' # newest epoch summarized
+  DbExecute('init', sql)
+
+#----------------------------------------------------------------------
+# local day support.  days are keyed by their local yyyymmdd date, and
+# DayStart returns the epoch of the local midnight starting a day.
+#----------------------------------------------------------------------
+
+def DayKey(Epoch):
+  return int(time.strftime('%Y%m%d', time.localtime(Epoch)))
+
+def DayStart(Epoch):
+  Local = time.localtime(Epoch)
+  return int(time.mktime((Local.tm_year, Local.tm_mon, Local.tm_mday, 0, 0, 0, 0, 0, -1)))
+
+def DayNext(Epoch):
+  return DayStart(DayStart(Epoch) + 86400 + 7200)
+
+#----------------------------------------------------------------------
+# one day's running summary, fed a reading at a time in epoch order
+#----------------------------------------------------------------------
+
+def DayNew(Epoch):
+  Start = DayStart(Epoch)
+  return {
+    'day': DayKey(Epoch), 'start': Start, 'end': DayNext(Epoch),
+    'min': None, 'max': None, 'readings': 0,
+    'midnight': None, 'low': None, 'lowtime': 0, 'recovered': None,
+    'n': 0, 'sx': 0.0, 'sy': 0.0, 'sxx': 0.0, 'sxy': 0.0,
+  }
+
+def DayAdd(Day, Epoch, Volt):
+  Hours = (Epoch - Day['start']) / 3600.0
+  if Day['readings'] == 0:
+    Day['min'] = Day['max'] = Day['midnight'] = Volt
+  Day['min'] = min(Day['min'], Volt)
+  Day['max'] = max(Day['max'], Volt)
+  Day['readings'] += 1
+  if Hours < NIGHT_HOURS:
+    Day['n'  ] += 1
+    Day['sx' ] += Hours
+    Day['sy' ] += Volt
+    Day['sxx'] += Hours * Hours
+    Day['sxy'] += Hours * Volt
+  if Hours < NOON_HOURS and (Day['low'] is None or Volt < Day['low']):
+    Day['low'] = Volt
+    Day['lowtime'] = Epoch
+    Day['recovered'] = None
+  elif Day['recovered'] is None and Day['low'] is not None and Volt >= Day['midnight']:
+    Day['recovered'] = Epoch
+
+def DaySlope(Day):
+  Divisor = Day['n'] * Day['sxx'] - Day['sx'] * Day['sx']
+  if Day['n'] < 2 or Divisor <= 0.0:
+    return None
+  return (Day['n'] * Day['sxy'] - Day['sx'] * Day['sy']) / Divisor
+
+def DayRecovery(Day):
+  if Day['recovered'] is None:
+    return None
+  return (Day['recovered'] - Day['lowtime']) // 60
+
+#----------------------------------------------------------------------
+# compare a complete day with the days before it
+#----------------------------------------------------------------------
+
+def Stats(Values):
+  Values = [Value for Value in Values if Value is not None]
+  if len(Values) < TREND_DAYS // 2:
+    return None, None
+  Mean = float(sum(Values)) / len(Values)
+  Deviation = (sum((Value - Mean) ** 2 for Value in Values) / len(Values)) ** 0.5
+  return Mean, Deviation
+
+def TrendFlags(Summary, History):
+  Flags = 0
+  if Summary['volt_min'] < VOLT_LOW:
+    Flags |= FLAG_LOW
+  Mean, Deviation = Stats([Prior['volt_max'] for Prior in History])
+  if Mean is not None and Summary['volt_max'] < Mean - TREND_SIGMA * max(Deviation, 0.05):
+    Flags |= FLAG_CHARGE
+  Mean, Deviation = Stats([Prior['discharge_vph'] for Prior in History])
+  if Mean is not None and Summary['discharge_vph'] is not None and \
+     Summary['discharge_vph'] < Mean - TREND_SIGMA * max(Deviation, 0.005):
+    Flags |= FLAG_DISCHARGE
+  Mean, Deviation = Stats([Prior['recovery_min'] for Prior in History])
+  if Mean is not None and Summary['recovery_min'] is not None and \
+     Summary['recovery_min'] > Mean + TREND_SIGMA * max(Deviation, 15.0):
+    Flags |= FLAG_RECOVERY
+  return Flags
+
+def FlagStr(Flags):
+  return ','.join([Name for Flag, Name in FlagNames if Flags & Flag]) or '-'
+
+#----------------------------------------------------------------------
+# write a finished (or the current partial) day.  only complete days
+# are compared with the trend and join the history for the days after.
+#----------------------------------------------------------------------
+
+def DayStore(DbCursor, Day, History, Complete):
+  Summary = {
+    'day'          : Day['day'],
+    'volt_min'     : Day['min'],
+    'volt_max'     : Day['max'],
+    'discharge_vph': DaySlope(Day),
+    'recovery_min' : DayRecovery(Day),
+    'readings'     : Day['readings'],
+    'flags'        : 0,
+  }
+  if Complete:
+    Summary['flags'] = TrendFlags(Summary, History)
+    History.append(Summary)
+    if Summary['flags']:
+      Print('  %d battery trend break: %s' % (Summary['day'], FlagStr(Summary['flags'])))
+  DbCursor.execute(
+    'INSERT INTO battery_day (day, volt_min, volt_max, discharge_vph, recovery_min, readings, flags) '
+    'VALUES (%(day)s, %(volt_min)s, %(volt_max)s, %(discharge_vph)s, %(recovery_min)s, %(readings)s, %(flags)s) '
+    'ON CONFLICT (day) DO UPDATE SET '
+    'volt_min = EXCLUDED.volt_min, volt_max = EXCLUDED.volt_max, '
+    'discharge_vph = EXCLUDED.discharge_vph, recovery_min = EXCLUDED.recovery_min, '
+    'readings = EXCLUDED.readings, flags = EXCLUDED.flags', Summary)
+
+#----------------------------------------------------------------------
+# main.  pick up at the start of the day holding the high water mark,
+# load the trend history from the days before it, then stream the new
+# epoch rows through a server side cursor (sqlite cursors stream rows
+# anyway), a day at a time.
+#----------------------------------------------------------------------
+
+print()
+Print('%s %s' % (PROGRAM, VERSION))
+print()
+Rebuild = False
+DaysShow = DAYS_SHOW
+try:
+  Args = sys.argv[1:]
+  while Args:
+    Arg = Args.pop(0).lower()
+    if Arg.startswith('-r'):
+      Rebuild = True
+    elif Arg.startswith('-d'):
+      DaysShow = int(Args.pop(0))
+    else:
+      raise ValueError(Arg)
+except:
+  print('bad arguments - specify [-rebuild] [-days n]')
+  sys.exit(1)
+DbInit()
+if Rebuild:
+  DbExecute('rebuild', 'DELETE FROM battery_day; DELETE FROM battery_mark;')
+  Print('rebuilding battery summaries')
+try:
+  DbConnection = storage.Connect()
+  DbCursor = DbConnection.cursor()
+  DbCursor.execute('SELECT epoch FROM battery_mark WHERE id = 0')
+  Row = DbCursor.fetchone()
+  Mark = Row['epoch'] if Row else 0
+  First = DayStart(Mark) if Mark else 0
+  DbCursor.execute(
+    'SELECT * FROM battery_day WHERE day < %d ORDER BY day DESC LIMIT %d' % (
+      DayKey(First) if First else 0, TREND_DAYS))
+  History = collections.deque(reversed(DbCursor.fetchall()), maxlen=TREND_DAYS)
+  Print('summarizing from %s' % (LocalTimeStr(First) if First else 'the first epoch'))
+  EpochCursor = DbConnection.cursor('battery_epochs')
+  EpochCursor.itersize = FETCH_ROWS
+  EpochCursor.execute(
+    'SELECT id, power_volt FROM epoch WHERE id >= %d AND power_volt > %f ORDER BY id' % (
+      First, VOLT_MIN))
+  Day = None
+  Days = Readings = 0
+  for Epoch, Volt in EpochCursor:
+    if Day is None or Epoch >= Day['end']:
+      if Day is not None:
+        DayStore(DbCursor, Day, History, True)
+        Days += 1
+      Day = DayNew(Epoch)
+    DayAdd(Day, Epoch, Volt)
+    Readings += 1
+    Mark = Epoch
+  EpochCursor.close()
+  if Day is not None:
+    DayStore(DbCursor, Day, History, False)
+    Days += 1
+  DbCursor.execute(
+    'INSERT INTO battery_mark (id, epoch) VALUES (0, %d) '
+    'ON CONFLICT (id) DO UPDATE SET epoch = EXCLUDED.epoch' % (Mark))
+  DbConnection.commit()
+  Print('  summarized %d readings into %d days' % (Readings, Days))
+  print()
+  DbCursor.execute('SELECT * FROM battery_day ORDER BY day DESC LIMIT %d' % (DaysShow))
+  print('     Day    Min    Max  Night V/h  Recovery  Flags')
+  for Row in reversed(DbCursor.fetchall()):
+    print('%8d  %5.2f  %5.2f  %9s  %8s  %s' % (
+      Row['day'], Row['volt_min'], Row['volt_max'],
+      '%+.3f' % (Row['discharge_vph']) if Row['discharge_vph'] is not None else '-',
+      '%dm' % (Row['recovery_min']) if Row['recovery_min'] is not None else '-',
+      FlagStr(Row['flags'])))
+  print()
+  DbConnection.close()
+except storage.Error as er:
+  Print('db error: %s' % (er.message))
+  sys.exit(1)
+Print('done')
+print()
+
+#==============================================================================
+# end
+#==============================================================================
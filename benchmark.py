@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+PROGRAM = 'benchmark.py'
+VERSION = '2.610.192'
+CONTACT = 'bright.tiger@mail.com' # michael nagy
+
+#==============================================================================
+# time the batch scripts against synthetic history of a month, a year
+# and ten years (see generate.py), and compare with a stored baseline:
+#
+#   benchmark.py [-sizes month,year,decade] [-url pattern] [-keep] [-save]
+#
+# the url pattern names a scratch database for each size, with %s for
+# the size.  it defaults to sqlite files in /tmp.  for postgresql give
+# something like postgresql:dbname=weather_bench_%s, after a createdb for
+# each size.  each size is generated afresh unless -keep is given and
+# its database already has rows.  either way the tables the scripts
+# derive from the epochs are dropped first, so every run starts from
+# the same place.
+#
+# every step runs a script as its own process against the scratch
+# database, and we record its wall time, its rate in epoch rows per
+# second and its peak resident memory.  condense.py runs twice, once to
+# condense all of history and once more to see the cost of a routine
+# run with nothing new.  backfill.py needs a weatherbox3 to talk to, so
+# it isn't run here.  the scripts write their permanent log as usual,
+# so /home/pi/weather has to exist.
+#
+# the steps run profiled (see RunStart in metrics.py), and the slowest
+# PHASES of each are listed under it, from the summary the script adds
+# to runs.jsonl, so a slower step can be traced to the phase that got
+# slower.  step times include the profiler's overhead, in the baseline
+# as in every run.  generate.py and battery.py have no phases.
+#
+# results are compared with BASELINE_FILE, and anything slower or
+# bigger than the baseline by more than TOLERANCE is flagged as a
+# regression, which also sets our exit status.  a step has to be slower
+# by TOLERANCE_SECS as well, so the jitter in short steps doesn't
+# count.  -save stores this run's results as the new baseline for the
+# sizes it ran.
+#==============================================================================
+
+import json, os, subprocess, sys, tempfile, time, storage
+
+SIZES = (('month', 30), ('year', 365), ('decade', 3652))
+
+URL_PATTERN = 'sqlite:/tmp/weather-bench-%s.db'
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark-baseline.json')
+
+TOLERANCE      = 0.25
+TOLERANCE_SECS = 0.5
+
+GENERATE_END  = '2026-10-01' # a fixed end keeps the data the same from run to run
+GENERATE_SEED = 1
+
+PHASES = 5 # slowest phases shown per step
+
+DERIVED = ('quarter', 'quarter_version', 'quarter_stats', 'quarter_gap', 'battery_day', 'battery_mark')
+
+#----------------------------------------------------------------------
+# the steps, each a script and its arguments.  weather-plot.py renders
+# the last four weeks a week at a time, then all of history at once.
+#----------------------------------------------------------------------
+
+def Steps(Last, Quarters):
+  return (
+    ('condense'      , ['condense.py', '-y']),
+    ('condense again', ['condense.py', '-y']),
+    ('summary'       , ['summary.py']),
+    ('summary verify', ['summary.py', '-v']),
+    ('battery'       , ['battery.py']),
+    ('voltage'       , ['voltage.py', '-png', 'voltage.png']),
+    ('weather-plot'  , ['weather-plot.py', '-batch',
+      '%d:%d/%d' % (Last - 2688, 2688, 672), '%d:%d' % (Last - Quarters, Quarters)]),
+  )
+
+#----------------------------------------------------------------------
+# run one script to completion, returning its wall time, peak resident
+# memory in mb, exit status (minus the signal if one killed it) and the
+# seconds of each phase it timed.  its output goes to a log file.
+#----------------------------------------------------------------------
+
+Here = os.path.dirname(os.path.abspath(__file__))
+
+def Phases(RunsFile, Seen):
+  if not os.path.exists(RunsFile):
+    return {}
+  with open(RunsFile) as f:
+    Lines = f.readlines()
+  if len(Lines) <= Seen:
+    return {}
+  return dict((Name, Phase['secs']) for Name, Phase in json.loads(Lines[-1])['phases'].items())
+
+def Run(Command, Url, WorkDir, Log):
+  Env = dict(os.environ)
+  Env['WEATHER_DB'] = Url
+  Env['WEATHER_PROFILE'] = os.path.join(WorkDir, 'profile')
+  RunsFile = os.path.join(Env['WEATHER_PROFILE'], 'runs.jsonl')
+  Seen = len(open(RunsFile).readlines()) if os.path.exists(RunsFile) else 0
+  Start = time.time()
+  Process = subprocess.Popen([sys.executable, os.path.join(Here, Command[0])] + Command[1:],
+    cwd=WorkDir, env=Env, stdout=Log, stderr=subprocess.STDOUT)
+  Pid, Status, Usage = os.wait4(Process.pid, 0)
+  Secs = time.time() - Start
+  if os.WIFSIGNALED(Status):
+    Status = -os.WTERMSIG(Status)
+  else:
+    Status = os.WEXITSTATUS(Status)
+  return Secs, Usage.ru_maxrss / 1024.0, Status, Phases(RunsFile, Seen)
+
+def EpochRows(Url):
+  try:
+    Db = storage.Connect(Url)
+    Cursor = Db.cursor()
+    Cursor.execute('SELECT count(*) AS count, max(id) AS max FROM epoch')
+    Row = Cursor.fetchone()
+    Db.close()
+    return Row['count'], Row['max']
+  except storage.Error:
+    return 0, None
+
+def Reset(Url, Tables):
+  Db = storage.Connect(Url)
+  Cursor = Db.cursor()
+  for Table in Tables:
+    Cursor.execute('DROP TABLE IF EXISTS %s' % (Table))
+  Db.commit()
+  Db.close()
+
+#----------------------------------------------------------------------
+# compare one result with the baseline
+#----------------------------------------------------------------------
+
+def Compare(Result, Base):
+  if not Base:
+    return ''
+  Notes = []
+  for Name, Label, Slack in (('secs', 'time', TOLERANCE_SECS), ('rss', 'rss', 0.0)):
+    if Name not in Base:
+      continue
+    Change = Result[Name] / max(Base[Name], 0.001) - 1.0
+    Flag = ' REGRESSION' if Change > TOLERANCE and Result[Name] - Base[Name] > Slack else ''
+    Notes.append('%s %+4.0f%%%s' % (Label, 100.0 * Change, Flag))
+  return '  '.join(Notes)
+
+#----------------------------------------------------------------------
+# main
+#----------------------------------------------------------------------
+
+print()
+print('%s %s' % (PROGRAM, VERSION))
+print()
+Sizes = [Name for Name, Days in SIZES]
+Pattern = URL_PATTERN
+Keep = False
+Save = False
+try:
+  Args = sys.argv[1:]
+  while Args:
+    Arg = Args.pop(0).lower()
+    if Arg.startswith('-si'):
+      Sizes = Args.pop(0).lower().split(',')
+      if set(Sizes) - set(dict(SIZES)):
+        raise ValueError(Sizes)
+    elif Arg.startswith('-u'):
+      Pattern = Args.pop(0)
+      storage.ParseUrl(Pattern % ('month'))
+    elif Arg.startswith('-k'):
+      Keep = True
+    elif Arg.startswith('-sa'):
+      Save = True
+    else:
+      raise ValueError(Arg)
+except:
+  print('bad arguments - specify [-sizes month,year,decade] [-url pattern] [-keep] [-save]')
+  print()
+  sys.exit(1)
+
+Baseline = {}
+if os.path.exists(BASELINE_FILE):
+  with open(BASELINE_FILE) as f:
+    Baseline = json.load(f)
+
+WorkDir = tempfile.mkdtemp(prefix='weather-bench-')
+Log = open(os.path.join(WorkDir, 'benchmark.log'), 'w')
+Regressions = 0
+Failures = 0
+
+def Step(Name, Command, Url, Base, Results):
+  global Regressions, Failures
+  Secs, Rss, Status, Phase = Run(Command, Url, WorkDir, Log)
+  if Status:
+    print('  %-16s failed, status %d, see %s' % (Name, Status, Log.name))
+    Failures += 1
+    return
+  Rows, Last = EpochRows(Url)
+  Results[Name] = {'secs': Secs, 'rss': Rss, 'phases': Phase}
+  Note = Compare(Results[Name], Base.get(Name))
+  Regressions += Note.count('REGRESSION')
+  print('  %-16s %8.2f %12.0f %8.1f  %s' % (Name, Secs, Rows / max(Secs, 0.001), Rss, Note))
+  BasePhase = Base.get(Name, {}).get('phases', {})
+  for Phase, PhaseSecs in sorted(Phase.items(), key=lambda Item: -Item[1])[:PHASES]:
+    Note = Compare({'secs': PhaseSecs}, {'secs': BasePhase[Phase]} if Phase in BasePhase else None)
+    Regressions += Note.count('REGRESSION')
+    print('    %-30s %8.2f  %s' % (Phase[:30], PhaseSecs, Note))
+
+for Size in Sizes:
+  Url = Pattern % (Size)
+  Days = dict(SIZES)[Size]
+  Key = '%s %s' % (storage.ParseUrl(Url)[0], Size)
+  Base = Baseline.get(Key, {})
+  Results = {}
+  print('%s, %s' % (Key, Url))
+  print()
+  print('  %-16s %8s %12s %8s' % ('step', 'secs', 'rows/s', 'rss mb'))
+  if Keep and EpochRows(Url)[0]:
+    Reset(Url, DERIVED)
+  else:
+    Reset(Url, ('epoch',) + DERIVED)
+    Step('generate', ['generate.py', '-to', Url, '-days', str(Days),
+      '-end', GENERATE_END, '-seed', str(GENERATE_SEED)], Url, Base, Results)
+  Rows, Last = EpochRows(Url)
+  if Rows:
+    for Name, Command in Steps(Last // 900, Days * 96):
+      Step(Name, Command, Url, Base, Results)
+  else:
+    print('  no rows to work with')
+    Failures += 1
+  print()
+  if Save and Results:
+    Baseline[Key] = Results
+Log.close()
+
+if Save:
+  with open(BASELINE_FILE, 'w') as f:
+    json.dump(Baseline, f, indent=2, sort_keys=True)
+  print('baseline saved to %s' % (BASELINE_FILE))
+  print()
+if Regressions or Failures:
+  print('%d regressions, %d failures' % (Regressions, Failures))
+  print()
+  sys.exit(1)
+
+#==============================================================================
+# end
+#==============================================================================
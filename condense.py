@@ -3,7 +3,7 @@
 from __future__ import print_function
 
 PROGRAM = 'condense.py'
-VERSION = '1.811.281'
+VERSION = '2.610.198'
 CONTACT = 'bright.tiger@mail.com' # michael nagy
 
 #==============================================================================
@@ -12,7 +12,8 @@ CONTACT = 'bright.tiger@mail.com' # michael nagy
 # aggregated.
 #==============================================================================
 
-import os, sys, psycopg2, psycopg2.extras, time
+import sys, time, storage, metrics
+from observation import Observation, CreateSql, InsertSql, ColumnTypes, QuarterStatsSql
 
 #----------------------------------------------------------------------
 # the standard utc and local time string format we use throughout
@@ -41,45 +42,227 @@ def Print(Text):
   PermaLog(Text.strip())
 
 #----------------------------------------------------------------------
-# database support.  we are currently using postgresql, but with minor
-# modifications to this single block of code we could alternately run
-# with sqlite3 or possibly other database engines.
+# database support.  postgresql or sqlite, as configured by WEATHER_DB
+# (see storage.py).  the quarter triggers below come in both dialects.
 #----------------------------------------------------------------------
 
 def DbExecute(Note, Sql):
   try:
-    db = psycopg2.connect('dbname=weather')
+    db = storage.Connect()
     cursor = db.cursor()
     cursor.execute(Sql)
     db.commit()
     db.close()
-  except psycopg2.Error as er:
+  except storage.Error as er:
     Print('db %s error: %s' % (Note, er.message))
-    os._exit(1)
+    sys.exit(1)
 
 def DbInit():
-  sql = 'CREATE TABLE IF NOT EXISTS quarter ('
-  sql += 'id             INT PRIMARY KEY,'
-  sql += 'boot_count     INT ,' # consolidated, maximum
-  sql += 'uptime_minutes INT ,' # consolidated, maximum
-  sql += 'temp_f         REAL,' # consolidated, average
-  sql += 'dewpoint_f     REAL,' # consolidated, average
-  sql += 'humidity_pct   INT ,' # consolidated, average
-  sql += 'pressure_inhg  REAL,' # consolidated, average
-  sql += 'wind_mph       INT ,' # consolidated, maximum
-  sql += 'wind_direction REAL,' # consolidated, final
-  sql += 'rain_in        REAL,' # consolidated, maximum
-  sql += 'rain_day_in    REAL,' # consolidated, maximum
-  sql += 'power_volt     REAL,' # consolidated, maximum
-  sql += 'tau_status     INT ,' # consolidated, maximum
-  sql += 'tau_queries    INT ,' # consolidated, maximum
-  sql += 'tau_replies    INT ,' # consolidated, maximum
-  sql += 'log_next       INT ,' # consolidated, maximum
-  sql += 'log_full       INT ,' # consolidated, maximum
-  sql += 'reported_mask  INT ,' # consolidated, bitwise or
-  sql += 'log_mask       INT ,' # log data needed or missing
-  sql += 'epochs         INT)'  # number of epoch records consolidated
-  DbExecute('init', sql)
+  DbExecute('init', CreateSql('quarter'))
+  QuarterExpectedInit()
+  QuarterVersionInit()
+  QuarterStatsInit()
+
+#----------------------------------------------------------------------
+# a quarter holds as many epochs as the logger's cadence allows, 15 at
+# the usual minute, but as few as 5 when it's calm and as many as 30
+# when it's active (see LOOP_TIME_MIN and LOOP_TIME_MAX in
+# proxy-logger.py).  each epoch records the cadence it was polled at,
+# and each quarter how many epochs that cadence should have given it.
+# a quarter is missing data when it is more than EPOCHS_SLACK epochs
+# short of that.  epochs from before the cadence was recorded count as
+# EPOCH_SECS apart.
+#----------------------------------------------------------------------
+
+EPOCH_SECS   = 60
+EPOCHS_SLACK = 2
+
+def Expected(Rows):
+  Secs = [Row['loop_secs'] or EPOCH_SECS for Row in Rows] or [EPOCH_SECS]
+  return max(1, int(round(900.0 * len(Secs) / sum(Secs))))
+
+def MissingData(Row):
+  return Row['epochs'] < Row['expected'] - EPOCHS_SLACK
+
+#----------------------------------------------------------------------
+# quarters condensed before they knew what to expect get a minute's
+# worth.  the running statistics below are kept by expected epochs as
+# well, so the old ones and their triggers are dropped first, to be
+# rebuilt.
+#----------------------------------------------------------------------
+
+def QuarterExpectedInit():
+  try:
+    db = storage.Connect()
+    cursor = db.cursor()
+    storage.AddColumns(cursor, 'quarter', ColumnTypes('quarter'))
+    db.commit()
+    cursor.execute('SELECT count(*) FROM quarter WHERE expected IS NULL')
+    Unknown = cursor.fetchone()[0]
+    db.close()
+  except storage.Error as er:
+    Print('db expected error: %s' % (er.message))
+    sys.exit(1)
+  if Unknown:
+    if storage.Backend == 'sqlite':
+      sql = ''.join(['DROP TRIGGER IF EXISTS quarter_stats_%s;' % (Op) for Op in ('insert', 'update', 'delete')])
+    else:
+      sql = 'DROP TRIGGER IF EXISTS quarter_stats_update ON quarter;'
+    sql += 'DROP TABLE IF EXISTS quarter_stats;'
+    sql += 'UPDATE quarter SET expected = %d WHERE expected IS NULL;' % (900 // EPOCH_SECS)
+    DbExecute('expected', sql)
+    Print('%d quarters now expect %d epochs' % (Unknown, 900 // EPOCH_SECS))
+
+#----------------------------------------------------------------------
+# keep a per-day version counter for the quarter table.  every insert,
+# update or delete of a quarter bumps the counter for its (utc) day,
+# whichever script does it, so readers such as the weather-plot.py
+# render cache can tell cheaply whether a range of quarters changed.
+#----------------------------------------------------------------------
+
+def QuarterVersionInit():
+  sql = 'CREATE TABLE IF NOT EXISTS quarter_version ('
+  sql += 'day            INT PRIMARY KEY,' # quarter id / 96
+  sql += 'version        INT NOT NULL);'
+  if storage.Backend == 'sqlite':
+    for Op, Row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+      sql += 'CREATE TRIGGER IF NOT EXISTS quarter_version_%s AFTER %s ON quarter BEGIN ' % (Op.lower(), Op)
+      sql += '  INSERT INTO quarter_version (day, version) VALUES (%s.id / 96, 1) ' % (Row)
+      sql += '    ON CONFLICT (day) DO UPDATE SET version = version + 1; '
+      sql += 'END;'
+  else:
+    sql += 'CREATE OR REPLACE FUNCTION quarter_version_bump() RETURNS trigger AS $$ '
+    sql += 'DECLARE quarter_day INT; '
+    sql += 'BEGIN '
+    sql += '  IF TG_OP = \'DELETE\' THEN quarter_day := OLD.id / 96; '
+    sql += '  ELSE quarter_day := NEW.id / 96; END IF; '
+    sql += '  INSERT INTO quarter_version (day, version) VALUES (quarter_day, 1) '
+    sql += '    ON CONFLICT (day) DO UPDATE SET version = quarter_version.version + 1; '
+    sql += '  RETURN NULL; '
+    sql += 'END $$ LANGUAGE plpgsql;'
+    sql += 'DROP TRIGGER IF EXISTS quarter_version_bump ON quarter;'
+    sql += 'CREATE TRIGGER quarter_version_bump AFTER INSERT OR UPDATE OR DELETE ON quarter '
+    sql += 'FOR EACH ROW EXECUTE PROCEDURE quarter_version_bump();'
+  DbExecute('version', sql)
+
+#----------------------------------------------------------------------
+# keep running statistics for summary.py, so that it doesn't have to
+# scan all of history: quarter_stats holds the number of quarters for
+# each count of epochs and of epochs expected, and how many of those
+# were reported to each service, and quarter_gap holds the runs of
+# consecutive quarters with no epochs.  a trigger on the quarter table
+# keeps both current as this script condenses quarters and backfill.py
+# fills them in or reports them.  the tables are built from scratch
+# when quarter_stats is empty (see QuarterStatsSql in observation.py),
+# and summary.py can verify them against a full scan and rebuild them
+# on request.
+#
+# sqlite triggers are plain statement lists, with no variables or
+# branches, so there the gap runs are merged and split with updates
+# guarded by the row's epochs instead.
+#----------------------------------------------------------------------
+
+def QuarterStatsInit():
+  sql = 'CREATE TABLE IF NOT EXISTS quarter_stats ('
+  sql += 'epochs         INT NOT NULL,'
+  sql += 'expected       INT NOT NULL,'
+  sql += 'quarters       INT NOT NULL,' # quarters with this many epochs, of that many expected
+  sql += 'wu             INT NOT NULL,' # of which reported to weather underground
+  sql += 'ps             INT NOT NULL,' # of which reported to aeris
+  sql += 'PRIMARY KEY (epochs, expected));'
+  sql += 'CREATE TABLE IF NOT EXISTS quarter_gap ('
+  sql += 'first          INT PRIMARY KEY,' # first quarter of a run with no epochs
+  sql += 'last           INT NOT NULL);' # last quarter of the run
+  if storage.Backend == 'sqlite':
+    for Op in ('INSERT', 'UPDATE', 'DELETE'):
+      sql += 'DROP TRIGGER IF EXISTS quarter_stats_%s;' % (Op.lower())
+      sql += 'CREATE TRIGGER quarter_stats_%s AFTER %s ON quarter BEGIN ' % (Op.lower(), Op)
+      if Op != 'INSERT':
+        sql += QuarterStatsSqlite('OLD', -1)
+      if Op != 'DELETE':
+        sql += QuarterStatsSqlite('NEW', 1)
+      sql += 'END;'
+  else:
+    sql += 'DROP FUNCTION IF EXISTS quarter_stats_count(INT, INT, INT);'
+    sql += 'CREATE OR REPLACE FUNCTION quarter_stats_count(quarter_epochs INT, quarter_expected INT, '
+    sql += '  quarter_mask INT, delta INT) '
+    sql += 'RETURNS void AS $$ '
+    sql += 'BEGIN '
+    sql += '  INSERT INTO quarter_stats (epochs, expected, quarters, wu, ps) '
+    sql += '    VALUES (quarter_epochs, quarter_expected, delta, '
+    sql += '    CASE WHEN quarter_mask & 1 <> 0 THEN delta ELSE 0 END, '
+    sql += '    CASE WHEN quarter_mask & 2 <> 0 THEN delta ELSE 0 END) '
+    sql += '  ON CONFLICT (epochs, expected) DO UPDATE SET '
+    sql += '    quarters = quarter_stats.quarters + EXCLUDED.quarters, '
+    sql += '    wu = quarter_stats.wu + EXCLUDED.wu, '
+    sql += '    ps = quarter_stats.ps + EXCLUDED.ps; '
+    sql += 'END $$ LANGUAGE plpgsql;'
+    sql += 'CREATE OR REPLACE FUNCTION quarter_gap_open(quarter_id INT) RETURNS void AS $$ '
+    sql += 'DECLARE gap_first INT; gap_last INT; '
+    sql += 'BEGIN '
+    sql += '  DELETE FROM quarter_gap WHERE last = quarter_id - 1 RETURNING first INTO gap_first; '
+    sql += '  DELETE FROM quarter_gap WHERE first = quarter_id + 1 RETURNING last INTO gap_last; '
+    sql += '  INSERT INTO quarter_gap (first, last) '
+    sql += '    VALUES (coalesce(gap_first, quarter_id), coalesce(gap_last, quarter_id)); '
+    sql += 'END $$ LANGUAGE plpgsql;'
+    sql += 'CREATE OR REPLACE FUNCTION quarter_gap_close(quarter_id INT) RETURNS void AS $$ '
+    sql += 'DECLARE gap_first INT; gap_last INT; '
+    sql += 'BEGIN '
+    sql += '  DELETE FROM quarter_gap WHERE first <= quarter_id AND last >= quarter_id '
+    sql += '    RETURNING first, last INTO gap_first, gap_last; '
+    sql += '  IF gap_first < quarter_id THEN '
+    sql += '    INSERT INTO quarter_gap (first, last) VALUES (gap_first, quarter_id - 1); '
+    sql += '  END IF; '
+    sql += '  IF gap_last > quarter_id THEN '
+    sql += '    INSERT INTO quarter_gap (first, last) VALUES (quarter_id + 1, gap_last); '
+    sql += '  END IF; '
+    sql += 'END $$ LANGUAGE plpgsql;'
+    sql += 'CREATE OR REPLACE FUNCTION quarter_stats_update() RETURNS trigger AS $$ '
+    sql += 'BEGIN '
+    sql += '  IF TG_OP <> \'INSERT\' THEN '
+    sql += '    PERFORM quarter_stats_count(OLD.epochs, OLD.expected, OLD.reported_mask, -1); '
+    sql += '    IF OLD.epochs = 0 THEN PERFORM quarter_gap_close(OLD.id); END IF; '
+    sql += '  END IF; '
+    sql += '  IF TG_OP <> \'DELETE\' THEN '
+    sql += '    PERFORM quarter_stats_count(NEW.epochs, NEW.expected, NEW.reported_mask, 1); '
+    sql += '    IF NEW.epochs = 0 THEN PERFORM quarter_gap_open(NEW.id); END IF; '
+    sql += '  END IF; '
+    sql += '  RETURN NULL; '
+    sql += 'END $$ LANGUAGE plpgsql;'
+    sql += 'DROP FUNCTION IF EXISTS quarter_stats_rebuild();'
+    sql += 'DROP TRIGGER IF EXISTS quarter_stats_update ON quarter;'
+    sql += 'CREATE TRIGGER quarter_stats_update AFTER INSERT OR UPDATE OR DELETE ON quarter '
+    sql += 'FOR EACH ROW EXECUTE PROCEDURE quarter_stats_update();'
+  sql += QuarterStatsSql()
+  DbExecute('stats', sql)
+
+def QuarterStatsSqlite(Row, Delta):
+  Quarter = '%s.id' % (Row)
+  Empty = '%s.epochs = 0' % (Row)
+  sql = 'INSERT INTO quarter_stats (epochs, expected, quarters, wu, ps) '
+  sql += '  VALUES (%s.epochs, %s.expected, %d, ' % (Row, Row, Delta)
+  sql += '  CASE WHEN %s.reported_mask & 1 <> 0 THEN %d ELSE 0 END, ' % (Row, Delta)
+  sql += '  CASE WHEN %s.reported_mask & 2 <> 0 THEN %d ELSE 0 END) ' % (Row, Delta)
+  sql += '  ON CONFLICT (epochs, expected) DO UPDATE SET '
+  sql += '    quarters = quarters + excluded.quarters, wu = wu + excluded.wu, ps = ps + excluded.ps; '
+  if Delta < 0:
+    # close: split the run holding this quarter around it
+    sql += 'INSERT INTO quarter_gap (first, last) SELECT %s + 1, last FROM quarter_gap ' % (Quarter)
+    sql += '  WHERE %s AND first <= %s AND last > %s; ' % (Empty, Quarter, Quarter)
+    sql += 'UPDATE quarter_gap SET last = %s - 1 ' % (Quarter)
+    sql += '  WHERE %s AND first < %s AND last >= %s; ' % (Empty, Quarter, Quarter)
+    sql += 'DELETE FROM quarter_gap WHERE %s AND first = %s; ' % (Empty, Quarter)
+  else:
+    # open: extend the run ending just before this quarter, or start a
+    # new one, through the run starting just after it
+    After = 'coalesce((SELECT g.last FROM quarter_gap g WHERE g.first = %s + 1), %s)' % (Quarter, Quarter)
+    sql += 'UPDATE quarter_gap SET last = %s ' % (After)
+    sql += '  WHERE %s AND last = %s - 1; ' % (Empty, Quarter)
+    sql += 'INSERT INTO quarter_gap (first, last) SELECT %s, %s ' % (Quarter, After)
+    sql += '  WHERE %s AND NOT EXISTS ' % (Empty)
+    sql += '  (SELECT 1 FROM quarter_gap WHERE first <= %s AND last >= %s); ' % (Quarter, Quarter)
+    sql += 'DELETE FROM quarter_gap WHERE %s AND first = %s + 1; ' % (Empty, Quarter)
+  return sql
 
 #----------------------------------------------------------------------
 # given a unix epoch value in seconds, return a quarter value, which
@@ -100,12 +283,16 @@ def QuarterToEpoch(Quarter):
 # the quarter was previously condensed. 
 #----------------------------------------------------------------------
 
+QuarterInsertSql = InsertSql('quarter')
+
 def CondenseQuarter(DbCursor, Quarter, OldEpochs=-1):
   EpochMin = QuarterToEpoch(Quarter  )
   EpochMax = QuarterToEpoch(Quarter+1)-1
   DbCursor.execute(
     'SELECT * FROM epoch WHERE id BETWEEN %d AND %d' % (EpochMin, EpochMax))
-  if DbCursor.rowcount > OldEpochs:
+  Rows = DbCursor.fetchall()
+  if len(Rows) > OldEpochs:
+    Start = time.time()
     BootCount     = 0
     UptimeMinutes = 0
     TempF         = 0.0
@@ -125,7 +312,7 @@ def CondenseQuarter(DbCursor, Quarter, OldEpochs=-1):
     ReportedMask  = 0
     LogMask       = 0
     Epochs        = 0
-    for Row in DbCursor.fetchall():
+    for Row in Rows:
       BootCount     = max(BootCount    , Row['boot_count'    ])
       UptimeMinutes = max(UptimeMinutes, Row['uptime_minutes'])
       TempF        +=                    Row['temp_f'        ]
@@ -144,58 +331,41 @@ def CondenseQuarter(DbCursor, Quarter, OldEpochs=-1):
       LogFull       = max(LogFull      , Row['log_full'      ])
       ReportedMask |=                    Row['reported_mask' ]
       Epochs       += 1
+    Expect = Expected(Rows)
     if Epochs:
       TempF        /= Epochs
       DewpointF    /= Epochs
       HumidityPct  /= Epochs
       PressureInhg /= Epochs
+    metrics.Timed('aggregate', Start)
     if OldEpochs > -1:
       Print('  recondense quarter %s from %d epoch records (was %d records)' % (LocalTimeStr(EpochMin), Epochs, OldEpochs))
       DbCursor.execute('DELETE FROM quarter WHERE id = %d' % (Quarter))
     else:
       Print('  condense quarter %s from %d epoch records' % (LocalTimeStr(EpochMin), Epochs))
-    sql = 'INSERT INTO quarter ('
-    sql += 'id,'
-    sql += 'boot_count,'
-    sql += 'uptime_minutes,'
-    sql += 'temp_f,'
-    sql += 'dewpoint_f,'
-    sql += 'humidity_pct,'
-    sql += 'pressure_inhg,'
-    sql += 'wind_mph,'
-    sql += 'wind_direction,'
-    sql += 'rain_in,'
-    sql += 'rain_day_in,'
-    sql += 'power_volt,'
-    sql += 'tau_status,'
-    sql += 'tau_queries,'
-    sql += 'tau_replies,'
-    sql += 'log_next,'
-    sql += 'log_full,'
-    sql += 'reported_mask,'
-    sql += 'log_mask,'
-    sql += 'epochs) VALUES ('
-    sql += '%d,'    % (Quarter      )
-    sql += '%d,'    % (BootCount    )
-    sql += '%d,'    % (UptimeMinutes)
-    sql += '%3.1f,' % (TempF        )
-    sql += '%3.1f,' % (DewpointF    )
-    sql += '%d,'    % (HumidityPct  )
-    sql += '%0.3f,' % (PressureInhg )
-    sql += '%d,'    % (WindMph      )
-    sql += '%1.0f,' % (WindDirection)
-    sql += '%4.2f,' % (RainIn       )
-    sql += '%4.2f,' % (RainDayIn    )
-    sql += '%6.3f,' % (PowerVolt    )
-    sql += '%d,'    % (TauStatus    )
-    sql += '%d,'    % (TauQueries   )
-    sql += '%d,'    % (TauReplies   )
-    sql += '%d,'    % (LogNext      )
-    sql += '%d,'    % (LogFull      )
-    sql += '%d,'    % (ReportedMask )
-    sql += '%d,'    % (LogMask      )
-    sql += '%d)'    % (Epochs       )
-    DbCursor.execute(sql)
+    Obs = Observation(
+      boot_count     = BootCount    ,
+      uptime_minutes = UptimeMinutes,
+      temp_f         = TempF        ,
+      dewpoint_f     = DewpointF    ,
+      humidity_pct   = HumidityPct  ,
+      pressure_inhg  = PressureInhg ,
+      wind_mph       = WindMph      ,
+      wind_direction = WindDirection,
+      rain_in        = RainIn       ,
+      rain_day_in    = RainDayIn    ,
+      power_volt     = PowerVolt    ,
+      tau_status     = TauStatus    ,
+      tau_queries    = TauQueries   ,
+      tau_replies    = TauReplies   ,
+      log_next       = LogNext      ,
+      log_full       = LogFull      ,
+      reported_mask  = ReportedMask ,
+      log_mask       = LogMask      ,
+      epochs         = Epochs       ,
+      expected       = Expect       ,
+    )
+    DbCursor.execute(QuarterInsertSql, Obs.Insert('quarter', Quarter))
     return True
   return False
 
@@ -210,19 +380,20 @@ def CondenseQuarter(DbCursor, Quarter, OldEpochs=-1):
 print()
 Print('%s %s' % (PROGRAM, VERSION))
 print()
+metrics.RunStart(PROGRAM, VERSION)
 AutoYes = False
 for arg in sys.argv:
   if arg.lower().startswith('-y'):
     AutoYes = True
 DbInit()
-DbConnection = psycopg2.connect('dbname=weather')
-DbCursor1 = DbConnection.cursor(cursor_factory=psycopg2.extras.DictCursor)
-DbCursor2 = DbConnection.cursor(cursor_factory=psycopg2.extras.DictCursor)
-DbCursor1.execute('SELECT min(id),max(id) from epoch')
+DbConnection = storage.Connect()
+DbCursor1 = DbConnection.cursor()
+DbCursor2 = DbConnection.cursor()
+DbCursor1.execute('SELECT min(id) AS min,max(id) AS max from epoch')
 Row1 = DbCursor1.fetchone()
 EpochMin = Row1['min']
 EpochMax = Row1['max']
-DbCursor1.execute('SELECT min(id),max(id) from quarter')
+DbCursor1.execute('SELECT min(id) AS min,max(id) AS max from quarter')
 Row1 = DbCursor1.fetchone()
 QuarterMin = Row1['min']
 QuarterMax = Row1['max']
@@ -240,6 +411,7 @@ Print('   %s' % (LocalTimeStr(QuarterToEpoch(QuarterMax))))
 print()
 Print('condensing quarters')
 print()
+Start = time.time()
 Quarter = NewQuarters = 0
 for Epoch in range(EpochMin, EpochMax+1):
   if Quarter != EpochToQuarter(Epoch):
@@ -248,6 +420,7 @@ for Epoch in range(EpochMin, EpochMax+1):
       CondenseQuarter(DbCursor1, Quarter)
       NewQuarters += 1
 DbConnection.commit()
+metrics.Timed('condense', Start)
 if NewQuarters:
   Print('  condensed %d new quarters' % (NewQuarters))
 else:
@@ -256,16 +429,18 @@ print()
 if AutoYes or raw_input("try to recondense quarters with missing data? (y/n): ").lower().strip()[:1] == "y":
   if not AutoYes:
     print()
+  Start = time.time()
   NoChange = Recondensed = 0
   DbCursor1.execute('SELECT * FROM quarter ORDER BY id ASC')
   for Row1 in DbCursor1.fetchall():
-    if Row1['epochs'] < 13:
+    if MissingData(Row1):
       if CondenseQuarter(DbCursor2, Row1['id'], Row1['epochs']):
         Recondensed += 1
       else:
         NoChange += 1
     else:
       NoChange += 1
+  metrics.Timed('recondense', Start)
   if Recondensed:
     print()
   Print('  recondensed %d quarters, %d quarters unchanged' % (Recondensed, NoChange))
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+PROGRAM = 'generate.py'
+VERSION = '2.610.192'
+CONTACT = 'bright.tiger@mail.com' # michael nagy
+
+#==============================================================================
+# fill a scratch database with synthetic epoch rows, as proxy-logger.py
+# would have logged them, so that the batch scripts can be measured
+# against years of history without waiting years for it:
+#
+#   generate.py -to url [-days n] [-end yyyy-mm-dd] [-seed n]
+#
+# the url is a storage url (see storage.py) and should name a scratch
+# database, never the live one.  the weather follows the seasons and
+# the time of day with some noise, storms bring rain, wind, pressure
+# drops and the odd tau alert, and the battery charges by day and
+# sags at night.  the trouble a real station has is thrown in at the
+# rates below: logger outages of minutes to hours (which leave quarters
+# short or missing for condense.py and backfill.py), weatherbox reboots
+# (boot count up, uptime back to zero), clock steps forward and back
+# (a step back loses the minutes that collide with ones already logged,
+# as the real insert would), and failed upstream reports.  the same
+# seed always generates the same rows.
+#==============================================================================
+
+import math, random, sys, time, storage
+from observation import Observation, CreateSql, ColumnTypes, InsertSql
+
+BATCH_ROWS = 5000
+
+#----------------------------------------------------------------------
+# trouble, in events per day
+#----------------------------------------------------------------------
+
+OUTAGE_RATE  = 0.05 # logger down, 10 minutes to 12 hours
+REBOOT_RATE  = 0.1  # weatherbox reboot
+CLOCK_RATE   = 0.02 # clock step of up to 10 minutes either way
+STORM_RATE   = 0.15 # storm of 1 to 6 hours
+REPORT_FAILS = 0.01 # chance that each upstream report fails
+
+LOG_SIZE = 8192 # wb3 log records, wrapping
+
+TAU_ALERT = 9
+
+#----------------------------------------------------------------------
+# the standard utc and local time string format we use throughout
+#----------------------------------------------------------------------
+
+TimePattern = '%Y-%m-%d %H:%M:%S'
+
+def LocalTimeStr(Epoch):
+  return time.strftime(TimePattern, time.localtime(Epoch))
+
+#----------------------------------------------------------------------
+# relative humidity from temperature and dew point (magnus formula)
+#----------------------------------------------------------------------
+
+def Celsius(Fahrenheit):
+  return (Fahrenheit - 32.0) / 1.8
+
+def Humidity(TempF, DewpointF):
+  Temp, Dewpoint = Celsius(TempF), Celsius(DewpointF)
+  return min(100.0, 100.0 * math.exp(
+    17.625 * Dewpoint / (243.04 + Dewpoint) - 17.625 * Temp / (243.04 + Temp)))
+
+#----------------------------------------------------------------------
+# generate the rows for one minute after another, yielding insert
+# parameters for each minute actually logged
+#----------------------------------------------------------------------
+
+def Minutes(First, Count, Rand):
+  PerMinute = 1.0 / 1440
+  Pressure  = 30.0
+  Direction = 180.0
+  Noise     = 0.0
+  Storm     = 0
+  Outage    = 0
+  Clock     = 0
+  BootCount = 1
+  Uptime    = 0
+  LogNext   = 0
+  LogFull   = 0
+  RainHour  = []
+  RainDay   = 0.0
+  LastId    = 0
+  for Minute in range(Count):
+    Epoch = First + Minute * 60
+    Local = time.localtime(Epoch)
+    if Local.tm_hour == 0 and Local.tm_min == 0:
+      RainDay = 0.0
+    Uptime += 1
+    if Rand.random() < REBOOT_RATE * PerMinute:
+      BootCount += 1
+      Uptime = 0
+    if Rand.random() < CLOCK_RATE * PerMinute:
+      Clock += Rand.randint(-600, 600)
+    if not Storm and Rand.random() < STORM_RATE * PerMinute:
+      Storm = Rand.randint(60, 360)
+    Season  = math.cos(2 * math.pi * (Local.tm_yday - 200) / 365.0)
+    Diurnal = math.cos(2 * math.pi * (Local.tm_hour * 60 + Local.tm_min - 900) / 1440.0)
+    Noise = 0.98 * Noise + Rand.gauss(0, 0.15)
+    Pressure += Rand.gauss(0, 0.0005) + (30.0 - Pressure) * 0.0005
+    Wind = abs(Rand.gauss(0, 4))
+    Rain = 0.0
+    Tau = 1
+    if Storm:
+      Storm -= 1
+      Pressure -= 0.0004
+      Wind += Rand.uniform(5, 25)
+      if Rand.random() < 0.4:
+        Rain = Rand.choice((0.01, 0.01, 0.02, 0.03))
+      if Rand.random() < 0.01:
+        Tau = TAU_ALERT
+    Direction = (Direction + Rand.choice((-22.5, 0, 0, 0, 22.5))) % 360
+    TempF = 72.0 + 12.0 * Season + 9.0 * Diurnal + Noise - (6.0 if Storm else 0.0)
+    DewpointF = min(TempF, 58.0 + 10.0 * Season + Noise + (8.0 if Storm else 0.0))
+    RainHour = (RainHour + [Rain])[-60:]
+    RainDay += Rain
+    Sun = max(0.0, math.cos(2 * math.pi * (Local.tm_hour * 60 + Local.tm_min - 720) / 1440.0))
+    Volt = 12.2 + 1.4 * Sun + 0.2 * Season + Rand.gauss(0, 0.02)
+    LogNext += 1
+    if LogNext == LOG_SIZE:
+      LogNext, LogFull = 0, 1
+    if Outage or Rand.random() < OUTAGE_RATE * PerMinute:
+      Outage = (Outage or Rand.randint(10, 720)) - 1
+      continue
+    Id = Epoch + Clock + Rand.randint(0, 5)
+    if Id <= LastId:
+      continue # collides with a minute already logged
+    LastId = Id
+    ReportedMask = 0
+    for Mask in (1, 2):
+      if Rand.random() >= REPORT_FAILS:
+        ReportedMask |= Mask
+    Obs = Observation(
+      boot_count     = BootCount                   ,
+      uptime_minutes = Uptime                      ,
+      temp_f         = TempF                       ,
+      dewpoint_f     = DewpointF                   ,
+      humidity_pct   = Humidity(TempF, DewpointF)  ,
+      pressure_inhg  = Pressure                    ,
+      wind_mph       = Wind                        ,
+      wind_direction = Direction                   ,
+      rain_in        = sum(RainHour)               ,
+      rain_day_in    = RainDay                     ,
+      power_volt     = Volt                        ,
+      tau_status     = Tau                         ,
+      tau_queries    = Uptime                      ,
+      tau_replies    = Uptime                      ,
+      log_next       = LogNext                     ,
+      log_full       = LogFull                     ,
+      reported_mask  = ReportedMask                ,
+      temp_min_f     = TempF - abs(Rand.gauss(0, 0.2)),
+      temp_max_f     = TempF + abs(Rand.gauss(0, 0.2)),
+      wind_gust_mph  = Wind + abs(Rand.gauss(0, 3)),
+      samples        = 1                           ,
+    )
+    yield Obs.Insert('epoch', Id)
+
+#----------------------------------------------------------------------
+# main
+#----------------------------------------------------------------------
+
+print()
+print('%s %s' % (PROGRAM, VERSION))
+print()
+Url  = None
+Days = 30
+End  = time.time()
+Seed = 1
+try:
+  Args = sys.argv[1:]
+  while Args:
+    Arg = Args.pop(0).lower()
+    if Arg.startswith('-t'):
+      Url = Args.pop(0)
+    elif Arg.startswith('-d'):
+      Days = int(Args.pop(0))
+    elif Arg.startswith('-e'):
+      End = time.mktime(time.strptime(Args.pop(0), '%Y-%m-%d'))
+    elif Arg.startswith('-s'):
+      Seed = int(Args.pop(0))
+    else:
+      raise ValueError(Arg)
+  storage.ParseUrl(Url)
+except:
+  print('bad arguments - specify -to url [-days n] [-end yyyy-mm-dd] [-seed n]')
+  print()
+  sys.exit(1)
+Count = Days * 1440
+First = int(End) // 60 * 60 - Count * 60
+print('generating %d days from %s into %s' % (Days, LocalTimeStr(First), Url))
+print()
+try:
+  Db = storage.Connect(Url)
+  Cursor = Db.cursor()
+  Cursor.execute(CreateSql('epoch'))
+  storage.AddColumns(Cursor, 'epoch', ColumnTypes('epoch'), Url)
+  Cursor.execute('DELETE FROM epoch WHERE id >= %d' % (First - 600))
+  Db.commit()
+  Sql = InsertSql('epoch')
+  Start = time.time()
+  Rows = 0
+  Batch = []
+  for Params in Minutes(First, Count, random.Random(Seed)):
+    Batch.append(Params)
+    if len(Batch) == BATCH_ROWS:
+      Cursor.executemany(Sql, Batch)
+      Db.commit()
+      Rows += len(Batch)
+      Batch = []
+      print('  %d rows through %s' % (Rows, LocalTimeStr(Params[0])))
+  Cursor.executemany(Sql, Batch)
+  Db.commit()
+  Rows += len(Batch)
+  Db.close()
+except storage.Error as er:
+  print('db error: %s' % (er))
+  sys.exit(1)
+Elapsed = max(time.time() - Start, 0.001)
+print()
+print('%d rows of %d minutes in %0.1fs (%d rows/s)' % (Rows, Count, Elapsed, Rows / Elapsed))
+print()
+
+#==============================================================================
+# end
+#==============================================================================
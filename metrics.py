@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+PROGRAM = 'metrics.py'
+VERSION = '2.610.192'
+CONTACT = 'bright.tiger@mail.com' # michael nagy
+
+#==============================================================================
+# timings and counters for the weather scripts, written out as prometheus
+# text, and sampled cProfile dumps.  a timing is taken by noting the
+# start time and handing it to Timed when the work is done:
+#
+#   Start = time.time()
+#   ...
+#   Timed('poll', Start)
+#
+# each name keeps a histogram over BUCKETS since we started (what
+# prometheus wants for rates) and its last WINDOW timings, for quantiles
+# of recent behavior.  Count bumps a counter and Gauge sets a value.
+# Write puts it all in a file, through a rename so a reader never sees
+# half of it.  the node_exporter textfile collector picks the file up as
+# it is, and otherwise it is simply read with cat.  the cost is a list
+# append and a bisect per timing.
+#==============================================================================
+
+import atexit, bisect, collections, json, os, resource, sys, time
+
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0) # seconds
+WINDOW  = 60 # timings kept per name for the rolling quantiles
+
+QUANTILES = (0.5, 0.95, 1.0)
+
+#----------------------------------------------------------------------
+# timers, counters and gauges, in the order they were first seen
+#----------------------------------------------------------------------
+
+class Timer(object):
+  __slots__ = ('Buckets', 'Sum', 'Max', 'Recent')
+
+  def __init__(self):
+    self.Buckets = [0] * (len(BUCKETS) + 1)
+    self.Sum     = 0.0
+    self.Max     = 0.0
+    self.Recent  = collections.deque(maxlen=WINDOW)
+
+  def Add(self, Secs):
+    self.Buckets[bisect.bisect_left(BUCKETS, Secs)] += 1
+    self.Sum += Secs
+    self.Max = max(self.Max, Secs)
+    self.Recent.append(Secs)
+
+Timers   = collections.OrderedDict()
+Counters = collections.OrderedDict()
+Gauges   = collections.OrderedDict()
+
+def Timed(Name, Start):
+  End = time.time()
+  Entry = Timers.get(Name)
+  if not Entry:
+    Entry = Timers[Name] = Timer()
+  Entry.Add(End - Start)
+  return End
+
+def Count(Name, By=1):
+  Counters[Name] = Counters.get(Name, 0) + By
+
+def Gauge(Name, Value):
+  Gauges[Name] = Value
+
+#----------------------------------------------------------------------
+# prometheus text exposition.  timers become a histogram of stage
+# seconds and a gauge of their recent quantiles, counters become event
+# totals, all labeled by name under the given metric prefix.
+#----------------------------------------------------------------------
+
+def Quantile(Values, Fraction):
+  Values = sorted(Values)
+  return Values[min(len(Values) - 1, int(Fraction * len(Values)))]
+
+def Exposition(Prefix):
+  Lines = []
+  if Timers:
+    Lines.append('# TYPE %s_seconds histogram' % (Prefix))
+    for Name, Entry in Timers.items():
+      Total = 0
+      for Bound, Hits in zip(BUCKETS + ('+Inf',), Entry.Buckets):
+        Total += Hits
+        Lines.append('%s_seconds_bucket{stage="%s",le="%s"} %d' % (Prefix, Name, Bound, Total))
+      Lines.append('%s_seconds_sum{stage="%s"} %0.6f' % (Prefix, Name, Entry.Sum))
+      Lines.append('%s_seconds_count{stage="%s"} %d' % (Prefix, Name, Total))
+    Lines.append('# TYPE %s_recent_seconds gauge' % (Prefix))
+    for Name, Entry in Timers.items():
+      for Fraction in QUANTILES:
+        Lines.append('%s_recent_seconds{stage="%s",quantile="%s"} %0.6f' % (
+          Prefix, Name, Fraction, Quantile(Entry.Recent, Fraction)))
+  if Counters:
+    Lines.append('# TYPE %s_events_total counter' % (Prefix))
+    for Name, Value in Counters.items():
+      Lines.append('%s_events_total{event="%s"} %d' % (Prefix, Name, Value))
+  for Name, Value in Gauges.items():
+    Lines.append('# TYPE %s_%s gauge' % (Prefix, Name))
+    Lines.append('%s_%s %s' % (Prefix, Name, Value))
+  return '\n'.join(Lines) + '\n'
+
+def Write(Path, Prefix):
+  try:
+    with open(Path + '.tmp', 'w') as f:
+      f.write(Exposition(Prefix))
+    os.rename(Path + '.tmp', Path)
+    return True
+  except (IOError, OSError):
+    return False
+
+#----------------------------------------------------------------------
+# sampled profiling.  one Profiler gathers cProfile statistics over the
+# stretches of work it is started and stopped around, and dumps them all
+# in pstats form (python -m pstats file) each time it is stopped.  only
+# the first and then every Every'th stretch is profiled, to keep the
+# overhead down.
+#----------------------------------------------------------------------
+
+class Profiler(object):
+
+  def __init__(self, Path, Every=1):
+    import cProfile
+    self.Path    = Path
+    self.Every   = Every
+    self.Runs    = 0
+    self.Active  = False
+    self.Profile = cProfile.Profile()
+
+  def Start(self):
+    self.Runs += 1
+    self.Active = (self.Runs - 1) % self.Every == 0
+    if self.Active:
+      self.Profile.enable()
+
+  def Stop(self):
+    if self.Active:
+      self.Profile.disable()
+      self.Profile.dump_stats(self.Path)
+      self.Active = False
+
+#----------------------------------------------------------------------
+# profiled runs of the batch scripts.  a script calls RunStart first
+# thing, and if it was given -profile, or WEATHER_PROFILE names a
+# directory, the whole run is profiled.  storage.py then times every
+# query and fetch by statement and table (see Profiling there), and the
+# script's own phases are timed as above.  at exit we print the phases,
+# dump the cProfile statistics to a pstats file named for the script
+# and the time, and append a one line json summary of the run to
+# RUNS_FILE, so the runs cron makes build up a history to trend.
+#----------------------------------------------------------------------
+
+PROFILE_DIR = '/home/pi/weather/profile' # unless WEATHER_PROFILE says
+RUNS_FILE   = 'runs.jsonl'
+
+Profiling = False
+Run = {}
+
+def RunStart(Program, Version):
+  global Profiling, PROFILE_DIR
+  if '-profile' in sys.argv:
+    sys.argv.remove('-profile')
+  elif not os.environ.get('WEATHER_PROFILE'):
+    return False
+  PROFILE_DIR = os.environ.get('WEATHER_PROFILE', PROFILE_DIR)
+  if not os.path.isdir(PROFILE_DIR):
+    os.makedirs(PROFILE_DIR)
+  Profiling = True
+  Run['program'] = Program
+  Run['version'] = Version
+  Run['args'   ] = sys.argv[1:]
+  Run['start'  ] = time.time()
+  Run['profile'] = Profiler(os.path.join(PROFILE_DIR, '%s-%s.pstats' % (
+    os.path.splitext(Program)[0], time.strftime('%Y%m%d-%H%M%S'))))
+  Run['profile'].Start()
+  atexit.register(RunEnd)
+  return True
+
+def RunEnd():
+  Run['profile'].Stop()
+  Secs = time.time() - Run['start']
+  Summary = {
+    'program': Run['program'],
+    'version': Run['version'],
+    'args'   : Run['args'   ],
+    'start'  : time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(Run['start'])),
+    'secs'   : round(Secs, 3),
+    'rss_mb' : round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+    'phases' : dict((Name, {'count': sum(Entry.Buckets), 'secs': round(Entry.Sum, 4),
+                 'max': round(Entry.Max, 4)}) for Name, Entry in Timers.items()),
+    'counts' : dict(Counters),
+  }
+  with open(os.path.join(PROFILE_DIR, RUNS_FILE), 'a') as f:
+    f.write('%s\n' % (json.dumps(Summary, sort_keys=True)))
+  print()
+  print('profile: %0.2fs, %0.1f mb, %s' % (Secs, Summary['rss_mb'], Run['profile'].Path))
+  print()
+  print('  %-30s %8s %10s %10s' % ('phase', 'count', 'secs', 'max ms'))
+  for Name, Entry in sorted(Timers.items(), key=lambda Item: -Item[1].Sum):
+    print('  %-30s %8d %10.3f %10.1f' % (Name, sum(Entry.Buckets), Entry.Sum, 1000.0 * Entry.Max))
+  for Name, Value in Counters.items():
+    print('  %-30s %8d' % (Name, Value))
+  print()
+
+#==============================================================================
+# end
+#==============================================================================
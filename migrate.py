@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+PROGRAM = 'migrate.py'
+VERSION = '2.610.192'
+CONTACT = 'bright.tiger@mail.com' # michael nagy
+
+#==============================================================================
+# copy the weather database from one storage backend to another (see
+# storage.py), typically from postgresql to sqlite on a standalone pi:
+#
+#   migrate.py -to sqlite:/home/pi/weather/weather.db [-from url]
+#
+# the source defaults to the WEATHER_DB database.  the epoch and quarter
+# tables are created in the target from the shared schema and copied in
+# id order, a batch per transaction.  only epoch rows newer than the
+# newest already in the target are copied, so an interrupted migration
+# can just be run again, and a last run after stopping proxy-logger.py
+# picks up the final minutes before WEATHER_DB is switched over.  the
+# quarter table is small but its rows are updated in place (condense.py
+# recondenses late quarters, backfill.py marks them uploaded), so it is
+# emptied and copied in full on every run.
+#
+# the derived tables (quarter_version, quarter_stats, quarter_gap and
+# the battery.py summaries) are not copied.  condense.py and battery.py
+# build them afresh on their first run against the target.
+#==============================================================================
+
+import os, sys, time, storage
+from observation import Columns, ColumnTypes, CreateSql, InsertSql
+
+TABLES = ('epoch', 'quarter')
+UPDATED = ('quarter',)
+
+BATCH_ROWS = 5000
+
+#----------------------------------------------------------------------
+# the standard utc and local time string format we use throughout
+#----------------------------------------------------------------------
+
+TimePattern = '%Y-%m-%d %H:%M:%S'
+
+def LocalTimeStr(Epoch):
+  return time.strftime(TimePattern, time.localtime(Epoch))
+
+#----------------------------------------------------------------------
+# write a timestamped message to the permanent log file
+#----------------------------------------------------------------------
+
+def PermaLog(Text):
+  Time = LocalTimeStr(time.time())
+  with open('/home/pi/weather/permanent.log', 'a') as f:
+    f.write('%s %s %s\n' % (Time, PROGRAM, Text))
+
+#----------------------------------------------------------------------
+# write a message to the console and the permanent log file
+#----------------------------------------------------------------------
+
+def Print(Text):
+  print('%s' % (Text))
+  PermaLog(Text.strip())
+
+#----------------------------------------------------------------------
+# copy the rows of one table newer than the target's newest, or all of
+# them for a table whose rows are updated in place.  the target's rows
+# are then deleted in the first batch's transaction.
+#----------------------------------------------------------------------
+
+def CopyTable(Table, Source, Target, TargetUrl):
+  TargetCursor = Target.cursor()
+  TargetCursor.execute(CreateSql(Table))
+  storage.AddColumns(TargetCursor, Table, ColumnTypes(Table), TargetUrl)
+  TargetCursor.execute('SELECT max(id) AS max FROM %s' % (Table))
+  Mark = TargetCursor.fetchone()['max']
+  Target.commit()
+  if Table in UPDATED:
+    TargetCursor.execute('DELETE FROM %s' % (Table))
+    Mark = None
+  Names = Columns(Table)
+  SourceCursor = Source.cursor('migrate_%s' % (Table))
+  SourceCursor.itersize = BATCH_ROWS
+  SourceCursor.execute('SELECT id,%s FROM %s WHERE id > %d ORDER BY id' % (
+    ','.join(Names), Table, Mark if Mark is not None else -1))
+  Sql = InsertSql(Table)
+  Start = time.time()
+  Copied = 0
+  while True:
+    Rows = SourceCursor.fetchmany(BATCH_ROWS)
+    if not Rows:
+      break
+    TargetCursor.executemany(Sql, [tuple(Row) for Row in Rows])
+    Target.commit()
+    Copied += len(Rows)
+    print('  %s %d rows' % (Table, Copied))
+  SourceCursor.close()
+  Target.commit()
+  Elapsed = max(time.time() - Start, 0.001)
+  Print('  %s copied %d rows after id %s in %0.1fs (%d rows/s)' % (
+    Table, Copied, Mark, Elapsed, Copied / Elapsed))
+
+#----------------------------------------------------------------------
+# main
+#----------------------------------------------------------------------
+
+print()
+Print('%s %s' % (PROGRAM, VERSION))
+print()
+SourceUrl = storage.DB_URL
+TargetUrl = None
+try:
+  Args = sys.argv[1:]
+  while Args:
+    Arg = Args.pop(0).lower()
+    if Arg.startswith('-f'):
+      SourceUrl = Args.pop(0)
+    elif Arg.startswith('-t'):
+      TargetUrl = Args.pop(0)
+    else:
+      raise ValueError(Arg)
+  storage.ParseUrl(SourceUrl)
+  storage.ParseUrl(TargetUrl)
+  if SourceUrl == TargetUrl:
+    raise ValueError(TargetUrl)
+except:
+  print('bad arguments - specify -to url [-from url], where url is one of')
+  print()
+  print('  postgresql:dbname=weather')
+  print('  sqlite:/home/pi/weather/weather.db')
+  print()
+  sys.exit(1)
+Print('migrating %s to %s' % (SourceUrl, TargetUrl))
+print()
+try:
+  Source = storage.Connect(SourceUrl)
+  Target = storage.Connect(TargetUrl)
+  for Table in TABLES:
+    CopyTable(Table, Source, Target, TargetUrl)
+  Source.rollback()
+  Source.close()
+  Target.close()
+except storage.Error as er:
+  Print('db error: %s' % (er.message))
+  os._exit(1)
+print()
+Print('done')
+print()
+
+#==============================================================================
+# end
+#==============================================================================
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+PROGRAM = 'observation.py'
+VERSION = '2.610.194'
+CONTACT = 'bright.tiger@mail.com' # michael nagy
+
+#==============================================================================
+# the one definition of the epoch and quarter table columns, shared by
+# proxy-logger.py, condense.py, backfill.py and summary.py, and a
+# compact observation type with the conversions between the forms an
+# observation takes:
+#
+#   weatherbox json dictionary  ->  Observation  (FromWb)
+#   quarter/epoch database row  ->  Observation  (FromRow)
+#   Observation  ->  database parameter tuple    (Insert, Update)
+#   Observation  ->  upstream report payload     (Upstream)
+#
+# each conversion is compiled into a plain list of steps when this module
+# is imported, so converting an observation is a single pass with no
+# per-call lookups in the schema, and each value is converted once.
+#==============================================================================
+
+import operator
+
+#----------------------------------------------------------------------
+# the schema.  each column has its sql type, the weatherbox json key it
+# comes from (None if it doesn't come from the weatherbox), the number
+# of decimals it is stored and reported with (None for integers), and
+# the tables it appears in (e = epoch, q = quarter).  the order here is
+# the column order of both tables.  quarter columns are consolidated
+# from the epochs in condense.py as noted.
+#----------------------------------------------------------------------
+
+SCHEMA = (
+  # column           type    wb key            decimals  tables
+  ('boot_count'    , 'INT' , 'boot.count'    , None    , 'eq'), # quarter maximum
+  ('uptime_minutes', 'INT' , 'uptime.minutes', None    , 'eq'), # quarter maximum
+  ('temp_f'        , 'REAL', 'temp.c'        , 1       , 'eq'), # quarter average
+  ('dewpoint_f'    , 'REAL', 'dewpoint.c'    , 1       , 'eq'), # quarter average
+  ('humidity_pct'  , 'INT' , 'humidity.pct'  , None    , 'eq'), # quarter average
+  ('pressure_inhg' , 'REAL', 'pressure.inhg' , 3       , 'eq'), # quarter average
+  ('wind_mph'      , 'INT' , 'wind.mph'      , None    , 'eq'), # quarter maximum
+  ('wind_direction', 'REAL', 'wind.direction', 0       , 'eq'), # quarter final
+  ('rain_in'       , 'REAL', 'rain.in'       , 2       , 'eq'), # quarter maximum
+  ('rain_day_in'   , 'REAL', 'rain.day.in'   , 2       , 'eq'), # quarter maximum
+  ('power_volt'    , 'REAL', 'power.volt'    , 3       , 'eq'), # quarter maximum
+  ('tau_status'    , 'INT' , 'tau.status'    , None    , 'eq'), # quarter maximum
+  ('tau_queries'   , 'INT' , 'tau.queries'   , None    , 'eq'), # quarter maximum
+  ('tau_replies'   , 'INT' , 'tau.replies'   , None    , 'eq'), # quarter maximum
+  ('log_next'      , 'INT' , 'log.next'      , None    , 'eq'), # quarter maximum
+  ('log_full'      , 'INT' , 'log.full'      , None    , 'eq'), # quarter maximum
+  ('reported_mask' , 'INT' , None            , None    , 'eq'), # quarter bitwise or
+  ('log_mask'      , 'INT' , None            , None    , 'q' ), # log data needed or missing
+  ('epochs'        , 'INT' , None            , None    , 'q' ), # number of epoch records consolidated
+  ('expected'      , 'INT' , None            , None    , 'q' ), # epochs expected at the logging cadence
+  ('temp_min_f'    , 'REAL', 'temp.min.c'    , 1       , 'e' ),
+  ('temp_max_f'    , 'REAL', 'temp.max.c'    , 1       , 'e' ),
+  ('wind_gust_mph' , 'INT' , 'wind.gust.mph' , None    , 'e' ),
+  ('samples'       , 'INT' , 'samples'       , None    , 'e' ),
+  ('loop_secs'     , 'INT' , 'loop.secs'     , None    , 'e' ), # polling cadence at the time
+)
+
+TABLES = {'epoch': 'e', 'quarter': 'q'}
+
+def Columns(Table):
+  return [Column[0] for Column in SCHEMA if TABLES[Table] in Column[4]]
+
+#----------------------------------------------------------------------
+# sql, built once from the schema.  statements take %s parameters in
+# column order, with the id first for an insert and last for an update.
+# a table's columns can be created and filled under another name.
+#----------------------------------------------------------------------
+
+def CreateSql(Table, Name=None):
+  sql = 'CREATE TABLE IF NOT EXISTS %s (' % (Name or Table)
+  sql += 'id             INT PRIMARY KEY'
+  for Name, Type, Key, Decimals, Tables in SCHEMA:
+    if TABLES[Table] in Tables:
+      sql += ',%-14s %s' % (Name, Type)
+  return sql + ');'
+
+def ColumnTypes(Table):
+  return [(Column[0], Column[1]) for Column in SCHEMA if TABLES[Table] in Column[4]]
+
+def InsertSql(Table, Name=None):
+  Names = Columns(Table)
+  return 'INSERT INTO %s (id,%s) VALUES (%s)' % (
+    Name or Table, ','.join(Names), ','.join(['%s'] * (len(Names) + 1)))
+
+def UpdateSql(Table, Names):
+  return 'UPDATE %s SET %s WHERE id = %%s' % (
+    Table, ','.join(['%s = %%s' % (Name) for Name in Names]))
+
+#----------------------------------------------------------------------
+# the running quarter statistics (see QuarterStatsInit in condense.py)
+# are built from the quarter table only while quarter_stats is empty,
+# so condense.py builds them once, and summary.py -v rebuilds them by
+# emptying the table first in the same transaction.
+#----------------------------------------------------------------------
+
+def QuarterStatsSql():
+  Empty = 'NOT EXISTS (SELECT 1 FROM quarter_stats)'
+  sql = 'DELETE FROM quarter_gap WHERE %s;' % (Empty)
+  sql += 'INSERT INTO quarter_gap (first, last) '
+  sql += '  SELECT min(id), max(id) FROM ('
+  sql += '    SELECT id, id - row_number() OVER (ORDER BY id) AS island '
+  sql += '    FROM quarter WHERE epochs = 0) AS q '
+  sql += '  WHERE %s GROUP BY island;' % (Empty)
+  sql += 'INSERT INTO quarter_stats (epochs, expected, quarters, wu, ps) '
+  sql += '  SELECT epochs, expected, count(*), '
+  sql += '    sum(CASE WHEN reported_mask & 1 <> 0 THEN 1 ELSE 0 END), '
+  sql += '    sum(CASE WHEN reported_mask & 2 <> 0 THEN 1 ELSE 0 END) '
+  sql += '  FROM quarter WHERE %s GROUP BY epochs, expected;' % (Empty)
+  return sql
+
+#----------------------------------------------------------------------
+# value conversions.  temperatures arrive in celsius and are kept in
+# fahrenheit with one decimal, everything else is rounded to its stored
+# precision (integers truncate, as the old %d formatting did).
+#----------------------------------------------------------------------
+
+def Fahrenheit(Celsius):
+  return round((Celsius * 1.8) + 32.0, 1)
+
+def Rounder(Decimals):
+  if Decimals is None:
+    return lambda Value: None if Value is None else int(Value)
+  return lambda Value: None if Value is None else round(Value, Decimals)
+
+def Formatter(Decimals):
+  if Decimals is None:
+    return lambda Value: '%d' % (Value)
+  return lambda Value: '%.*f' % (Decimals, Value)
+
+CELSIUS = ('temp.c', 'dewpoint.c', 'temp.min.c', 'temp.max.c')
+
+#----------------------------------------------------------------------
+# upstream report fields, shared by weather underground and aeris
+#----------------------------------------------------------------------
+
+UPSTREAM = (
+  ('winddir'     , 'wind_direction'),
+  ('windspeedmph', 'wind_mph'      ),
+  ('windgustmph' , 'wind_gust_mph' ),
+  ('rainin'      , 'rain_in'       ),
+  ('dailyrainin' , 'rain_day_in'   ),
+  ('humidity'    , 'humidity_pct'  ),
+  ('dewptf'      , 'dewpoint_f'    ),
+  ('UV'          , 'tau_status'    ),
+  ('tempf'       , 'temp_f'        ),
+  ('baromin'     , 'pressure_inhg' ),
+)
+
+#----------------------------------------------------------------------
+# the compiled conversion steps
+#----------------------------------------------------------------------
+
+Rounders = dict((Column[0], Rounder(Column[3])) for Column in SCHEMA)
+
+WbSteps = [(Name, Key, Fahrenheit if Key in CELSIUS else Rounders[Name])
+  for Name, Type, Key, Decimals, Tables in SCHEMA if Key]
+
+RowSteps = dict((Table, (operator.itemgetter(*Columns(Table)), Columns(Table)))
+  for Table in TABLES)
+
+ParamSteps = dict((Table, (operator.attrgetter(*Columns(Table)),
+  [Rounders[Name] for Name in Columns(Table)])) for Table in TABLES)
+
+UpstreamSteps = [(Field, Name, Formatter(Column[3]))
+  for Field, Name in UPSTREAM for Column in SCHEMA if Column[0] == Name]
+
+#----------------------------------------------------------------------
+# one observation, an epoch or a quarter.  slots keep it to a fixed
+# small footprint, and columns not yet known are None (null).
+#----------------------------------------------------------------------
+
+class Observation(object):
+  __slots__ = tuple(Column[0] for Column in SCHEMA)
+
+  def __init__(self, **Values):
+    for Name in self.__slots__:
+      setattr(self, Name, Values.get(Name))
+
+  @classmethod
+  def FromWb(cls, wb):
+    Obs = cls()
+    for Name, Key, Convert in WbSteps:
+      if Key in wb:
+        setattr(Obs, Name, Convert(wb[Key]))
+    return Obs
+
+  @classmethod
+  def FromRow(cls, Row, Table='quarter'):
+    Obs = cls()
+    Getter, Names = RowSteps[Table]
+    for Name, Value in zip(Names, Getter(Row)):
+      setattr(Obs, Name, Value)
+    return Obs
+
+  def Params(self, Table):
+    Getter, Converts = ParamSteps[Table]
+    return tuple([Convert(Value) for Convert, Value in zip(Converts, Getter(self))])
+
+  def Insert(self, Table, Id):
+    return (Id,) + self.Params(Table)
+
+  def Update(self, Names, Id):
+    return tuple([Rounders[Name](getattr(self, Name)) for Name in Names]) + (Id,)
+
+  def Upstream(self, StationId, Password, UtcTime):
+    Data = {
+      'ID'      : StationId  ,
+      'PASSWORD': Password   ,
+      'dateutc' : UtcTime    ,
+      'action'  : 'updateraw',
+    }
+    for Field, Name, Format in UpstreamSteps:
+      Value = getattr(self, Name)
+      if Value is not None:
+        Data[Field] = Format(Value)
+    return Data
+
+#==============================================================================
+# end
+#==============================================================================
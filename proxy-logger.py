@@ -3,7 +3,7 @@
 from __future__ import print_function
 
 PROGRAM = 'proxy-logger.py'
-VERSION = '1.908.021'
+VERSION = '2.610.1915'
 CONTACT = 'bright.tiger@mail.com' # michael nagy
 
 #==============================================================================
@@ -11,7 +11,7 @@ CONTACT = 'bright.tiger@mail.com' # michael nagy
 # turn will be querying a tornado alert unit), and report it to both weather
 # underground and aeris.  if the realtime clock in the weatherbox4 is off by
 # more than 60 seconds, reset it to the current time.  also log the weather
-# data to a postgresql database.
+# data to a postgresql (or sqlite) database.
 #
 # we expect to have an oled shield installed with an sh1106 display and a set
 # of gpio buttons.  pressing joystick down will cause a program exit (which,
@@ -26,14 +26,48 @@ CONTACT = 'bright.tiger@mail.com' # michael nagy
 # we also log to /var/log/syslog as the proxy-logger.py process.  to allow
 # for some debugging on a system other than the target raspberry pi, we
 # inhibit the gpio, watchdog and upstream reporting functions if the oled
-# display is not present.
+# display is not present (upstream reporting still goes to urls given in
+# the environment, such as the simulate.py stand-ins).  the traffic can
+# also be recorded, for replay.py to play back (see PROXY_RECORD below),
+# and timings and counters for each poll go to a stats file (METRICS_FILE).
+# a restart picks up where the last run left off from a checkpoint
+# (CHECKPOINT_FILE), and should be polling again within the startup
+# budget (STARTUP_BUDGET_SECS).
 #==============================================================================
 
-import os, requests, json, time, calendar, logging, subprocess
+import os, json, time, calendar, logging, subprocess, collections, metrics
 from syslog import syslog
 from time import sleep
 from datetime import datetime
 
+#----------------------------------------------------------------------
+# startup budget.  a restart, by systemd or after a failsafe exit, should
+# be ready to poll again within STARTUP_BUDGET_SECS, well inside the
+# minute.  each stage of startup is timed (see metrics.py) and once we
+# are ready the total and the slowest stages are logged.  to keep it
+# short the optional subsystems are only imported where and when they
+# are needed: the display and gpio libraries only if there is an spi bus
+# for the display, psycopg2 only for postgresql (see storage.py), and
+# requests only for the first upstream report.
+#----------------------------------------------------------------------
+
+STARTUP_BUDGET_SECS = 2.0
+
+StartTime = StartupMark = time.time()
+
+def Startup(Stage):
+  global StartupMark
+  StartupMark = metrics.Timed('startup %s' % (Stage), StartupMark)
+
+def StartupDone(Warm):
+  Total = StartupMark - StartTime
+  metrics.Gauge('startup_seconds', round(Total, 3))
+  Stages = sorted([(Entry.Sum, Name.split(' ', 1)[1]) for Name, Entry in
+    metrics.Timers.items() if Name.startswith('startup ')], reverse=True)
+  Print('[00] %s start %0.2fs%s (%s)' % ('warm' if Warm else 'cold', Total,
+    ' over budget' if Total > STARTUP_BUDGET_SECS else '',
+    ', '.join(['%s %0.2fs' % (Name, Secs) for Secs, Name in Stages[:3]])), 'permalog')
+
 try:
   import serial
 except:
@@ -49,6 +83,8 @@ except:
 
 Password = json.load(open('/home/pi/weather/.passwords.json'))
 
+Startup('imports')
+
 #----------------------------------------------------------------------
 # two-digit cyclic counter to provide a warm fuzzy progress indicator
 #----------------------------------------------------------------------
@@ -75,10 +111,7 @@ BCM_JOYSTICK_RIGHT  =  5
 BCM_JOYSTICK_LEFT   = 26
 BCM_JOYSTICK_CENTER = 13
 
-try:
-  import RPi.GPIO as GPIO
-except:
-  pass
+OLED_SPI = '/dev/spidev0.0' # no spi bus, no display
 
 def GpioInit():
   if Oled:
@@ -108,6 +141,9 @@ def GpioCleanup():
 #----------------------------------------------------------------------
 
 try:
+  if not os.path.exists(OLED_SPI):
+    raise IOError(OLED_SPI)
+  import RPi.GPIO as GPIO
   from demo_opts import get_device
   from luma.core.virtual import terminal
   from PIL import ImageFont
@@ -124,12 +160,17 @@ try:
 except:
   print('[00] oled disabled')
 
+Startup('display')
+
 #----------------------------------------------------------------------
 # the watchdog must be reset at least once every 5 minutes or systemd
 # will, as configured in our unit file, restart us, and actually
 # reboot the system if it has to restart us too often.  we reset the
 # watchdog on every successful query of the weatherbox4 system, which
-# is about the most reliable indicator of health we have available.
+# is about the most reliable indicator of health we have available,
+# and every WATCHDOG_WAIT_SECS while waiting after one.  a calm wait
+# can be as long as LOOP_TIME_MAX, and without those resets it would
+# eat most of the allowance for failed polls after it.
 # note that for getpid() to work, the systemd unit file must specify:
 #
 #   [Service]
@@ -141,16 +182,35 @@ except:
 
 WatchDogCmd = '/bin/systemd-notify --pid=%d WATCHDOG=1' % (os.getpid())
 
+WATCHDOG_WAIT_SECS = 60
+
+WatchdogTime = 0.0 # time of the last reset
+
 def WatchdogReset():
+  global WatchdogTime
+  WatchdogTime = time.time()
   if Oled:
     subprocess.call(WatchDogCmd, shell=True)
+    metrics.Count('watchdog_reset')
 
 #----------------------------------------------------------------------
-# disable annoying info logging from requests package
+# upstream http requests.  requests takes a while to import, so that
+# waits for the first report, and never happens if we don't report.
+# disable annoying info logging from requests package.
 #----------------------------------------------------------------------
 
 logging.getLogger('requests.packages.urllib3.connectionpool').setLevel(logging.ERROR)
 
+requests = None
+
+def HttpGet(Url, Params):
+  global requests
+  if not requests:
+    Start = time.time()
+    import requests
+    metrics.Timed('import requests', Start)
+  return requests.get(Url, params=Params)
+
 #----------------------------------------------------------------------
 # bitmask values which indicate publication to weather underground and
 # aeris was successfull
@@ -197,99 +257,476 @@ def Print(Text='', Log=None):
       PermaLog(Text)
 
 #----------------------------------------------------------------------
-# database support.  we are currently using postgresql, but with minor
-# modifications to this single block of code we could alternately run
-# with sqlite3 or possibly other database engines.
+# database support.  postgresql or sqlite, as configured by WEATHER_DB
+# (see storage.py).
 #----------------------------------------------------------------------
 
-import psycopg2
+import storage
+from observation import Observation, CreateSql, ColumnTypes, InsertSql
+
+EpochInsertSql = InsertSql('epoch')
 
-def DbExecute(Note5, Sql):
+def DbExecute(Note5, Sql, Params=None):
   try:
-    db = psycopg2.connect('dbname=weather')
+    db = storage.Connect()
     cursor = db.cursor()
-    cursor.execute(Sql)
+    cursor.execute(Sql, Params)
     db.commit()
     db.close()
     Print('[%02d] %s ok' % (LoopCount, Note5), 'syslog')
-  except psycopg2.Error as er:
+    return True
+  except storage.Error as er:
     Print('[%02d] %s error: %s' % (LoopCount, Note5, er.message), 'permalog')
+    return False
 
 def DbInit():
-  sql = 'CREATE TABLE IF NOT EXISTS epoch ('
-  sql += 'id             INT PRIMARY KEY,'
-  sql += 'boot_count     INT ,'
-  sql += 'uptime_minutes INT ,'
-  sql += 'temp_f         REAL,'
-  sql += 'dewpoint_f     REAL,'
-  sql += 'humidity_pct   INT ,'
-  sql += 'pressure_inhg  REAL,'
-  sql += 'wind_mph       INT ,'
-  sql += 'wind_direction REAL,'
-  sql += 'rain_in        REAL,'
-  sql += 'rain_day_in    REAL,'
-  sql += 'power_volt     REAL,'
-  sql += 'tau_status     INT ,'
-  sql += 'log_next       INT ,'
-  sql += 'log_full       INT ,'
-  sql += 'reported_mask  INT);'
-  DbExecute('init ', sql)
-
-#----------------------------------------------------------------------
-# serial port - half duplex, 19200 bps, return decoded json
+  DbExecute('init ', CreateSql('epoch'))
+  try:
+    db = storage.Connect()
+    storage.AddColumns(db.cursor(), 'epoch', ColumnTypes('epoch'))
+    db.commit()
+    db.close()
+  except storage.Error as er:
+    Print('[00] alter error: %s' % (er.message), 'permalog')
+
+#----------------------------------------------------------------------
+# group commit.  committing every minute's row on its own costs a wal
+# flush and fsync per sample on the sd card.  with GROUP_COMMIT_ROWS set
+# each row is instead appended to a local journal file, and the journal
+# is committed to the database in a single transaction once it holds
+# GROUP_COMMIT_ROWS rows or GROUP_COMMIT_SECS have passed, then emptied.
+#
+# the journal is what makes this crash safe.  it is synced every
+# JOURNAL_SYNC_ROWS rows, which is the durability window: at most that
+# many rows can be lost to a power cut.  1 loses nothing and still
+# trades each database commit for one small append.  setting it to
+# GROUP_COMMIT_ROWS brings flash writes down to about one per group, at
+# the risk of that many minutes.  on startup any rows left in the
+# journal are replayed into the database.  rows already committed just
+# before a crash are skipped, so replay is always safe, and a torn last
+# line is dropped and cut from the journal, along with everything else
+# if no whole rows remain.  if the database is down the rows simply stay
+# in the journal until the next commit works.
+#----------------------------------------------------------------------
+
+GROUP_COMMIT_ROWS = 0   # 0 commits every row as it comes, 15 is sensible
+GROUP_COMMIT_SECS = 900 # commit at least this often while rows arrive
+JOURNAL_SYNC_ROWS = 1   # rows at risk on power loss, 1..GROUP_COMMIT_ROWS
+JOURNAL_FILE      = '/home/pi/weather/epoch.journal'
+
+JournalInsertSql = EpochInsertSql + ' ON CONFLICT (id) DO NOTHING'
+
+Journal         = None # the open journal file, if group commit is enabled
+JournalRows     = []   # rows journaled but not yet committed
+JournalUnsynced = 0    # rows appended since the last sync
+JournalTime     = 0.0  # time of the last commit
+
+def JournalSync():
+  global JournalUnsynced
+  Journal.flush()
+  os.fsync(Journal.fileno())
+  JournalUnsynced = 0
+
+def JournalCommit():
+  global JournalTime
+  JournalTime = time.time()
+  if not JournalRows:
+    return True
+  try:
+    db = storage.Connect()
+    cursor = db.cursor()
+    cursor.executemany(JournalInsertSql, JournalRows)
+    db.commit()
+    db.close()
+  except storage.Error as er:
+    Print('[%02d] group error: %s' % (LoopCount, er.message), 'permalog')
+    return False
+  Print('[%02d] group %d ok' % (LoopCount, len(JournalRows)), 'syslog')
+  del JournalRows[:]
+  Journal.flush()
+  os.ftruncate(Journal.fileno(), 0)
+  JournalSync()
+  return True
+
+def JournalInit():
+  global Journal
+  if not GROUP_COMMIT_ROWS:
+    return
+  Text = ''
+  if os.path.exists(JOURNAL_FILE):
+    with open(JOURNAL_FILE) as f:
+      Text = f.read()
+  Whole = Text[:Text.rfind('\n') + 1]
+  if Whole != Text:
+    Print('[00] journal torn line dropped', 'permalog')
+  for Line in Whole.splitlines():
+    try:
+      JournalRows.append(json.loads(Line))
+    except ValueError:
+      Print('[00] journal line dropped', 'permalog')
+  Keep = len(Whole) if JournalRows else 0
+  Journal = open(JOURNAL_FILE, 'a')
+  if Keep != len(Text):
+    os.ftruncate(Journal.fileno(), Keep)
+    JournalSync()
+  if JournalRows:
+    Print('[00] journal replay %d' % (len(JournalRows)), 'permalog')
+  JournalCommit()
+
+def EpochWrite(Params):
+  global JournalUnsynced
+  if not Journal:
+    Ok = DbExecute('write', EpochInsertSql, Params)
+    Record(wb4.RECORD_DB, wb4.RecordWrite.pack(Ok, 1))
+    metrics.Count('db_error', not Ok)
+    return
+  Journal.write('%s\n' % (json.dumps(Params)))
+  JournalRows.append(Params)
+  JournalUnsynced += 1
+  if JournalUnsynced >= JOURNAL_SYNC_ROWS:
+    JournalSync()
+  Print('[%02d] journal %d' % (LoopCount, len(JournalRows)), 'syslog')
+  Ok, Rows = True, 0
+  if len(JournalRows) >= GROUP_COMMIT_ROWS or time.time() - JournalTime >= GROUP_COMMIT_SECS:
+    Rows = len(JournalRows)
+    Ok = JournalCommit()
+  Record(wb4.RECORD_DB, wb4.RecordWrite.pack(Ok, Rows))
+  metrics.Count('db_error', not Ok)
+
+def JournalClose():
+  if Journal:
+    JournalCommit()
+    JournalSync()
+    Journal.close()
+
+#----------------------------------------------------------------------
+# recording.  if PROXY_RECORD names a file, every serial reply and the
+# outcome of every upstream report and database write is appended to
+# it as it happens (see wb4.py for the format), to be run through
+# replay.py later.  it costs a few hundred bytes a minute.  an existing
+# recording is appended to.
+#----------------------------------------------------------------------
+
+import wb4
+
+RECORD_FILE = os.environ.get('PROXY_RECORD')
+
+Recording = None
+
+def RecordInit(Whole=0):
+  global Recording
+  if RECORD_FILE:
+    try:
+      Recording = wb4.Recorder(RECORD_FILE, Whole)
+      Print('[00] recording to %s' % (RECORD_FILE), 'permalog')
+    except (IOError, ValueError) as er:
+      Print('[00] recording error: %s' % (er), 'permalog')
+
+def Record(Kind, Payload=b''):
+  if Recording:
+    Recording.Write(Kind, Payload)
+    if Kind == wb4.RECORD_DB:
+      Recording.Flush()
+
+def RecordEnd():
+  return Recording.End() if Recording else 0
+
+def RecordClose():
+  if Recording:
+    Recording.Close()
+
+#----------------------------------------------------------------------
+# metrics.  the stages of each poll are timed and the events that
+# matter are counted (see metrics.py), and after every poll it's all
+# written in prometheus text form to METRICS_FILE, on tmpfs so the sd
+# card isn't written every minute.  if PROXY_PROFILE names a file, the
+# first poll and one in PROFILE_EVERY after it run under cProfile, and
+# the statistics gathered so far are dumped there for python -m pstats.
+#----------------------------------------------------------------------
+
+METRICS_FILE   = os.environ.get('PROXY_METRICS', '/dev/shm/proxy-logger.prom')
+METRICS_PREFIX = 'proxy_logger'
+
+PROFILE_FILE  = os.environ.get('PROXY_PROFILE')
+PROFILE_EVERY = 60 # polls, about hourly
+
+Profiler = metrics.Profiler(PROFILE_FILE, PROFILE_EVERY) if PROFILE_FILE else None
+
+#----------------------------------------------------------------------
+# serial port - half duplex, 19200 bps, return decoded json, or with
+# 'bin' a decoded binary frame (see wb4.py)
 #----------------------------------------------------------------------
 
 Wb4Port = None
 
-def Wb4Json(Command='', Trace=False):
+def Wb4Send(Command):
   Command += '\r'
   for Character in Command:
     Wb4Port.write(Character)
     sleep(0.1)
+
+def Wb4Json(Command='', Trace=False):
+  Wb4Send(Command)
   Response = Wb4Port.read(4000)
+  Record(wb4.RECORD_JSON, Response)
   if Trace:
     print('%s' % (Response))
-  try:
-    return json.loads('{%s}' % Response.split('{')[1].split('}')[0])
-  except:
-    return None
+  Start = time.time()
+  wb = wb4.JsonParse(Response)
+  metrics.Timed('decode', Start)
+  return wb
+
+def Wb4Frame(Command='bin'):
+  Wb4Send(Command)
+  Raw, wb = wb4.FrameRead(Wb4Port.read)
+  Record(wb4.RECORD_FRAME, Raw)
+  return wb
+
+#----------------------------------------------------------------------
+# query current data, as a binary frame if enabled, falling back to
+# json if the frame is missing or damaged.  a weatherbox that never
+# answers 'bin' gets switched back to json after a few tries.
+#----------------------------------------------------------------------
+
+Wb4Binary = False # set from WB4_BINARY by Wb4Init
+Wb4FrameErrors = 0
+
+def Wb4Now():
+  global Wb4Binary, Wb4FrameErrors
+  if Wb4Binary:
+    wb = Wb4Frame()
+    if wb:
+      Wb4FrameErrors = 0
+      return wb
+    Wb4Port.flushInput()
+    Wb4FrameErrors += 1
+    metrics.Count('frame_error')
+    if Wb4FrameErrors >= FRAME_ERRORS_MAX:
+      Print('[%02d] wb4 bin disabled' % (LoopCount), 'permalog')
+      Wb4Binary = False
+    else:
+      Print('[%02d] wb4 bin bad' % (LoopCount), 'syslog')
+  return Wb4Json('now')
+
+#----------------------------------------------------------------------
+# open the port and send an empty command, which ends any command left
+# half sent by the last run.  on a warm start the weatherbox4 was
+# answering a moment ago, so rather than wait out the read timeout for
+# its reply we read up to the closing brace, and keep binary frames off
+# if the last run had to give up on them.
+#----------------------------------------------------------------------
 
-def Wb4Init():
-  global Wb4Port
+def Wb4Probe():
+  Wb4Send('')
+  Reply = b''
+  while not Reply.endswith(b'}'):
+    Byte = Wb4Port.read(1)
+    if not Byte:
+      break
+    Reply += Byte
+  Wb4Port.flushInput()
+
+def Wb4Init(Checkpoint):
+  global Wb4Port, Wb4Binary
   try:
     Wb4Port = serial.Serial(WB4_PORT, baudrate=WB4_BAUD, timeout=1.0)
-    Wb4Json()
+    if Checkpoint:
+      Wb4Probe()
+    else:
+      Wb4Json()
+    Wb4Binary = WB4_BINARY and Checkpoint.get('binary', True)
   except:
     Print('[00] serial error', 'permalog')
     sleep(2)
     os._exit(1)
 
 #----------------------------------------------------------------------
-# report no more than once per minute
+# report no more than once per minute, unless the adaptive cadence
+# below moves us within these bounds.  the watchdog is kept up through
+# the wait (see WATCHDOG_WAIT_SECS), so even the longest wait leaves the
+# usual room for failed polls inside the 5 minute systemd watchdog.
 #----------------------------------------------------------------------
 
 LOOP_TIME_SECS = 60
+LOOP_TIME_MIN  = 30
+LOOP_TIME_MAX  = 180
 
 #----------------------------------------------------------------------
-# serial port parameters for weatherbox4 rs485 interface
+# serial port parameters for weatherbox4 rs485 interface.  the port and
+# the upstream urls can be pointed elsewhere from the environment, for
+# instance at simulate.py.
 #----------------------------------------------------------------------
 
-WB4_PORT = '/dev/ttyUSB0'
+WB4_PORT = os.environ.get('WB4_PORT', '/dev/ttyUSB0')
 WB4_BAUD = 19200
 
 #----------------------------------------------------------------------
-# weather underground parameters
+# request compact binary frames instead of json (opt-in, needs matching
+# firmware), and give up on them after this many consecutive failures
+#----------------------------------------------------------------------
+
+WB4_BINARY       = False
+FRAME_ERRORS_MAX = 3
+
+#----------------------------------------------------------------------
+# weather underground parameters.  we only report from the pi itself
+# (see Oled above), or to a url given in the environment.
 #----------------------------------------------------------------------
 
 WU_STATION_ID = 'KFLMYAKK20'
-WU_URL_GET    = 'http://weatherstation.wunderground.com/weatherstation/updateweatherstation.php'
+WU_URL_GET    = os.environ.get('WU_URL', 'http://weatherstation.wunderground.com/weatherstation/updateweatherstation.php')
+WU_REPORT     = bool(Oled) or 'WU_URL' in os.environ
 
 #----------------------------------------------------------------------
 # aeris parameters
 #----------------------------------------------------------------------
 
 PS_STATION_ID = 'KFLMYAKK20'
-PS_URL_GET    = 'https://www.pwsweather.com/pwsupdate/pwsupdate.php'
+PS_URL_GET    = os.environ.get('PS_URL', 'https://www.pwsweather.com/pwsupdate/pwsupdate.php')
+PS_REPORT     = bool(Oled) or 'PS_URL' in os.environ
+
+#----------------------------------------------------------------------
+# sub-minute sampling.  if SAMPLE_TIME_SECS is nonzero we also poll the
+# weatherbox every SAMPLE_TIME_SECS between the once-a-minute reports
+# and keep the raw samples in a small ring.  each minute the ring is
+# reduced (see wb4.py) to the single epoch row we write: means for
+# temperature, dew point, humidity, pressure and wind speed, the
+# highest wind speed as the gust, min/max temperature, and maxima for
+# hourly rain and tau status.  we still write one row per minute, it
+# just says more.
+#
+# every sample is timed.  one that takes longer than SAMPLE_BUDGET_SECS
+# costs us the following slot, and we never start a sample that could
+# run into the minute poll, so the serial line is never saturated.
+#----------------------------------------------------------------------
+
+SAMPLE_TIME_SECS   = 0   # 0 disables, 5..10 is sensible
+SAMPLE_BUDGET_SECS = 1.5 # serial plus processing time allowed per sample
+
+SampleRing = collections.deque(maxlen=(LOOP_TIME_MAX // max(SAMPLE_TIME_SECS, 1)) + 2)
+
+SampleTimeMax = 0.0 # slowest sample since the last reduction
+SampleSkips   = 0   # slots skipped since the last reduction
+
+def SampleWb4():
+  global SampleTimeMax
+  Start = time.time()
+  try:
+    wb = Wb4Now()
+    if wb:
+      SampleRing.append(wb4.SampleOf(wb))
+      Record(wb4.RECORD_SAMPLE)
+  except:
+    Print('[%02d] sample err' % (LoopCount), 'syslog')
+  Elapsed = metrics.Timed('sample', Start) - Start
+  SampleTimeMax = max(SampleTimeMax, Elapsed)
+  return Elapsed
+
+def SampleReduce(wb):
+  global SampleTimeMax, SampleSkips
+  SampleRing.append(wb4.SampleOf(wb))
+  Count = wb4.ReduceSamples(wb, SampleRing)
+  if SAMPLE_TIME_SECS:
+    Print('[%02d] samples %d max %0.2fs skip %d' % (LoopCount, Count, SampleTimeMax, SampleSkips), 'syslog')
+  SampleRing.clear()
+  SampleTimeMax = 0.0
+  SampleSkips   = 0
+
+#----------------------------------------------------------------------
+# adaptive cadence.  keep the last ACTIVITY_WINDOW polls and judge how
+# lively the weather is from the variance of wind speed and pressure,
+# any rain in the last hour, and the tau alert state.  storms and tau
+# alerts drop us to LOOP_TIME_MIN, a full window of calm lets us relax
+# to LOOP_TIME_MAX, and anything else runs at LOOP_TIME_SECS.  we go
+# active at once but only go calm on a full window, so a single quiet
+# poll in the middle of a storm doesn't back us off.  every change is
+# logged along with the numbers that caused it.
+#----------------------------------------------------------------------
+
+ADAPTIVE_LOOP   = True
+ACTIVITY_WINDOW = 10 # polls
+
+CALM_WIND_VAR       = 1.0     # mph^2
+CALM_PRESSURE_VAR   = 0.00003 # inhg^2, about 0.005 inhg deviation
+ACTIVE_WIND_VAR     = 25.0    # mph^2
+ACTIVE_PRESSURE_VAR = 0.0004  # inhg^2, about 0.02 inhg deviation
+
+TAU_ALERT = 9 # tau.status while the tornado alert unit is alerting
+
+Activity = collections.deque(maxlen=ACTIVITY_WINDOW)
+LoopTime = LOOP_TIME_SECS
+
+def Variance(Values):
+  Mean = sum(Values) / float(len(Values))
+  return sum((Value - Mean) ** 2 for Value in Values) / len(Values)
+
+def AdaptLoopTime(wb):
+  global LoopTime
+  if not ADAPTIVE_LOOP:
+    return
+  Activity.append((wb['wind.mph'], wb['pressure.inhg'], wb['rain.in']))
+  Wind, Pressure, Rain = zip(*Activity)
+  WindVar     = Variance(Wind    )
+  PressureVar = Variance(Pressure)
+  if wb['tau.status'] == TAU_ALERT or max(Rain) > 0 or \
+     WindVar >= ACTIVE_WIND_VAR or PressureVar >= ACTIVE_PRESSURE_VAR:
+    Target, Mood = LOOP_TIME_MIN, 'active'
+  elif len(Activity) == ACTIVITY_WINDOW and \
+     WindVar < CALM_WIND_VAR and PressureVar < CALM_PRESSURE_VAR:
+    Target, Mood = LOOP_TIME_MAX, 'calm'
+  else:
+    Target, Mood = LOOP_TIME_SECS, 'normal'
+  if Target != LoopTime:
+    Print('[%02d] loop %ds %s wv=%0.1f pv=%0.5f rain=%4.2f tau=%d' % (
+      LoopCount, Target, Mood, WindVar, PressureVar, max(Rain), wb['tau.status']), 'permalog')
+    LoopTime = Target
+
+#----------------------------------------------------------------------
+# warm restart checkpoint.  after every poll the state a restart would
+# otherwise lose - the loop counter, the wb4 reboot counts, the adaptive
+# cadence, whether binary frames work and when the next poll is due -
+# goes to CHECKPOINT_FILE, with how much of the recording is known to be
+# whole.  it lives on tmpfs, so it costs the sd card nothing, and a
+# reboot always starts cold.  a restart finding a checkpoint less than
+# CHECKPOINT_SECS old picks up where the last run left off: it notices a
+# wb4 reboot in between, keeps the poll on its minute rather than
+# polling at once, cuts the serial probe short, and appends to the
+# recording without reading it all first.  the group commit journal
+# needs nothing here, it is replayed from its own file (see above).
+#----------------------------------------------------------------------
+
+CHECKPOINT_FILE = os.environ.get('PROXY_CHECKPOINT', '/dev/shm/proxy-logger.checkpoint')
+CHECKPOINT_SECS = LOOP_TIME_MAX + 60
+
+def CheckpointRead():
+  try:
+    with open(CHECKPOINT_FILE) as f:
+      Checkpoint = json.load(f)
+    if 0 <= time.time() - Checkpoint['time'] < CHECKPOINT_SECS:
+      return Checkpoint
+  except (IOError, ValueError, KeyError, TypeError):
+    pass
+  return {}
+
+def CheckpointWrite(NextPoll):
+  Checkpoint = {
+    'time'         : time.time()   ,
+    'loop.count'   : LoopCount     ,
+    'reboots.total': RebootsTotal  ,
+    'reboots.show' : RebootsShow   ,
+    'loop.time'    : LoopTime      ,
+    'activity'     : list(Activity),
+    'binary'       : Wb4Binary     ,
+    'next.poll'    : NextPoll      ,
+    'record.file'  : RECORD_FILE   ,
+    'record.whole' : RecordEnd()   ,
+  }
+  try:
+    with open(CHECKPOINT_FILE + '.tmp', 'w') as f:
+      json.dump(Checkpoint, f)
+    os.rename(CHECKPOINT_FILE + '.tmp', CHECKPOINT_FILE)
+  except (IOError, OSError) as er:
+    Print('[%02d] checkpoint error: %s' % (LoopCount, er), 'syslog')
 
 #----------------------------------------------------------------------
 # main
@@ -297,30 +734,98 @@ PS_URL_GET    = 'https://www.pwsweather.com/pwsupdate/pwsupdate.php'
 
 PermaLog('%s %s' % (PROGRAM, VERSION))
 Print('[00] pid %d' % (os.getpid()), 'permalog')
+Startup('modules')
 
+Checkpoint = CheckpointRead()
 DbInit()
-Wb4Init()
+Startup('database')
+JournalInit()
+Startup('journal')
+RecordInit(Checkpoint.get('record.whole', 0) if Checkpoint.get('record.file') == RECORD_FILE else 0)
+Startup('recording')
+Wb4Init(Checkpoint)
+Startup('serial')
 
 FAILSAFE_MAX = 5 # minutes without wb4 msx before auto-exit
 
 FailSafe     = 0 # runcount of bad wb4 queries
-RebootsTotal = 0 # wb4 reboot count
-RebootsShow  = 0 # wb4 reboots since cleared
+RebootsTotal = Checkpoint.get('reboots.total', 0) # wb4 reboot count
+RebootsShow  = Checkpoint.get('reboots.show' , 0) # wb4 reboots since cleared
+
+LoopCount = Checkpoint.get('loop.count', LoopCount)
+LoopTime  = Checkpoint.get('loop.time' , LoopTime )
+Activity.extend(Checkpoint.get('activity', []))
 
 ReportedMask = 0x00 # MASK_REPORTED_PS | MASK_REPORTED_WU
 
+StartupDone(Checkpoint)
+LoopEnd    = Checkpoint.get('next.poll', 0) # a warm restart waits out the poll it was due
+NextSample = time.time() + SAMPLE_TIME_SECS
+PollGood   = False
+if LoopEnd > time.time():
+  Print('[%02d] resume, poll in %ds' % (LoopCount, LoopEnd - time.time()), 'syslog')
+
 try:
   ExitLoop = False
   PowerOff = False
   while not ExitLoop:
+    # wait out the interval to the next poll, sampling and minding the
+    # buttons.  after a warm restart the first wait is what was left of
+    # the interval the last run was in.
+    while time.time() < LoopEnd:
+      sleep(0.1)
+      if PollGood and time.time() - WatchdogTime >= WATCHDOG_WAIT_SECS:
+        WatchdogReset()
+      if SAMPLE_TIME_SECS and time.time() >= NextSample:
+        if NextSample + SAMPLE_BUDGET_SECS < LoopEnd:
+          if SampleWb4() > SAMPLE_BUDGET_SECS:
+            Print('[%02d] sample over budget' % (LoopCount), 'syslog')
+            metrics.Count('sample_over_budget')
+            NextSample += SAMPLE_TIME_SECS # skip a slot
+            SampleSkips += 1
+        NextSample += SAMPLE_TIME_SECS
+      if Oled:
+        if GpioInput(BCM_BUTTON_TOP):
+          if PowerOff:
+            PowerOff = False
+            Print('[%02d] poweroff false' % (LoopCount), 'permalog')
+        if GpioInput(BCM_BUTTON_MIDDLE):
+          Print('[%02d] middle' % (LoopCount), 'syslog')
+        if GpioInput(BCM_BUTTON_BOTTOM):
+          if not PowerOff:
+            PowerOff = True
+            Print('[%02d] poweroff true' % (LoopCount), 'permalog')
+        if GpioInput(BCM_JOYSTICK_UP):
+          Print('[%02d] reset status' % (LoopCount), 'permalog')
+          RebootsShow = 0
+        if GpioInput(BCM_JOYSTICK_DOWN):
+          if not ExitLoop:
+            Print('[%02d] exitloop true' % (LoopCount), 'permalog')
+            ExitLoop = True
+            break
+        if GpioInput(BCM_JOYSTICK_LEFT):
+          Print('[%02d] left' % (LoopCount), 'syslog')
+        if GpioInput(BCM_JOYSTICK_RIGHT):
+          Print('[%02d] right' % (LoopCount), 'syslog')
+        if GpioInput(BCM_JOYSTICK_CENTER):
+          Print('[%02d] center' % (LoopCount), 'permalog')
+    if ExitLoop:
+      break
     if LoopCount > 98:
       LoopCount = 0 # keep loopcount 2 digits 01..99
     LoopCount += 1
+    LoopStart = time.time()
+    LoopWait = LOOP_TIME_SECS # unless the poll succeeds
+    PollGood = False
+    if Profiler:
+      Profiler.Start()
 
     try:
-      wb = Wb4Json('now')
+      wb = Wb4Now()
+      metrics.Timed('poll', LoopStart)
       if wb:
         FailSafe = 0
+        PollGood = True
         Print('[%02d] wb4   ok %d' % (LoopCount, wb['tau.status']), 'syslog')
         WatchdogReset() # only on the raspberry pi
 
@@ -332,15 +837,25 @@ try:
         if RebootsTotal != BootCount:
           if RebootsTotal:
             Print('[%02d] wb4 reboot %d' % (LoopCount, BootCount), 'permalog')
+            metrics.Count('wb4_reboot')
           RebootsTotal = BootCount
           RebootsShow += 1
 
         #------------------------------------------------------------------
-        # convert celsius to fahrenheit with one decimal precision
+        # fold in any sub-minute samples taken since the last report
         #------------------------------------------------------------------
 
-        wb['dewpoint.f'] = round((wb['dewpoint.c'] * 1.8) + 32.0, 1)
-        wb['temp.f'    ] = round((wb['temp.c'    ] * 1.8) + 32.0, 1)
+        SampleReduce(wb)
+
+        #------------------------------------------------------------------
+        # convert to the observation we report and record, which takes
+        # celsius to fahrenheit with one decimal precision, noting the
+        # cadence we're polling at so condense.py knows how many epochs
+        # to expect in a quarter
+        #------------------------------------------------------------------
+
+        wb['loop.secs'] = LoopTime
+        Obs = Observation.FromWb(wb)
 
         #------------------------------------------------------------------
         # get the actual utc time and convert to epoch
@@ -348,16 +863,13 @@ try:
 
         wb['actual.utc'  ] = str(datetime.utcnow())[:-7]
         wb['actual.epoch'] = calendar.timegm(time.strptime(wb['actual.utc'], TimePattern))
+        Record(wb4.RECORD_POLL, wb4.RecordEpoch.pack(wb['actual.epoch']))
 
         #------------------------------------------------------------------
         # get the weatherbox4 utc time and convert to epoch
         #------------------------------------------------------------------
 
-        wb['time.utc'] = '%4d-%02d-%02d %02d:%02d:%02d' % (
-          wb['time.year'], wb['time.month' ], wb['time.day'   ],
-          wb['time.hour'], wb['time.minute'], wb['time.second']
-        )
-        wb['time.epoch'] = calendar.timegm(time.strptime(wb['time.utc'], TimePattern))
+        wb4.ClockEpoch(wb)
 
         #------------------------------------------------------------------
         # compare the actual and weatherbox4 epochs.  if they differ by
@@ -369,8 +881,12 @@ try:
         if TimeError > 60:
           TimeSetCmd = 'time=' + wb['actual.utc'].replace(' ',',')
           Print('[%02d] wb4 time set' % (LoopCount), 'permalog')
+          metrics.Count('clock_set')
           try:
-            if Wb4Json(TimeSetCmd, True):
+            Start = time.time()
+            Ok = Wb4Json(TimeSetCmd, True)
+            metrics.Timed('clock_set', Start)
+            if Ok:
               Print('[%02d] wb4   ok' % (LoopCount), 'syslog')
             else:
               Print('[%02d] wb4 bad' % (LoopCount), 'permalog')
@@ -389,26 +905,16 @@ try:
         #------------------------------------------------------------------
 
         ReportedMask &= ~MASK_REPORTED_WU
+        Status = 0
         try:
-          Data = {
-            'ID'          :                WU_STATION_ID    ,
-            'PASSWORD'    :      Password['WU_PASSWORD'   ] ,
-            'dateutc'     : '%s'    % (wb['actual.utc'    ]),
-            'winddir'     : '%1.0f' % (wb['wind.direction']),
-            'windspeedmph': '%d'    % (wb['wind.mph'      ]),
-            'rainin'      : '%4.2f' % (wb['rain.in'       ]),
-            'dailyrainin' : '%4.2f' % (wb['rain.day.in'   ]),
-            'humidity'    : '%d'    % (wb['humidity.pct'  ]),
-            'dewptf'      : '%3.1f' % (wb['dewpoint.f'    ]),
-            'UV'          : '%d'    % (wb['tau.status'    ]),
-            'tempf'       : '%3.1f' % (wb['temp.f'        ]),
-            'baromin'     : '%0.3f' % (wb['pressure.inhg' ]),
-            'action'      :               'updateraw'
-          }
+          Data = Obs.Upstream(WU_STATION_ID, Password['WU_PASSWORD'], wb['actual.utc'])
           if not Oled:
             Print('[%02d] %s' % (LoopCount, WU_URL_GET))
-          if Oled:
-            r = requests.get(WU_URL_GET, params=Data)
+          if WU_REPORT:
+            Start = time.time()
+            r = HttpGet(WU_URL_GET, Data)
+            metrics.Timed('wu', Start)
+            Status = r.status_code
             if r.status_code == 200:
               Print('[%02d] wu    ok' % (LoopCount), 'syslog')
               ReportedMask |= MASK_REPORTED_WU
@@ -416,32 +922,25 @@ try:
               Print('[%02d] wu bad %d' % (LoopCount, r.status_code), 'permalog')
         except:
           Print('[%02d] wu err' % (LoopCount), 'permalog')
+          Status = -1
+        Record(wb4.RECORD_WU, wb4.RecordStatus.pack(Status))
+        metrics.Count('wu_error', Status not in (0, 200))
 
         #------------------------------------------------------------------
         # report data to aeris
         #------------------------------------------------------------------
 
         ReportedMask &= ~MASK_REPORTED_PS
+        Status = 0
         try:
-          Data = {
-            'ID'          :                PS_STATION_ID    ,
-            'PASSWORD'    :      Password['PS_PASSWORD'   ] ,
-            'dateutc'     : '%s'    % (wb['actual.utc'    ]),
-            'winddir'     : '%1.0f' % (wb['wind.direction']),
-            'windspeedmph': '%d'    % (wb['wind.mph'      ]),
-            'rainin'      : '%4.2f' % (wb['rain.in'       ]),
-            'dailyrainin' : '%4.2f' % (wb['rain.day.in'   ]),
-            'humidity'    : '%d'    % (wb['humidity.pct'  ]),
-            'dewptf'      : '%3.1f' % (wb['dewpoint.f'    ]),
-            'UV'          : '%d'    % (wb['tau.status'    ]),
-            'tempf'       : '%3.1f' % (wb['temp.f'        ]),
-            'baromin'     : '%0.3f' % (wb['pressure.inhg' ]),
-            'action'      :               'updateraw'
-          }
+          Data = Obs.Upstream(PS_STATION_ID, Password['PS_PASSWORD'], wb['actual.utc'])
           if not Oled:
             Print('[%02d] %s' % (LoopCount, PS_URL_GET))
-          if Oled:
-            r = requests.get(PS_URL_GET, params=Data)
+          if PS_REPORT:
+            Start = time.time()
+            r = HttpGet(PS_URL_GET, Data)
+            metrics.Timed('aeris', Start)
+            Status = r.status_code
             if r.status_code == 200:
               Print('[%02d] aeris ok' % (LoopCount), 'syslog')
               ReportedMask |= MASK_REPORTED_PS
@@ -449,93 +948,57 @@ try:
               Print('[%02d] aeris bad %d' % (LoopCount, r.status_code), 'permalog')
         except:
           Print('[%02d] aeris err' % (LoopCount), 'permalog')
+          Status = -1
+        Record(wb4.RECORD_PS, wb4.RecordStatus.pack(Status))
+        metrics.Count('aeris_error', Status not in (0, 200))
 
         #------------------------------------------------------------------
         # record the current data in the database
         #------------------------------------------------------------------
 
-        sql = 'INSERT INTO epoch ('
-        sql += 'id,'
-        sql += 'boot_count,'
-        sql += 'uptime_minutes,'
-        sql += 'temp_f,'
-        sql += 'dewpoint_f,'
-        sql += 'humidity_pct,'
-        sql += 'pressure_inhg,'
-        sql += 'wind_mph,'
-        sql += 'wind_direction,'
-        sql += 'rain_in,'
-        sql += 'rain_day_in,'
-        sql += 'power_volt,'
-        sql += 'tau_status,'
-        sql += 'log_next,'
-        sql += 'log_full,'
-        sql += 'reported_mask) VALUES ('
-        sql += '%d,'    % wb['actual.epoch'   ]
-        sql += '%d,'    % wb['boot.count'     ]
-        sql += '%d,'    % wb['uptime.minutes' ]
-        sql += '%3.1f,' % wb['temp.f'         ]
-        sql += '%3.1f,' % wb['dewpoint.f'     ]
-        sql += '%d,'    % wb['humidity.pct'   ]
-        sql += '%0.3f,' % wb['pressure.inhg'  ]
-        sql += '%d,'    % wb['wind.mph'       ]
-        sql += '%1.0f,' % wb['wind.direction' ]
-        sql += '%4.2f,' % wb['rain.in'        ]
-        sql += '%4.2f,' % wb['rain.day.in'    ]
-        sql += '%6.3f,' % wb['power.volt'     ]
-        sql += '%d,'    % wb['tau.status'     ]
-        sql += '%d,'    % wb['log.next'       ]
-        sql += '%d,'    % wb['log.full'       ]
-        sql += '%d);'   % ReportedMask
-        DbExecute('write', sql)
+        Obs.reported_mask = ReportedMask
+        Start = time.time()
+        EpochWrite(Obs.Insert('epoch', wb['actual.epoch']))
+        metrics.Timed('db_write', Start)
+        metrics.Gauge('clock_error_seconds', TimeError)
 
         Print('[%02d] dt=%02d %d' % (LoopCount, TimeError, RebootsShow), 'syslog')
 
+        #------------------------------------------------------------------
+        # pick the interval to the next poll based on recent activity
+        #------------------------------------------------------------------
+
+        AdaptLoopTime(wb)
+        LoopWait = LoopTime
+
       else:
         Print('[%02d] wb4 bad %d' % (LoopCount, r.status_code), 'permalog')
     except:
       Print('[%02d] wb4 err' % (LoopCount), 'permalog')
 
-    Print('[%02d] sleep %d' % (LoopCount, LOOP_TIME_SECS), 'syslog')
+    Print('[%02d] sleep %d' % (LoopCount, LoopWait), 'syslog')
 
+    metrics.Count('poll')
+    metrics.Count('poll_error', not PollGood)
     FailSafe += 1
     if FailSafe > FAILSAFE_MAX:
       Print('[%02d] failsafe' % (LoopCount), 'permalog') # we expect to exit and be auto-restarted
+      metrics.Count('failsafe')
       ExitLoop = True
-    else:
-      for Second in range(LOOP_TIME_SECS):
-        for Tick in range(10):
-          sleep(0.1)
-          if Oled:
-            if GpioInput(BCM_BUTTON_TOP):
-              if PowerOff:
-                PowerOff = False
-                Print('[%02d] poweroff false' % (LoopCount), 'permalog')
-            if GpioInput(BCM_BUTTON_MIDDLE):
-              Print('[%02d] middle' % (LoopCount), 'syslog')
-            if GpioInput(BCM_BUTTON_BOTTOM):
-              if not PowerOff:
-                PowerOff = True
-                Print('[%02d] poweroff true' % (LoopCount), 'permalog')
-            if GpioInput(BCM_JOYSTICK_UP):
-              Print('[%02d] reset status' % (LoopCount), 'permalog')
-              RebootsShow = 0
-            if GpioInput(BCM_JOYSTICK_DOWN):
-              if not ExitLoop:
-                Print('[%02d] exitloop true' % (LoopCount), 'permalog')
-                ExitLoop = True
-                break
-            if GpioInput(BCM_JOYSTICK_LEFT):
-              Print('[%02d] left' % (LoopCount), 'syslog')
-            if GpioInput(BCM_JOYSTICK_RIGHT):
-              Print('[%02d] right' % (LoopCount), 'syslog')
-            if GpioInput(BCM_JOYSTICK_CENTER):
-              Print('[%02d] center' % (LoopCount), 'permalog')
-        if ExitLoop:
-          break
+    metrics.Timed('loop', LoopStart)
+    metrics.Gauge('loop_wait_seconds', LoopWait)
+    metrics.Write(METRICS_FILE, METRICS_PREFIX)
+    CheckpointWrite(LoopStart + LoopWait)
+    if Profiler:
+      Profiler.Stop()
+    LoopEnd = LoopStart + LoopWait
+    NextSample = LoopStart + SAMPLE_TIME_SECS
 except:
   Print('[%02d] exception' % (LoopCount), 'permalog')
 
+JournalClose()
+RecordClose()
+
 if PowerOff:
   if Oled:
     Print('[%02d] poweroff' % (LoopCount), 'permalog')
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+PROGRAM = 'replay.py'
+VERSION = '2.610.191'
+CONTACT = 'bright.tiger@mail.com' # michael nagy
+
+#==============================================================================
+# play a recording of proxy-logger.py traffic (see PROXY_RECORD there)
+# back through the same parsing, conversion, clock check and database
+# write, as fast as it will go or at a given speedup, and time each:
+#
+#   replay.py recording [-to url] [-speed n] [-group n] [-keep]
+#
+#   parse     each serial reply, json or binary frame (wb4.py)
+#   convert   the minute's samples reduced, the Observation built and
+#             both upstream payloads formatted
+#   clock     the weatherbox time against the logged time
+#   write     each database commit, a row at a time as proxy-logger.py
+#             does by default, or -group n rows at a time as it does
+#             with GROUP_COMMIT_ROWS
+#
+# the rows go to a scratch table, replay_epoch, in the configured
+# database or the one given by url, which is dropped when we're done
+# unless -keep is given.  the live epoch table is never touched.  the
+# reported mask of each row comes from the upstream outcomes recorded
+# with it, so replayed rows match the logged ones.  -speed 1440 plays
+# a day in a minute, and the default of 0 doesn't wait at all.
+#
+# nothing is sent anywhere and there's no serial port, so the timings
+# are those of the logger's own code.  run it before and after a change
+# to the logger to see what the change costs on real traffic.
+#==============================================================================
+
+import io, sys, time, storage, wb4
+from observation import Observation, CreateSql, InsertSql
+
+TABLE = 'replay_epoch'
+
+STAGES = ('parse', 'convert', 'clock', 'write')
+
+TIME_SET_SECS = 60 # as in proxy-logger.py
+
+MASK_REPORTED_WU = 0x01
+MASK_REPORTED_PS = 0x02
+
+#----------------------------------------------------------------------
+# stage timings, kept in full so we can give percentiles
+#----------------------------------------------------------------------
+
+Timings = dict((Stage, []) for Stage in STAGES)
+
+def Timed(Stage, Start):
+  End = time.time()
+  Timings[Stage].append(End - Start)
+  return End
+
+def Percentile(Values, Fraction):
+  return sorted(Values)[min(len(Values) - 1, int(Fraction * len(Values)))]
+
+#----------------------------------------------------------------------
+# the database write, a row or a group at a time
+#----------------------------------------------------------------------
+
+Sql = InsertSql('epoch', TABLE)
+
+Batch = []
+WriteErrors = 0
+
+def Write(Url, Params=None, Group=0):
+  global WriteErrors
+  if Params:
+    Batch.append(Params)
+  if not Batch or len(Batch) < Group and Params:
+    return
+  Start = time.time()
+  try:
+    Db = storage.Connect(Url)
+    Db.cursor().executemany(Sql, Batch)
+    Db.commit()
+    Db.close()
+  except storage.Error as er:
+    print('  write error: %s' % (er))
+    WriteErrors += 1
+  Timed('write', Start)
+  del Batch[:]
+
+#----------------------------------------------------------------------
+# main
+#----------------------------------------------------------------------
+
+print()
+print('%s %s' % (PROGRAM, VERSION))
+print()
+Path  = None
+Url   = storage.DB_URL
+Speed = 0.0
+Group = 0
+Keep  = False
+try:
+  Args = sys.argv[1:]
+  while Args:
+    Arg = Args.pop(0)
+    if Arg.lower().startswith('-t'):
+      Url = Args.pop(0)
+      storage.ParseUrl(Url)
+    elif Arg.lower().startswith('-s'):
+      Speed = float(Args.pop(0))
+    elif Arg.lower().startswith('-g'):
+      Group = int(Args.pop(0))
+    elif Arg.lower().startswith('-k'):
+      Keep = True
+    elif not Path and not Arg.startswith('-'):
+      Path = Arg
+    else:
+      raise ValueError(Arg)
+  if not Path:
+    raise ValueError(Path)
+except:
+  print('bad arguments - specify recording [-to url] [-speed n] [-group n] [-keep]')
+  print()
+  sys.exit(1)
+
+try:
+  Db = storage.Connect(Url)
+  Cursor = Db.cursor()
+  Cursor.execute('DROP TABLE IF EXISTS %s' % (TABLE))
+  Cursor.execute(CreateSql('epoch', TABLE))
+  Db.commit()
+  Db.close()
+except storage.Error as er:
+  print('db error: %s' % (er))
+  sys.exit(1)
+
+Replies = BadReplies = Samples = Polls = TimeSets = 0
+Upstream = {wb4.RECORD_WU: {}, wb4.RECORD_PS: {}}
+Logged = {True: 0, False: 0}
+
+wb = None      # the last reply parsed
+Ring = []      # samples kept since the last poll
+Pending = None # the last poll's observation and epoch, until written
+First = Last = None
+Start = time.time()
+try:
+  for Kind, Time, Payload in wb4.RecordRead(Path):
+    if First is None:
+      First = Time
+    Last = Time
+    if Speed:
+      Wait = Start + (Time - First) / Speed - time.time()
+      if Wait > 0:
+        time.sleep(Wait)
+
+    if Kind in (wb4.RECORD_JSON, wb4.RECORD_FRAME):
+      Begin = time.time()
+      if Kind == wb4.RECORD_JSON:
+        wb = wb4.JsonParse(Payload)
+      else:
+        wb = wb4.FrameRead(io.BytesIO(Payload).read)[1]
+      Timed('parse', Begin)
+      Replies += 1
+      BadReplies += not wb
+
+    elif Kind == wb4.RECORD_SAMPLE and wb:
+      Ring.append(wb4.SampleOf(wb))
+      Samples += 1
+
+    elif Kind == wb4.RECORD_POLL and wb:
+      if Pending:
+        Write(Url, Pending[0].Insert('epoch', Pending[1]), Group)
+      Begin = time.time()
+      Ring.append(wb4.SampleOf(wb))
+      wb4.ReduceSamples(wb, Ring)
+      Ring = []
+      Obs = Observation.FromWb(wb)
+      UtcTime = time.strftime(wb4.TimePattern, time.gmtime(Time))
+      Obs.Upstream('replay', 'replay', UtcTime)
+      Obs.Upstream('replay', 'replay', UtcTime)
+      Obs.reported_mask = 0
+      Begin = Timed('convert', Begin)
+      Epoch = wb4.RecordEpoch.unpack(Payload)[0]
+      TimeSets += abs(wb4.ClockEpoch(wb) - Epoch) > TIME_SET_SECS
+      Timed('clock', Begin)
+      Pending = (Obs, Epoch)
+      Polls += 1
+
+    elif Kind in Upstream:
+      Status = wb4.RecordStatus.unpack(Payload)[0]
+      Upstream[Kind][Status] = Upstream[Kind].get(Status, 0) + 1
+      if Pending and Status == 200:
+        Pending[0].reported_mask |= MASK_REPORTED_WU if Kind == wb4.RECORD_WU else MASK_REPORTED_PS
+
+    elif Kind == wb4.RECORD_DB:
+      Ok, Rows = wb4.RecordWrite.unpack(Payload)
+      Logged[bool(Ok)] += 1
+      if Pending:
+        Write(Url, Pending[0].Insert('epoch', Pending[1]), Group)
+        Pending = None
+except (IOError, ValueError) as er:
+  print('recording error: %s' % (er))
+  sys.exit(1)
+if Pending:
+  Write(Url, Pending[0].Insert('epoch', Pending[1]), Group)
+Write(Url)
+Elapsed = max(time.time() - Start, 0.001)
+
+if not Keep:
+  Db = storage.Connect(Url)
+  Db.cursor().execute('DROP TABLE %s' % (TABLE))
+  Db.commit()
+  Db.close()
+
+#----------------------------------------------------------------------
+# report
+#----------------------------------------------------------------------
+
+def Statuses(Counts):
+  return ', '.join('%d x %s' % (Counts[Status],
+    {0: 'not sent', -1: 'failed'}.get(Status, Status)) for Status in sorted(Counts)) or 'none'
+
+Span = (Last - First) if First is not None else 0.0
+print('%s: %0.2f hours of traffic replayed in %0.2fs (%0.0fx)' % (
+  Path, Span / 3600.0, Elapsed, Span / Elapsed))
+print()
+print('  %d replies (%d bad), %d samples, %d polls, %d clock sets' % (
+  Replies, BadReplies, Samples, Polls, TimeSets))
+print('  recorded wu: %s' % (Statuses(Upstream[wb4.RECORD_WU])))
+print('  recorded aeris: %s' % (Statuses(Upstream[wb4.RECORD_PS])))
+print('  recorded writes: %d ok, %d failed; replayed to %s: %d failed' % (
+  Logged[True], Logged[False], Url, WriteErrors))
+print()
+print('  %-8s %8s %10s %10s %10s %10s' % ('stage', 'count', 'total ms', 'mean ms', 'p95 ms', 'max ms'))
+for Stage in STAGES:
+  Values = Timings[Stage]
+  if Values:
+    print('  %-8s %8d %10.1f %10.3f %10.3f %10.3f' % (Stage, len(Values), 1000.0 * sum(Values),
+      1000.0 * sum(Values) / len(Values), 1000.0 * Percentile(Values, 0.95), 1000.0 * max(Values)))
+print()
+
+#==============================================================================
+# end
+#==============================================================================
@@ -1,7 +1,10 @@
 #!/bin/bash
 
-mkdir -p data
-cd data
-tar xf ../weather.tgz
-psql weather < ./weather.db > /dev/null
-../summary.py
+# report on the local weather database as it stands, kept up to date
+# by incremental snapshots.  './report.sh restore [weather.tgz]' first
+# replaces it with a full snapshot (see restore.sh).
+
+if [ "$1" == 'restore' ]; then
+  ./restore.sh ${2:-weather.tgz} || exit 1
+fi
+./summary.py
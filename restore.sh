@@ -0,0 +1,63 @@
+#!/bin/bash
+
+PROGRAM='restore.sh'
+VERSION='2.610.191'
+CONTACT='bright.tiger@gmail.com'
+
+# Restore a full snapshot archive (see snapshot.sh) into a fresh local
+# weather database, and check it against the snapshot's manifest:
+#
+#   ./restore.sh [weather.tgz]
+#
+# Current snapshots hold a custom format dump, which pg_restore loads
+# with RESTORE_JOBS parallel workers.  It copies the epoch and quarter
+# rows into bare tables first, and only then builds the primary keys
+# and other indexes, in parallel, and adds the triggers.  The session
+# settings in PGOPTIONS give the index builds more memory and skip the
+# commit flushes, since a failed restore is simply run again.  Older
+# snapshots hold a plain sql dump, which is still replayed with psql.
+#
+# Afterwards the row count and checksum of each month are compared
+# with the manifest (see './snapshot.sh manifest'), and any month that
+# differs is listed and we exit with an error.
+
+Archive=${1:-weather.tgz}
+
+RESTORE_JOBS=`nproc`
+
+export PGOPTIONS='-c maintenance_work_mem=256MB -c synchronous_commit=off'
+
+mkdir -p data
+rm -f data/weather.db data/weather.dump data/manifest.txt
+tar xf $Archive -C data || exit 1
+
+echo
+echo -n 'Restoring snapshot...'
+dropdb --if-exists weather && createdb weather || exit 1
+if [ -f data/weather.dump ]; then
+  pg_restore -j $RESTORE_JOBS --no-owner -d weather data/weather.dump || exit 1
+else
+  psql -q weather < data/weather.db > /dev/null
+fi
+psql -qc 'ANALYZE' weather
+echo 'done.'
+
+if [ -f data/manifest.txt ]; then
+  echo -n 'Verifying manifest...'
+  ./snapshot.sh manifest > data/manifest.local
+  if diff data/manifest.txt data/manifest.local > data/manifest.diff; then
+    echo "$(wc -l < data/manifest.txt) table months verified."
+  else
+    echo 'mismatch.'
+    echo
+    echo 'table month rows checksum (< snapshot, > restored)'
+    grep '^[<>]' data/manifest.diff
+    echo
+    exit 1
+  fi
+fi
+echo
+
+#
+# End
+#
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+PROGRAM = 'scheduler.py'
+VERSION = '2.610.191'
+CONTACT = 'bright.tiger@mail.com' # michael nagy
+
+#==============================================================================
+# a resident scheduler for the batch scripts, in place of their cron
+# entries.  each job runs its script in our own process, so python, the
+# database driver, requests and the rest are loaded once rather than on
+# every run, the scripts share database connections (see Sharing in
+# storage.py), and backfill.py shares our http session and its kept
+# alive connections.  jobs run one at a time, never two at once, and
+# each is triggered by one of
+#
+#   ('quarter', n)   n seconds after each quarter hour closes
+#   ('after', job)   as soon as the named job has finished
+#   ('daily', time)  at the given local hh:mm each day
+#
+# quarter jobs also run once when we start, to catch up on anything
+# missed while we were down.  a job still running when it should start
+# again isn't queued twice - it just runs once more straight after.  a
+# script ending with sys.exit or an exception ends only its job.
+#
+#   scheduler.py [-run job ...]
+#
+# with -run, the named jobs are run once, in order, and we exit.  each
+# job's run time goes to the permanent log, and timings and counters for
+# the jobs and the database and http work inside them go to a stats file
+# (METRICS_FILE, see metrics.py).  jobs, including those started with
+# -run, hold LOCK_FILE while they run, so a manual run waits for the
+# service's current job to finish.  the systemd unit file is
+#
+#   /etc/systemd/system/scheduler.service
+#
+# and the cron entries for the scripts it runs should then be removed.
+#==============================================================================
+
+import os, sys, time, fcntl, runpy, traceback, requests, storage, metrics
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+LOCK_FILE      = '/home/pi/weather/.scheduler.lock'
+METRICS_FILE   = os.environ.get('SCHEDULER_METRICS', '/dev/shm/scheduler.prom')
+METRICS_PREFIX = 'scheduler'
+
+#----------------------------------------------------------------------
+# the jobs - name, script, arguments and trigger.  the report is the
+# daily summary.py statistics, which land in syslog with the rest of
+# our output.
+#----------------------------------------------------------------------
+
+JOBS = (
+  ('condense', 'condense.py', ['-y'], ('quarter', 120       )),
+  ('backfill', 'backfill.py', [    ], ('after'  , 'condense')),
+  ('battery' , 'battery.py' , [    ], ('daily'  , '00:10'   )),
+  ('report'  , 'summary.py' , [    ], ('daily'  , '00:15'   )),
+)
+
+#----------------------------------------------------------------------
+# the standard utc and local time string format we use throughout
+#----------------------------------------------------------------------
+
+TimePattern = '%Y-%m-%d %H:%M:%S'
+
+def LocalTimeStr(Epoch):
+  return time.strftime(TimePattern, time.localtime(Epoch))
+
+#----------------------------------------------------------------------
+# write a timestamped message to the permanent log file
+#----------------------------------------------------------------------
+
+def PermaLog(Text):
+  Time = LocalTimeStr(time.time())
+  with open('/home/pi/weather/permanent.log', 'a') as f:
+    f.write('%s %s %s\n' % (Time, PROGRAM, Text))
+
+#----------------------------------------------------------------------
+# write a message to the console and the permanent log file
+#----------------------------------------------------------------------
+
+def Print(Text):
+  print('%s' % (Text))
+  sys.stdout.flush()
+  PermaLog(Text.strip())
+
+#----------------------------------------------------------------------
+# the next time a trigger fires after the given time, or None for an
+# 'after' trigger, which is fired by its job instead
+#----------------------------------------------------------------------
+
+def NextTime(Trigger, After):
+  Kind, Value = Trigger
+  if Kind == 'quarter':
+    return (int(After - Value) // 900 + 1) * 900 + Value
+  if Kind == 'daily':
+    Hour, Minute = [int(Part) for Part in Value.split(':')]
+    Day = time.localtime(After)
+    Next = time.mktime((Day.tm_year, Day.tm_mon, Day.tm_mday, Hour, Minute, 0, 0, 0, -1))
+    if Next <= After:
+      Next = time.mktime((Day.tm_year, Day.tm_mon, Day.tm_mday + 1, Hour, Minute, 0, 0, 0, -1))
+    return Next
+  return None
+
+#----------------------------------------------------------------------
+# run one job's script to the end, as if it were run from the command
+# line, and return whether it succeeded.  the script gets a fresh set of
+# globals each run, plus our http session.
+#----------------------------------------------------------------------
+
+Http = requests.Session()
+
+def RunJob(Name, Script, Args):
+  Status = 0
+  Argv = sys.argv
+  sys.argv = [os.path.join(HERE, Script)] + Args
+  with open(LOCK_FILE, 'a') as Lock:
+    fcntl.flock(Lock, fcntl.LOCK_EX)
+    Print('job %s started' % (Name))
+    Start = time.time()
+    try:
+      runpy.run_path(sys.argv[0], init_globals={'Http': Http}, run_name='__main__')
+    except SystemExit as er:
+      Status = er.code
+    except Exception as er:
+      print(traceback.format_exc())
+      Status = 'exception: %s' % (er)
+    sys.argv = Argv
+    metrics.Timed('job %s' % (Name), Start)
+    metrics.Count('job %s' % (Name))
+    if Status:
+      metrics.Count('job %s failed' % (Name))
+      Print('job %s failed in %0.1fs, %s' % (Name, time.time() - Start, Status))
+    else:
+      Print('job %s done in %0.1fs' % (Name, time.time() - Start))
+  metrics.Write(METRICS_FILE, METRICS_PREFIX)
+  return not Status
+
+#----------------------------------------------------------------------
+# main.  a job whose time has come, or whose job before it has just
+# finished, runs next.  otherwise we sleep until the next time.
+#----------------------------------------------------------------------
+
+print()
+Print('%s %s' % (PROGRAM, VERSION))
+print()
+os.environ.pop('WEATHER_PROFILE', None) # no per-run profiles, see METRICS_FILE
+storage.Sharing = True
+
+Jobs = dict((Name, (Script, Args, Trigger)) for Name, Script, Args, Trigger in JOBS)
+if '-run' in sys.argv[1:2]:
+  Names = sys.argv[2:]
+  if not Names or set(Names) - set(Jobs):
+    print('bad arguments - specify [-run job ...], jobs are %s' % (', '.join(Job[0] for Job in JOBS)))
+    print()
+    sys.exit(1)
+  Failed = 0
+  for Name in Names:
+    Failed += not RunJob(Name, *Jobs[Name][:2])
+  sys.exit(1 if Failed else 0)
+
+Now = time.time()
+Due = {}
+for Name, Script, Args, (Kind, Value) in JOBS:
+  if Kind == 'quarter':
+    Due[Name] = Now
+  elif Kind == 'daily':
+    Due[Name] = NextTime((Kind, Value), Now)
+Ready = []
+while True:
+  if not Ready:
+    Name = min(Due, key=lambda Name: Due[Name])
+    Wait = Due[Name] - time.time()
+    if Wait > 0:
+      time.sleep(Wait)
+    Ready.append(Name)
+  Name = Ready.pop(0)
+  Start = time.time()
+  RunJob(Name, *Jobs[Name][:2])
+  if Name in Due:
+    Due[Name] = NextTime(Jobs[Name][2], max(Due[Name], Start))
+    if Due[Name] <= time.time():
+      Print('job %s ran past its next start, running it again now' % (Name))
+  for After, (Script, Args, Trigger) in sorted(Jobs.items()):
+    if Trigger == ('after', Name) and After not in Ready:
+      Ready.append(After)
+
+#==============================================================================
+# end
+#==============================================================================
@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+PROGRAM = 'simulate.py'
+VERSION = '2.610.192'
+CONTACT = 'bright.tiger@mail.com' # michael nagy
+
+#==============================================================================
+# local stand-ins for everything proxy-logger.py and backfill.py talk
+# to, so that both can be run and measured on any linux box:
+#
+#   simulate.py [-baud n] [-latency secs] [-errors fraction]
+#               [-skew secs] [-log records] [-port n]
+#
+#   wb4        a pseudo terminal speaking the weatherbox4 serial protocol:
+#              'now' for json, 'bin' for a binary frame (see FrameRead in
+#              wb4.py) and 'time=yyyy-mm-dd,hh:mm:ss' to set
+#              the clock, with every byte paced at the baud rate
+#
+#   wb3        a weatherbox3 web server on the port: /now, and /log?n for
+#              record n of a ring log of the given size, a record every
+#              15 minutes, which has wrapped once already
+#
+#   upstream   weather underground and aeris on the next port, at /wu
+#              and /ps, taking every report with a 200 'success'
+#
+# every reply waits about the given latency first, and fails at the
+# given rate: the serial reply is lost, cut short or has a byte garbled,
+# and the http reply is a 500 or a dropped connection.  the wb4 clock
+# starts off by the skew, to exercise the time set in proxy-logger.py.
+# the weather is a gentle daily cycle with some noise.  a given log
+# record always reads the same, as it would from fram.
+#
+# we print the environment that points the scripts at the stand-ins:
+#
+#   WB4_PORT=/dev/pts/n WB3_URL=... WU_URL=... PS_URL=... ./proxy-logger.py
+#==============================================================================
+
+import calendar, json, math, os, random, select, struct, sys, threading, time, tty
+
+try:
+  from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+  from SocketServer import ThreadingMixIn
+except ImportError:
+  from http.server import HTTPServer, BaseHTTPRequestHandler
+  from socketserver import ThreadingMixIn
+
+BAUD        = 19200
+LATENCY     = 0.05 # seconds
+ERRORS      = 0.0  # fraction of replies that fail
+SKEW        = 0    # seconds the wb4 clock starts off by
+LOG_RECORDS = 1168 # as many as fit in the wb3 fram
+PORT        = 8031
+
+LOG_SECS = 900
+
+#----------------------------------------------------------------------
+# the standard utc and local time string format we use throughout
+#----------------------------------------------------------------------
+
+TimePattern = '%Y-%m-%d %H:%M:%S'
+
+def LocalTimeStr(Epoch):
+  return time.strftime(TimePattern, time.localtime(Epoch))
+
+def Print(Text):
+  print('%s %s' % (LocalTimeStr(time.time()), Text))
+  sys.stdout.flush()
+
+#----------------------------------------------------------------------
+# the weather at a given time, as a weatherbox dictionary.  noise is
+# seeded by the time so that a moment always reads the same.
+#----------------------------------------------------------------------
+
+Started = time.time()
+BootCount = 1
+
+def Weather(Epoch):
+  Rand = random.Random(int(Epoch))
+  Diurnal = math.cos(2 * math.pi * ((Epoch % 86400) - 72000) / 86400.0)
+  Temp = 22.0 + 6.0 * Diurnal + Rand.gauss(0, 0.3)
+  Dewpoint = Temp - 6.0 - Rand.random()
+  Utc = time.gmtime(Epoch)
+  Uptime = int(max(0, Epoch - Started) // 60)
+  return {
+    'time.year'     : Utc.tm_year                                      ,
+    'time.month'    : Utc.tm_mon                                       ,
+    'time.day'      : Utc.tm_mday                                      ,
+    'time.hour'     : Utc.tm_hour                                      ,
+    'time.minute'   : Utc.tm_min                                       ,
+    'time.second'   : Utc.tm_sec                                       ,
+    'humidity.pct'  : int(100 - 5 * (Temp - Dewpoint))                 ,
+    'wind.direction': Rand.randint(0, 15) * 22.5                       ,
+    'power.volt'    : round(12.6 + 0.8 * max(0.0, -Diurnal), 3)        ,
+    'wind.mph'      : int(abs(Rand.gauss(0, 4)))                       ,
+    'wind.avg.mph'  : 3                                                ,
+    'wind.max.mph'  : 9                                                ,
+    'tau.status'    : 1                                                ,
+    'tau.set'       : 0                                                ,
+    'temp.c'        : round(Temp, 1)                                   ,
+    'dewpoint.c'    : round(Dewpoint, 1)                               ,
+    'rain.in'       : 0.0                                              ,
+    'rain.day.in'   : 0.0                                              ,
+    'pressure.inhg' : round(30.0 + 0.1 * math.sin(Epoch / 259200.0), 3),
+    'boot.count'    : BootCount                                        ,
+    'uptime.minutes': Uptime                                           ,
+    'tau.queries'   : Uptime                                           ,
+    'tau.replies'   : Uptime                                           ,
+  }
+
+def Fails():
+  return Errors and random.random() < Errors
+
+def Wait():
+  time.sleep(Latency * random.uniform(0.5, 1.5))
+
+#----------------------------------------------------------------------
+# the wb3 ring log.  record r was written at LogStart + r * LOG_SECS,
+# and lives at index r modulo the log size.
+#----------------------------------------------------------------------
+
+def LogCount():
+  return int((time.time() - LogStart) // LOG_SECS)
+
+def LogHeader():
+  Count = LogCount()
+  return {
+    'log.size': LogRecords,
+    'log.next': Count % LogRecords,
+    'log.full': 1 if Count >= LogRecords else 0,
+  }
+
+def LogRecord(Index):
+  Count = LogCount()
+  if Index >= LogRecords or (Count < LogRecords and Index >= Count):
+    return None
+  Record = Count - 1 - ((Count - 1 - Index) % LogRecords)
+  wb = Weather(LogStart + Record * LOG_SECS)
+  wb.update(LogHeader())
+  wb['log.index'] = Index
+  return wb
+
+#----------------------------------------------------------------------
+# wb4 serial stand-in
+#----------------------------------------------------------------------
+
+FrameHeader  = struct.Struct('>2sBB')
+FramePayload = struct.Struct('>14B2h5H2HB2H')
+FrameSum     = struct.Struct('>BB')
+
+VUNIT = 0.081865 # weatherbox power.volt unit
+
+Wb4Skew = SKEW
+
+def Fletcher16(Data):
+  Sum1 = Sum2 = 0
+  for Byte in bytearray(Data):
+    Sum1 = (Sum1 + Byte) % 255
+    Sum2 = (Sum2 + Sum1) % 255
+  return Sum2, Sum1
+
+def Wb4Now():
+  wb = Weather(time.time() + Wb4Skew)
+  wb.update(LogHeader())
+  return wb
+
+def Wb4Frame(wb):
+  Payload = FramePayload.pack(
+    wb['time.year'] - 2000, wb['time.month'], wb['time.day'],
+    wb['time.hour'], wb['time.minute'], wb['time.second'], wb['humidity.pct'],
+    int(wb['wind.direction'] / 22.5), int(round(wb['power.volt'] / VUNIT)),
+    wb['wind.mph'], wb['wind.avg.mph'], wb['wind.max.mph'], wb['tau.status'], wb['tau.set'],
+    int(round(wb['temp.c'] * 10)), int(round(wb['dewpoint.c'] * 10)),
+    int(round(wb['rain.in'] / 0.011)), int(round(wb['rain.day.in'] / 0.011)),
+    int(round(wb['pressure.inhg'] * 1000)), wb['boot.count'] % 65536,
+    wb['uptime.minutes'] % 65536, wb['log.size'], wb['log.next'], wb['log.full'],
+    wb['tau.queries'] % 65536, wb['tau.replies'] % 65536)
+  return FrameHeader.pack(b'WB', 1, len(Payload)) + Payload + FrameSum.pack(*Fletcher16(Payload))
+
+def Wb4Reply(Command):
+  global Wb4Skew
+  if Command == 'bin':
+    return Wb4Frame(Wb4Now())
+  if Command.startswith('time='):
+    Target = calendar.timegm(time.strptime(Command[5:], '%Y-%m-%d,%H:%M:%S'))
+    Wb4Skew = int(Target - time.time())
+    Print('wb4 time set, skew now %ds' % (Wb4Skew))
+  return ('%s\r\n' % (json.dumps(Wb4Now(), sort_keys=True))).encode('ascii')
+
+def Wb4Send(Master, Reply):
+  if Fails():
+    Choice = random.choice(('lost', 'short', 'garbled'))
+    Print('wb4 reply %s' % (Choice))
+    if Choice == 'lost':
+      return
+    if Choice == 'short':
+      Reply = Reply[:len(Reply) // 2]
+    else:
+      Reply = bytearray(Reply)
+      Reply[random.randrange(len(Reply))] ^= 0x55
+      Reply = bytes(Reply)
+  ByteSecs = 10.0 / Baud # start, eight data bits, stop
+  for Offset in range(0, len(Reply), 16):
+    Chunk = Reply[Offset:Offset + 16]
+    os.write(Master, Chunk)
+    time.sleep(len(Chunk) * ByteSecs)
+
+def Wb4Serve(Master):
+  Command = b''
+  while True:
+    select.select([Master], [], [])
+    for Byte in bytearray(os.read(Master, 256)):
+      if Byte == 13:
+        Text = Command.decode('ascii', 'replace').strip()
+        Command = b''
+        Wait()
+        Start = time.time()
+        Reply = Wb4Reply(Text)
+        Wb4Send(Master, Reply)
+        Print('wb4 %-4s %d bytes in %0.3fs' % (Text.split('=')[0] or '-', len(Reply), time.time() - Start))
+      elif Byte != 10:
+        Command += bytes(bytearray([Byte]))
+
+#----------------------------------------------------------------------
+# wb3 and upstream web stand-ins
+#----------------------------------------------------------------------
+
+class Server(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+class Handler(BaseHTTPRequestHandler):
+  def Reply(self, Body, Type='application/json'):
+    Wait()
+    if Fails():
+      if random.random() < 0.5:
+        Print('%s %s dropped' % (self.Name, self.path))
+        self.close_connection = True
+        return
+      self.send_error(500)
+      Print('%s %s 500' % (self.Name, self.path))
+      return
+    Body = Body.encode('ascii')
+    self.send_response(200)
+    self.send_header('Content-Type', Type)
+    self.send_header('Content-Length', str(len(Body)))
+    self.end_headers()
+    self.wfile.write(Body)
+    Print('%s %s 200' % (self.Name, self.path[:60]))
+
+  def log_message(self, Format, *Args):
+    pass
+
+class Wb3Handler(Handler):
+  Name = 'wb3'
+
+  def do_GET(self):
+    if self.path == '/now':
+      wb = Weather(time.time())
+      wb.update(LogHeader())
+      wb['http.message'] = 'now'
+    elif self.path.startswith('/log?') and self.path[5:].isdigit():
+      wb = LogRecord(int(self.path[5:])) or {'http.message': 'error'}
+      wb.setdefault('http.message', 'log')
+    else:
+      wb = {'http.message': 'bad.request'}
+    self.Reply(json.dumps(wb, sort_keys=True))
+
+class UpstreamHandler(Handler):
+  Name = 'upstream'
+
+  def do_GET(self):
+    if self.path.startswith('/wu') or self.path.startswith('/ps'):
+      self.Reply('success\n', 'text/plain')
+    else:
+      self.send_error(404)
+
+def HttpServe(Port, Handler):
+  Httpd = Server(('127.0.0.1', Port), Handler)
+  Thread = threading.Thread(target=Httpd.serve_forever)
+  Thread.daemon = True
+  Thread.start()
+
+#----------------------------------------------------------------------
+# main
+#----------------------------------------------------------------------
+
+print()
+print('%s %s' % (PROGRAM, VERSION))
+print()
+Baud       = BAUD
+Latency    = LATENCY
+Errors     = ERRORS
+LogRecords = LOG_RECORDS
+Port       = PORT
+try:
+  Args = sys.argv[1:]
+  while Args:
+    Arg = Args.pop(0).lower()
+    if Arg.startswith('-b'):
+      Baud = int(Args.pop(0))
+    elif Arg.startswith('-la'):
+      Latency = float(Args.pop(0))
+    elif Arg.startswith('-e'):
+      Errors = float(Args.pop(0))
+    elif Arg.startswith('-s'):
+      Wb4Skew = int(Args.pop(0))
+    elif Arg.startswith('-lo'):
+      LogRecords = int(Args.pop(0))
+    elif Arg.startswith('-p'):
+      Port = int(Args.pop(0))
+    else:
+      raise ValueError(Arg)
+except:
+  print('bad arguments - specify [-baud n] [-latency secs] [-errors fraction]')
+  print('                        [-skew secs] [-log records] [-port n]')
+  print()
+  sys.exit(1)
+
+LogStart = (time.time() - LogRecords * 3 // 2 * LOG_SECS) // LOG_SECS * LOG_SECS
+
+Master, Slave = os.openpty()
+tty.setraw(Slave) # held open so the pty survives the logger restarting
+HttpServe(Port, Wb3Handler)
+HttpServe(Port + 1, UpstreamHandler)
+Wb4Path = os.ttyname(Slave)
+print('  wb4       %s at %d bps' % (Wb4Path, Baud))
+print('  wb3       http://127.0.0.1:%d (%d record log)' % (Port, LogRecords))
+print('  upstream  http://127.0.0.1:%d/wu and /ps' % (Port + 1))
+print('  latency   %0.3fs, errors %0.1f%%, skew %ds' % (Latency, 100.0 * Errors, Wb4Skew))
+print()
+print('WB4_PORT=%s WB3_URL=http://127.0.0.1:%d WU_URL=http://127.0.0.1:%d/wu PS_URL=http://127.0.0.1:%d/ps' % (
+  Wb4Path, Port, Port + 1, Port + 1))
+print()
+sys.stdout.flush()
+try:
+  Wb4Serve(Master)
+except KeyboardInterrupt:
+  print()
+
+#==============================================================================
+# end
+#==============================================================================
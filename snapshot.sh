@@ -1,7 +1,7 @@
 #!/bin/bash
 
 PROGRAM='snapshot.sh'
-VERSION='1.809.151'
+VERSION='2.610.193'
 CONTACT='bright.tiger@gmail.com'
 
 # This script executes both locally on the raspberry pi to collect
@@ -16,32 +16,187 @@ CONTACT='bright.tiger@gmail.com'
 #   on other system: run a copy of this script on the raspberry
 #     pi and catch the resulting stdout traffic in a local .tgz
 #     backup file
+#
+# There are two kinds of snapshot, chosen by the first argument:
+#
+#   ./snapshot.sh full   the whole database plus scripts and config
+#                        in weather.tgz, restored with restore.sh
+#
+#   ./snapshot.sh        only the epoch and quarter rows changed
+#                        since the last snapshot, merged straight
+#                        into the local weather database
+#
+# An incremental snapshot is streamed from psql through gzip and the
+# ssh pipe, so nothing is staged on the pi's sd card, and a copy of
+# each one is kept locally in snapshots/.  It is a psql script that
+# merges its rows in a single transaction: new epochs are added, and
+# every day whose quarters changed (per the quarter_version counters
+# that condense.py keeps) is replaced whole.  Epochs are resent from a
+# day before the last acknowledged one, since rows can arrive late with
+# lower ids (a replayed journal, a gap backfilled from the weatherbox),
+# and those already merged are skipped.  The pi remembers what it
+# last sent in its snapshot_mark and snapshot_version tables, and only
+# takes that as the new high-water mark once the local side has
+# acknowledged a successful merge or fetch, so a failed snapshot is
+# simply sent again next time.  Run a full snapshot first, restore it
+# with restore.sh, and take incremental snapshots from then on.  A full
+# snapshot now and then is still a good idea, for the scripts.
+#
+# A full snapshot dumps the database in pg_dump's custom format, which
+# pg_restore can load in parallel, along with a manifest of the row
+# count and an md5 checksum of the rows for each month of the epoch
+# and quarter tables.  The dump and the manifest are taken from one
+# exported transaction snapshot so that they agree exactly, and
+# restore.sh checks the restored database against the manifest with
+#
+#   ./snapshot.sh manifest
+#
+# which lists the same for the local weather database.  Reals are
+# checksummed as text with extra_float_digits = 0, which formats them
+# the same way on every postgresql version.
+
+ManifestSql() {
+  cat <<'SQL'
+SET extra_float_digits = 0;
+SELECT 'epoch', to_char(to_timestamp(id) AT TIME ZONE 'UTC', 'YYYY-MM') AS month,
+  count(*), md5(string_agg(e::text, '' ORDER BY id)) FROM epoch e GROUP BY month ORDER BY month;
+SELECT 'quarter', to_char(to_timestamp(id * 900) AT TIME ZONE 'UTC', 'YYYY-MM') AS month,
+  count(*), md5(string_agg(q::text, '' ORDER BY id)) FROM quarter q GROUP BY month ORDER BY month;
+SQL
+}
+
+if [ "$1" == 'manifest' ]; then
+  ManifestSql | psql -qAt -F ' ' -v ON_ERROR_STOP=1 weather
+  exit
+fi
 
 if [ `whoami` == 'pi' ]; then
-  rm -rf snapshot/
-  mkdir snapshot
-  pg_dump -c --no-owner weather > snapshot/weather.db
-  cp /etc/systemd/system/proxy-logger.service snapshot/
-  cp weather/*.{py,sh,log} snapshot/
-  cp -R weather/fonts/ snapshot/
-  crontab -l > snapshot/crontab.list
-  cd snapshot
-  tar czf ../weather.tgz .
-  rm -rf snapshot/
+
+  # remember the high-water marks, creating the tables as needed.
+  # sent marks are promoted to acked ones by the 'ack' command.
+
+  MarkInit() {
+    psql -q weather <<'SQL'
+SET client_min_messages = warning;
+CREATE TABLE IF NOT EXISTS snapshot_mark (id INT PRIMARY KEY, acked INT, sent INT);
+INSERT INTO snapshot_mark VALUES (0, -1, -1) ON CONFLICT (id) DO NOTHING;
+CREATE TABLE IF NOT EXISTS snapshot_version (day INT PRIMARY KEY, acked INT, sent INT);
+SQL
+  }
+
+  Columns() {
+    psql -Atc "SELECT string_agg(column_name, ',' ORDER BY ordinal_position) \
+      FROM information_schema.columns WHERE table_name = '$1'" weather
+  }
+
+  case "$1" in
+  full)
+    MarkInit
+    rm -rf snapshot/
+    mkdir snapshot
+    {
+      cat <<'SQL'
+BEGIN ISOLATION LEVEL REPEATABLE READ;
+SELECT pg_export_snapshot() AS snapshot \gset
+\setenv SNAPSHOT :snapshot
+\! pg_dump -Fc --no-owner --snapshot=$SNAPSHOT -T snapshot_mark -T snapshot_version weather > snapshot/weather.dump
+UPDATE snapshot_mark SET sent = coalesce((SELECT max(id) FROM epoch), -1);
+INSERT INTO snapshot_version (day, sent) SELECT day, version FROM quarter_version
+  ON CONFLICT (day) DO UPDATE SET sent = EXCLUDED.sent;
+SQL
+      ManifestSql
+      echo 'COMMIT;'
+    } | psql -qAt -F ' ' -v ON_ERROR_STOP=1 weather > snapshot/manifest.txt || exit 1
+    # psql carries on past a failed \! command, so check the dump reads
+    pg_restore -l snapshot/weather.dump > /dev/null || exit 1
+    cp /etc/systemd/system/proxy-logger.service snapshot/
+    cp weather/*.{py,sh,log} snapshot/
+    cp -R weather/fonts/ snapshot/
+    crontab -l > snapshot/crontab.list
+    cd snapshot
+    tar czf ../weather.tgz . || exit 1
+    cd ..
+    rm -rf snapshot/
+    ;;
+  ack)
+    psql -q weather <<'SQL'
+BEGIN;
+UPDATE snapshot_mark SET acked = sent;
+UPDATE snapshot_version SET acked = sent;
+COMMIT;
+SQL
+    ;;
+  *)
+    MarkInit
+    psql -qAt -v ON_ERROR_STOP=1 -v epoch="`Columns epoch`" -v quarter="`Columns quarter`" weather <<'SQL' | gzip
+BEGIN ISOLATION LEVEL REPEATABLE READ;
+CREATE TEMP TABLE changed AS
+  SELECT v.day, v.version FROM quarter_version v LEFT JOIN snapshot_version s ON s.day = v.day
+  WHERE s.acked IS DISTINCT FROM v.version;
+\echo 'BEGIN;'
+\echo 'CREATE TEMP TABLE delta_epoch (LIKE epoch);'
+\echo 'COPY delta_epoch (' :epoch ') FROM stdin;'
+COPY (SELECT :epoch FROM epoch WHERE id > (SELECT acked - 86400 FROM snapshot_mark) ORDER BY id) TO STDOUT;
+\echo '\\.'
+\echo 'CREATE TEMP TABLE delta_day (day INT PRIMARY KEY);'
+\echo 'COPY delta_day FROM stdin;'
+COPY (SELECT day FROM changed ORDER BY day) TO STDOUT;
+\echo '\\.'
+\echo 'CREATE TEMP TABLE delta_quarter (LIKE quarter);'
+\echo 'COPY delta_quarter (' :quarter ') FROM stdin;'
+COPY (SELECT :quarter FROM quarter q JOIN changed c ON q.id BETWEEN c.day * 96 AND c.day * 96 + 95 ORDER BY id) TO STDOUT;
+\echo '\\.'
+\echo 'INSERT INTO epoch (' :epoch ') SELECT' :epoch 'FROM delta_epoch ON CONFLICT (id) DO NOTHING;'
+\echo 'DELETE FROM quarter q USING delta_day d WHERE q.id BETWEEN d.day * 96 AND d.day * 96 + 95;'
+\echo 'INSERT INTO quarter (' :quarter ') SELECT' :quarter 'FROM delta_quarter;'
+\echo 'COMMIT;'
+\echo '\\echo snapshot merged'
+UPDATE snapshot_mark SET sent = coalesce((SELECT max(id) FROM epoch), -1);
+INSERT INTO snapshot_version (day, sent) SELECT day, version FROM changed
+  ON CONFLICT (day) DO UPDATE SET sent = EXCLUDED.sent;
+COMMIT;
+SQL
+    ;;
+  esac
 else
-  echo
-  echo -n 'Generating snapshot...'
-  ssh pi@pi < ./snapshot.sh > /dev/null 2>&1
-  echo -n 'fetching snapshot...'
-  scp pi@pi:weather.tgz . > /dev/null
-  echo 'done.'
-  echo
-  tar tvf ./weather.tgz
-  echo
-  echo "Snapshot 'weather.tgz' is a tar gzip compressed archive."
-  echo
+  set -o pipefail
+  if [ "$1" == 'full' ]; then
+    echo
+    echo -n 'Generating snapshot...'
+    if ssh pi@pi bash -s full < ./snapshot.sh > /dev/null && echo -n 'fetching snapshot...' \
+      && scp pi@pi:weather.tgz . > /dev/null; then
+      ssh pi@pi bash -s ack < ./snapshot.sh
+      echo 'done.'
+      echo
+      tar tvf ./weather.tgz
+      echo
+      echo "Snapshot 'weather.tgz' is a tar gzip compressed archive."
+    else
+      echo 'failed.'
+      echo
+      echo "Nothing was acknowledged, the next snapshot will send these changes again."
+    fi
+    echo
+  else
+    mkdir -p snapshots
+    Delta=snapshots/weather-`date +%Y%m%d-%H%M%S`.sql.gz
+    echo
+    echo -n 'Streaming changes...'
+    if ssh pi@pi bash -s delta < ./snapshot.sh | tee $Delta | gunzip \
+      | psql -q -v ON_ERROR_STOP=1 weather | grep -q 'snapshot merged'; then
+      ssh pi@pi bash -s ack < ./snapshot.sh
+      echo 'merged.'
+      echo
+      echo "Snapshot '$Delta' ($(du -h $Delta | cut -f1)) is merged into the weather database."
+    else
+      echo 'failed.'
+      echo
+      echo "Nothing was acknowledged, the next snapshot will send these changes again."
+    fi
+    echo
+  fi
 fi
 
 #
 # End
-#
\ No newline at end of file
+#
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+PROGRAM = 'storage-bench.py'
+VERSION = '2.610.191'
+CONTACT = 'bright.tiger@mail.com' # michael nagy
+
+#==============================================================================
+# compare the storage backends (see storage.py) on this machine, using
+# the access patterns of the weather scripts against a scratch table:
+#
+#   storage-bench.py [-rows n] [url ...]
+#
+# the urls default to a postgresql database named weather_bench (create
+# it first with 'createdb weather_bench') and a sqlite file in /tmp.  the
+# scratch table is bench_epoch, with the epoch table's columns, and is
+# dropped when we're done, so a live weather database is never touched.
+#
+#   minute write   one row per connection and commit, as proxy-logger.py
+#   batch write    n * BATCH_FACTOR rows in a single transaction
+#   quarter read   every 15 minute window in turn, as condense.py
+#   bucket scan    min/mean/max per bucket over everything, as voltage.py
+#==============================================================================
+
+import sys, time, storage
+from observation import Observation, CreateSql, InsertSql
+
+URLS = ['postgresql:dbname=weather_bench', 'sqlite:/tmp/weather-bench.db']
+
+TABLE = 'bench_epoch'
+
+ROWS = 500
+BATCH_FACTOR = 20
+
+#----------------------------------------------------------------------
+# a plausible epoch row for minute n
+#----------------------------------------------------------------------
+
+def BenchRow(Minute):
+  Obs = Observation(
+    boot_count=1, uptime_minutes=Minute, temp_f=70.0 + (Minute % 20),
+    dewpoint_f=60.0, humidity_pct=70, pressure_inhg=30.012, wind_mph=Minute % 15,
+    wind_direction=180.0, rain_in=0.0, rain_day_in=0.0, power_volt=12.6,
+    tau_status=1, log_next=Minute, log_full=0, reported_mask=3,
+    temp_min_f=69.0, temp_max_f=71.0, wind_gust_mph=Minute % 20, samples=1)
+  return Obs.Insert('epoch', 1500000000 + Minute * 60)
+
+#----------------------------------------------------------------------
+# time each pattern against one backend, returning (name, count, secs)
+#----------------------------------------------------------------------
+
+def Bench(Url, Rows):
+  Results = []
+  Sql = InsertSql('epoch', TABLE)
+  Db = storage.Connect(Url)
+  Cursor = Db.cursor()
+  Cursor.execute('DROP TABLE IF EXISTS %s' % (TABLE))
+  Cursor.execute(CreateSql('epoch', TABLE))
+  Db.commit()
+  Db.close()
+
+  Start = time.time()
+  for Minute in range(Rows):
+    Db = storage.Connect(Url)
+    Db.cursor().execute(Sql, BenchRow(Minute))
+    Db.commit()
+    Db.close()
+  Results.append(('minute write', Rows, time.time() - Start))
+
+  Db = storage.Connect(Url)
+  Cursor = Db.cursor()
+  Batch = Rows * BATCH_FACTOR
+  Start = time.time()
+  Cursor.executemany(Sql, [BenchRow(Minute) for Minute in range(Rows, Rows + Batch)])
+  Db.commit()
+  Results.append(('batch write', Batch, time.time() - Start))
+
+  Total = Rows + Batch
+  First = 1500000000
+  Start = time.time()
+  Quarters = 0
+  for Epoch in range(First, First + Total * 60, 900):
+    Cursor.execute('SELECT * FROM %s WHERE id BETWEEN %d AND %d' % (TABLE, Epoch, Epoch + 899))
+    Cursor.fetchall()
+    Quarters += 1
+  Results.append(('quarter read', Quarters, time.time() - Start))
+
+  Start = time.time()
+  Cursor.execute(
+    'SELECT (id - %d) / 3600 AS bucket, min(power_volt), avg(power_volt), max(power_volt) '
+    'FROM %s GROUP BY bucket ORDER BY bucket' % (First, TABLE))
+  Cursor.fetchall()
+  Results.append(('bucket scan', Total, time.time() - Start))
+
+  Cursor.execute('DROP TABLE %s' % (TABLE))
+  Db.commit()
+  Db.close()
+  return Results
+
+#----------------------------------------------------------------------
+# main
+#----------------------------------------------------------------------
+
+print()
+print('%s %s' % (PROGRAM, VERSION))
+print()
+Rows = ROWS
+Urls = []
+try:
+  Args = sys.argv[1:]
+  while Args:
+    Arg = Args.pop(0)
+    if Arg.lower().startswith('-r'):
+      Rows = int(Args.pop(0))
+    else:
+      storage.ParseUrl(Arg)
+      Urls.append(Arg)
+except:
+  print('bad arguments - specify [-rows n] [url ...]')
+  sys.exit(1)
+for Url in Urls or URLS:
+  print(Url)
+  print()
+  try:
+    for Name, Count, Secs in Bench(Url, Rows):
+      Secs = max(Secs, 0.000001)
+      print('  %-12s  %7d ops  %8.3fs  %10.1f ops/s  %8.3f ms/op' % (
+        Name, Count, Secs, Count / Secs, 1000.0 * Secs / Count))
+  except (storage.Error, AttributeError) as er:
+    print('  unavailable: %s' % (er))
+  print()
+
+#==============================================================================
+# end
+#==============================================================================
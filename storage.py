@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+PROGRAM = 'storage.py'
+VERSION = '2.610.195'
+CONTACT = 'bright.tiger@mail.com' # michael nagy
+
+#==============================================================================
+# database connections for all of the weather scripts, on either of two
+# storage backends, chosen by the WEATHER_DB environment variable:
+#
+#   postgresql:dbname=weather           (the default)
+#   sqlite:/home/pi/weather/weather.db
+#
+# a full postgresql server costs the pi memory and sd card writes that a
+# single station doesn't need, so a standalone pi can run on sqlite
+# instead.  either way Connect returns a connection whose cursors return
+# rows that can be indexed by column name or position, take %s (or
+# %(name)s) query parameters, and raise Error on any database problem,
+# so the scripts use one set of sql for both wherever the dialects
+# agree.  the few places they don't test Backend.
+#
+# sqlite databases run in wal mode, so readers never block the logger,
+# with synchronous=normal, which only syncs at checkpoints, and a busy
+# timeout so that the scripts wait their turn for the write lock.  a
+# transaction lasts until commit, so scripts writing many rows batch
+# them into one.
+#==============================================================================
+
+import os, re, time, metrics
+
+DB_URL = os.environ.get('WEATHER_DB', 'postgresql:dbname=weather')
+
+SQLITE_SYNCHRONOUS = 'NORMAL'
+SQLITE_BUSY_SECS   = 30.0
+SQLITE_CACHE_KB    = 8192
+
+def ParseUrl(Url):
+  Backend, Target = Url.split(':', 1)
+  if Backend not in ('postgresql', 'sqlite'):
+    raise ValueError('unknown storage backend %s' % (Backend))
+  return Backend, Target
+
+Backend, Target = ParseUrl(DB_URL)
+
+#----------------------------------------------------------------------
+# import only the driver(s) we need, so a pi running sqlite doesn't
+# need psycopg2 installed at all, nor spend its startup loading it.
+# the configured backend's driver is imported now, and the other's only
+# if a url asks for it.  Error takes in each driver's errors as it's
+# imported.
+#----------------------------------------------------------------------
+
+sqlite3 = psycopg2 = None
+
+Error = ()
+
+def Driver(UrlBackend):
+  global sqlite3, psycopg2, Error
+  try:
+    if UrlBackend == 'sqlite' and not sqlite3:
+      import sqlite3
+      Error += (sqlite3.Error,)
+    elif UrlBackend == 'postgresql' and not psycopg2:
+      import psycopg2, psycopg2.extras
+      Error += (psycopg2.Error,)
+  except ImportError:
+    pass
+
+Driver(Backend)
+
+#----------------------------------------------------------------------
+# sqlite adapter.  sqlite3 uses ? and :name placeholders and runs one
+# statement per execute, so parameters are translated and a string of
+# several statements (table and trigger definitions) is split and run a
+# statement at a time.  executescript would do it in one call, but it
+# commits any open transaction first.  a trigger body holds semicolons
+# of its own, so the split pieces are joined up again until sqlite says
+# the statement is complete.  sqlite3.Row gives rows by name and
+# position.
+#----------------------------------------------------------------------
+
+SqliteNamed = re.compile(r'%\((\w+)\)s')
+
+def SqliteParams(Sql):
+  return SqliteNamed.sub(r':\1', Sql).replace('%s', '?').replace('%%', '%')
+
+class SqliteCursor(object):
+  def __init__(self, Cursor):
+    self.Cursor = Cursor
+    self.itersize = 0 # accepted for psycopg2 named cursor compatibility
+
+  def execute(self, Sql, Params=None):
+    if Params is not None:
+      self.Cursor.execute(SqliteParams(Sql), Params)
+    elif Sql.strip().rstrip(';').count(';'):
+      Statement = ''
+      for Piece in Sql.split(';'):
+        Statement += Piece + ';'
+        if sqlite3.complete_statement(Statement):
+          self.Cursor.execute(Statement)
+          Statement = ''
+    else:
+      self.Cursor.execute(Sql)
+
+  def executemany(self, Sql, Params):
+    self.Cursor.executemany(SqliteParams(Sql), Params)
+
+  def fetchone(self):
+    return self.Cursor.fetchone()
+
+  def fetchall(self):
+    return self.Cursor.fetchall()
+
+  def fetchmany(self, Size):
+    return self.Cursor.fetchmany(Size)
+
+  def close(self):
+    self.Cursor.close()
+
+  def __iter__(self):
+    return iter(self.Cursor)
+
+  @property
+  def rowcount(self):
+    return self.Cursor.rowcount
+
+class SqliteConnection(object):
+  def __init__(self, Path):
+    self.Connection = sqlite3.connect(Path, timeout=SQLITE_BUSY_SECS)
+    self.Connection.row_factory = sqlite3.Row
+    self.Connection.execute('PRAGMA journal_mode = WAL')
+    self.Connection.execute('PRAGMA synchronous = %s' % (SQLITE_SYNCHRONOUS))
+    self.Connection.execute('PRAGMA cache_size = -%d' % (SQLITE_CACHE_KB))
+
+  def cursor(self, Name=None, cursor_factory=None):
+    return SqliteCursor(self.Connection.cursor())
+
+  def commit(self):
+    self.Connection.commit()
+
+  def rollback(self):
+    self.Connection.rollback()
+
+  def close(self):
+    self.Connection.close()
+
+#----------------------------------------------------------------------
+# connect to the configured database, or to another given by url (used
+# by migrate.py and storage-bench.py to work with both at once)
+#----------------------------------------------------------------------
+
+def Connect(Url=None):
+  Start = time.time()
+  UrlBackend, UrlTarget = ParseUrl(Url) if Url else (Backend, Target)
+  Driver(UrlBackend)
+  if Sharing and Shared.get(Url or DB_URL):
+    Connection = Shared[Url or DB_URL].pop()
+  elif UrlBackend == 'sqlite':
+    Connection = SqliteConnection(UrlTarget)
+  else:
+    Connection = psycopg2.connect(UrlTarget, cursor_factory=psycopg2.extras.DictCursor)
+  metrics.Timed('connect', Start)
+  if Sharing:
+    Connection = SharedConnection(Url or DB_URL, Connection)
+  return TimedConnection(Connection) if metrics.Profiling else Connection
+
+#----------------------------------------------------------------------
+# shared connections, for scheduler.py, which runs the batch scripts one
+# after another in one process.  with Sharing set, closing a connection
+# rolls back anything uncommitted and keeps it, idle, for the next
+# Connect to the same url, so each script doesn't pay for its own
+# connects.  a connection that can't even roll back is broken, and is
+# closed and forgotten instead.
+#----------------------------------------------------------------------
+
+Sharing = False
+Shared = {} # url -> idle connections
+
+class SharedConnection(object):
+  def __init__(self, Url, Connection):
+    self.Url = Url
+    self.Connection = Connection
+    self.Closed = False
+
+  def close(self):
+    if self.Closed:
+      return
+    self.Closed = True
+    try:
+      self.Connection.rollback()
+      Shared.setdefault(self.Url, []).append(self.Connection)
+    except Error:
+      try:
+        self.Connection.close()
+      except Error:
+        pass
+
+  def __getattr__(self, Name):
+    return getattr(self.Connection, Name)
+
+#----------------------------------------------------------------------
+# profiled runs (see metrics.py).  every connection and cursor is then
+# wrapped so that each statement is timed under its verb and table, as
+# 'sql select epoch', and the fetches of its rows likewise, as 'fetch
+# select epoch', and the rows read and written are counted.  otherwise
+# only the connect is timed, which costs next to nothing.
+#----------------------------------------------------------------------
+
+SqlVerb  = re.compile(r'\s*(\w+)')
+SqlTable = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?(\w+)', re.I)
+
+def QueryName(Sql):
+  Words = ['sql']
+  for Pattern in (SqlVerb, SqlTable):
+    Match = Pattern.search(Sql)
+    if Match:
+      Words.append(Match.group(1).lower())
+  return ' '.join(Words)
+
+class TimedCursor(object):
+  def __init__(self, Cursor):
+    self.__dict__['Cursor'] = Cursor
+    self.__dict__['Name'  ] = 'sql'
+
+  def execute(self, Sql, Params=None):
+    self.__dict__['Name'] = QueryName(Sql)
+    Start = time.time()
+    self.Cursor.execute(Sql, Params)
+    metrics.Timed(self.Name, Start)
+
+  def executemany(self, Sql, Params):
+    Params = list(Params)
+    self.__dict__['Name'] = QueryName(Sql)
+    Start = time.time()
+    self.Cursor.executemany(Sql, Params)
+    metrics.Timed(self.Name, Start)
+    metrics.Count('rows written', len(Params))
+
+  def Fetched(self, Start, Rows):
+    metrics.Timed('fetch' + self.Name[3:], Start)
+    metrics.Count('rows read', Rows)
+
+  def fetchone(self):
+    Start = time.time()
+    Row = self.Cursor.fetchone()
+    self.Fetched(Start, Row is not None)
+    return Row
+
+  def fetchall(self):
+    Start = time.time()
+    Rows = self.Cursor.fetchall()
+    self.Fetched(Start, len(Rows))
+    return Rows
+
+  def fetchmany(self, Size):
+    Start = time.time()
+    Rows = self.Cursor.fetchmany(Size)
+    self.Fetched(Start, len(Rows))
+    return Rows
+
+  def __iter__(self):
+    while True:
+      Rows = self.fetchmany(self.Cursor.itersize or 1000)
+      if not Rows:
+        return
+      for Row in Rows:
+        yield Row
+
+  def __getattr__(self, Name):
+    return getattr(self.Cursor, Name)
+
+  def __setattr__(self, Name, Value):
+    setattr(self.Cursor, Name, Value) # itersize
+
+class TimedConnection(object):
+  def __init__(self, Connection):
+    self.Connection = Connection
+
+  def cursor(self, *Args, **Options):
+    return TimedCursor(self.Connection.cursor(*Args, **Options))
+
+  def commit(self):
+    Start = time.time()
+    self.Connection.commit()
+    metrics.Timed('commit', Start)
+
+  def __getattr__(self, Name):
+    return getattr(self.Connection, Name)
+
+#----------------------------------------------------------------------
+# a pool of warm connections for the weather-plot.py server.  sqlite
+# connections are cheap and local, so its pool just keeps the idle ones.
+#----------------------------------------------------------------------
+
+class SqlitePool(object):
+  def __init__(self, Url):
+    self.Url = Url
+    self.Idle = []
+
+  def getconn(self):
+    return self.Idle.pop() if self.Idle else Connect(self.Url)
+
+  def putconn(self, Connection):
+    self.Idle.append(Connection)
+
+def Pool(Minimum, Maximum, Url=None):
+  UrlBackend, UrlTarget = ParseUrl(Url) if Url else (Backend, Target)
+  if UrlBackend == 'sqlite':
+    return SqlitePool(Url or DB_URL)
+  Driver(UrlBackend)
+  import psycopg2.pool
+  return psycopg2.pool.SimpleConnectionPool(Minimum, Maximum, UrlTarget,
+    cursor_factory=psycopg2.extras.DictCursor)
+
+#----------------------------------------------------------------------
+# add any of the given (name, type) columns missing from a table.
+# sqlite has no ADD COLUMN IF NOT EXISTS, so we look first.
+#----------------------------------------------------------------------
+
+def AddColumns(Cursor, Table, Columns, Url=None):
+  UrlBackend = ParseUrl(Url)[0] if Url else Backend
+  if UrlBackend == 'sqlite':
+    Cursor.execute('PRAGMA table_info(%s)' % (Table))
+    Existing = set([Row['name'] for Row in Cursor.fetchall()])
+    for Name, Type in Columns:
+      if Name not in Existing:
+        Cursor.execute('ALTER TABLE %s ADD COLUMN %s %s' % (Table, Name, Type))
+  else:
+    Cursor.execute('ALTER TABLE %s %s' % (Table, ','.join(
+      ['ADD COLUMN IF NOT EXISTS %s %s' % (Name, Type) for Name, Type in Columns])))
+
+#==============================================================================
+# end
+#==============================================================================
@@ -3,14 +3,19 @@
 from __future__ import print_function
 
 PROGRAM = 'summary.py'
-VERSION = '1.809.180'
+VERSION = '2.610.196'
 CONTACT = 'bright.tiger@mail.com' # michael nagy
 
 #==============================================================================
 # display a summary of the current database content
+#
+#   summary.py [-v]
+#
+# -v verifies the running statistics against a full scan of the quarter
+# table, and if they disagree rebuilds them
 #==============================================================================
 
-import time
+import sys, time
 
 #----------------------------------------------------------------------
 # bitmask values which indicate publication to weather underground and
@@ -20,6 +25,13 @@ import time
 MASK_REPORTED_WU = 0x01
 MASK_REPORTED_PS = 0x02
 
+#----------------------------------------------------------------------
+# a quarter more than this many epochs short of what the logging
+# cadence should have given it is partial (as in condense.py)
+#----------------------------------------------------------------------
+
+EPOCHS_SLACK = 2
+
 #----------------------------------------------------------------------
 # the standard utc and local time string format we use throughout
 #----------------------------------------------------------------------
@@ -30,15 +42,76 @@ def LocalTimeStr(Quarter):
   Epoch = Quarter * 900
   return time.strftime(TimePattern, time.localtime(Epoch))
 
+#----------------------------------------------------------------------
+# everything but the last (incomplete) quarter is summarized: a
+# histogram of quarters by epoch count and expected epoch count, with
+# counts of those reported to each service, and the lengths of the runs
+# of quarters without data.  a run still open at the end doesn't count
+# as a gap yet.
+#
+# StatsRead takes these from the quarter_stats and quarter_gap tables
+# that the trigger installed by condense.py keeps current, backing out
+# the last quarter, so it costs the same however much history there is.
+# StatsScan computes them from the quarter table itself, finding the
+# gaps as gaps-and-islands with row_number.
+#----------------------------------------------------------------------
+
+def StatsRead(DbCursor, QuarterMax):
+  DbCursor.execute('SELECT epochs, expected, quarters, wu, ps FROM quarter_stats WHERE quarters > 0')
+  Data = {}
+  for Row in DbCursor.fetchall():
+    Data[(Row[0], Row[1])] = {'count': Row[2], 'wu': Row[3], 'ps': Row[4]}
+  DbCursor.execute('SELECT epochs, expected, reported_mask FROM quarter WHERE id = %d' % (QuarterMax))
+  Row = DbCursor.fetchone()
+  if Row and (Row[0], Row[1]) in Data:
+    Stats = Data[(Row[0], Row[1])]
+    Stats['count'] -= 1
+    if Row[2] & MASK_REPORTED_WU:
+      Stats['wu'] -= 1
+    if Row[2] & MASK_REPORTED_PS:
+      Stats['ps'] -= 1
+    if Stats['count'] <= 0:
+      del Data[(Row[0], Row[1])]
+  DbCursor.execute(
+    'SELECT last - first + 1 FROM quarter_gap '
+    'WHERE last + 1 < %d ORDER BY first' % (QuarterMax))
+  Gaps = [Row[0] for Row in DbCursor.fetchall()]
+  return Data, Gaps
+
+def StatsScan(DbCursor, QuarterMax):
+  DbCursor.execute(
+    'SELECT epochs, expected, count(*), '
+    'sum(CASE WHEN reported_mask & %d <> 0 THEN 1 ELSE 0 END), '
+    'sum(CASE WHEN reported_mask & %d <> 0 THEN 1 ELSE 0 END) '
+    'FROM quarter WHERE id < %d GROUP BY epochs, expected' % (
+      MASK_REPORTED_WU, MASK_REPORTED_PS, QuarterMax))
+  Data = {}
+  for Row in DbCursor.fetchall():
+    Data[(Row[0], Row[1])] = {'count': Row[2], 'wu': Row[3], 'ps': Row[4]}
+  DbCursor.execute(
+    'SELECT count(*) FROM ('
+    'SELECT id, epochs, row_number() OVER (ORDER BY id) - '
+    'row_number() OVER (PARTITION BY epochs = 0 ORDER BY id) AS island '
+    'FROM quarter WHERE id < %d) AS q '
+    'WHERE epochs = 0 GROUP BY island '
+    'HAVING max(id) < (SELECT max(id) FROM quarter WHERE id < %d AND epochs > 0) '
+    'ORDER BY min(id)' % (QuarterMax, QuarterMax))
+  Gaps = [Row[0] for Row in DbCursor.fetchall()]
+  return Data, Gaps
+
 #----------------------------------------------------------------------
 # main
 #----------------------------------------------------------------------
 
-import psycopg2, psycopg2.extras
+import storage, metrics
+from observation import QuarterStatsSql
+
+metrics.RunStart(PROGRAM, VERSION)
+Verify = '-v' in sys.argv[1:]
 
 try:
-  DbConnection = psycopg2.connect('dbname=weather')
-  DbCursor = DbConnection.cursor(cursor_factory=psycopg2.extras.DictCursor)
+  DbConnection = storage.Connect()
+  DbCursor = DbConnection.cursor()
   DbCursor.execute('SELECT min(id), max(id) FROM quarter')
   Row = DbCursor.fetchone()
   QuarterMin = Row[0]
@@ -49,38 +122,34 @@ try:
   print('Quarter %d is %s' % (QuarterMin, LocalTimeStr(QuarterMin)))
   print('Quarter %d is %s' % (QuarterMax, LocalTimeStr(QuarterMax)))
   print()
-  DbCursor.execute('SELECT * FROM quarter WHERE id < %d ORDER BY id ASC' % (QuarterMax))
-  Data = {}
-  Quarters = 0
-  Gaps = []
-  GapLength = 0
-  for Row in DbCursor.fetchall():
-    Quarters += 1
-    Epochs = Row['epochs']
-    if Epochs:
-      if GapLength:
-        Gaps.append(GapLength)
-        GapLength = 0
+  Start = time.time()
+  Data, Gaps = StatsRead(DbCursor, QuarterMax)
+  metrics.Timed('stats read', Start)
+  if Verify:
+    Start = time.time()
+    ScanData, ScanGaps = StatsScan(DbCursor, QuarterMax)
+    metrics.Timed('stats scan', Start)
+    if ScanData == Data and ScanGaps == Gaps:
+      print('Statistics verified')
     else:
-      GapLength += 1
-    Reported = Row['reported_mask']
-    if not Epochs in Data:
-      Data[Epochs] = {'count': 0, 'wu': 0, 'ps': 0}
-    Stats = Data[Epochs]
-    Stats['count'] += 1
-    if Reported & MASK_REPORTED_WU:
-      Stats['wu'] += 1
-    if Reported & MASK_REPORTED_PS:
-      Stats['ps'] += 1
+      print('Statistics differ from a full scan, rebuilding them')
+      DbCursor.execute('DELETE FROM quarter_stats;' + QuarterStatsSql())
+      DbConnection.commit()
+      Data, Gaps = ScanData, ScanGaps
+    print()
   DbConnection.close()
-  print('Epochs  Datasets  Wunderground  Aeris')
-  for Epochs in sorted(Data):
-    Stats = Data[Epochs]
-    print('%6d  %8d  %12d  %5d' % (Epochs, Stats['count'], Stats['wu'], Stats['ps']))
-  print('        --------')
-  print('        %8d, %s gaps' % (Quarters, str(Gaps).replace(' ','')))
+  Quarters = sum(Stats['count'] for Stats in Data.values())
+  Partial = sum(Stats['count'] for (Epochs, Expected), Stats in Data.items()
+    if Epochs < Expected - EPOCHS_SLACK)
+  print('Epochs  Expected  Datasets  Wunderground  Aeris')
+  for Epochs, Expected in sorted(Data):
+    Stats = Data[(Epochs, Expected)]
+    print('%6d  %8d  %8d  %12d  %5d%s' % (Epochs, Expected, Stats['count'], Stats['wu'], Stats['ps'],
+      '  partial' if Epochs < Expected - EPOCHS_SLACK else ''))
+  print('                  --------')
+  print('                  %8d, %d partial, %s gaps' % (Quarters, Partial, str(Gaps).replace(' ','')))
   print()
-except psycopg2.Error as er:
+except storage.Error as er:
   print('db error: %s' % (er.message))
 
 #==============================================================================
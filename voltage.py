@@ -3,50 +3,138 @@
 from __future__ import print_function
 
 PROGRAM = 'voltage.py'
-VERSION = '1.812.301'
+VERSION = '2.610.194'
 CONTACT = 'bright.tiger@mail.com' # michael nagy
 
 #==============================================================================
-# display battery voltage by date/time                                                                                                                          
-#==============================================================================                                                                                 
-                                                                                                                                                                
-import psycopg2, psycopg2.extras, time                                                                                                                          
-import datetime as dt                                                                                                                                           
-import numpy as np                                                                                                                                              
+# display battery voltage by date/time
+#
+#   voltage.py [-from yyyy-mm-dd] [-to yyyy-mm-dd] [-png file]
+#
+# -from and -to limit the plot to a range of local dates (the -to date
+# is included), and -png renders headless to a file instead of showing
+# a window
+#==============================================================================
+
+import storage, metrics, sys, time
+import datetime as dt
+import numpy as np
+
+#----------------------------------------------------------------------
+# the database is reduced to about one bucket per horizontal pixel, so
+# each bucket covers (range / PLOT_POINTS) seconds, but never less than
+# the one minute epoch.  each bucket yields the minimum, mean and
+# maximum voltage, drawn as a mean line over a shaded min/max band.
+# readings at or below VOLT_MIN are the weatherbox being offline rather
+# than a real voltage, and stretches of more than GAP_SECS (or one
+# bucket, if longer) without readings break the line and band.
+#----------------------------------------------------------------------
+
+PLOT_WIDTH = 12 # inches
+PLOT_HEIGHT = 6 # inches
+PLOT_DPI = 100
+PLOT_POINTS = PLOT_WIDTH * PLOT_DPI
+
+BUCKET_MIN = 60
+VOLT_MIN = 1.0
+GAP_SECS = 7200
+
+#----------------------------------------------------------------------
+# parse the command line
+#----------------------------------------------------------------------
+
+def DateEpoch(Date):
+  return int(time.mktime(time.strptime(Date, '%Y-%m-%d')))
+
+metrics.RunStart(PROGRAM, VERSION)
+RangeFirst = RangeLast = None
+PngFile = None
+try:
+  Args = sys.argv[1:]
+  while Args:
+    Arg = Args.pop(0).lower()
+    if Arg.startswith('-f'):
+      RangeFirst = DateEpoch(Args.pop(0))
+    elif Arg.startswith('-t'):
+      RangeLast = DateEpoch(Args.pop(0)) + 86400
+    elif Arg.startswith('-p'):
+      PngFile = Args.pop(0)
+    else:
+      raise ValueError(Arg)
+except:
+  print('bad arguments - specify [-from yyyy-mm-dd] [-to yyyy-mm-dd] [-png file]')
+  sys.exit(1)
+
+Start = time.time()
+import matplotlib
+if PngFile:
+  matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import matplotlib.dates as md
+metrics.Timed('import matplotlib', Start)
 
 #----------------------------------------------------------------------
-# collect data from weather database epoch table and display
+# collect bucketed data from weather database epoch table and display
 #----------------------------------------------------------------------
 
 print()
 print('%s %s' % (PROGRAM, VERSION))
 print()
 
-DbConnection = psycopg2.connect('dbname=weather')
-DbCursor = DbConnection.cursor(cursor_factory=psycopg2.extras.DictCursor)
-DbCursor.execute('SELECT id,power_volt FROM epoch ORDER BY id')
-Dates = []
-Volts = []
-LastTime = 0
-for Row in DbCursor.fetchall():
-  Time    = Row['id'        ]
-  Voltage = Row['power_volt']
-  if Voltage > 1.0:
-    if LastTime and (Time > LastTime + 7200):
-      Dates.append(dt.datetime.fromtimestamp(LastTime+900))
-      Volts.append(8.0) # np.nan)
-      Dates.append(dt.datetime.fromtimestamp(Time-900))
-      Volts.append(8.0) # np.nan)
-    LastTime = Time
-    Dates.append(dt.datetime.fromtimestamp(Time))
-    Volts.append(Voltage)
-
-plt.plot(Dates, Volts)
+DbConnection = storage.Connect()
+DbCursor = DbConnection.cursor()
+if RangeFirst is None or RangeLast is None:
+  DbCursor.execute('SELECT min(id), max(id) + 1 FROM epoch')
+  Row = DbCursor.fetchone()
+  if Row[0] is None:
+    print('no data')
+    sys.exit(0)
+  if RangeFirst is None:
+    RangeFirst = Row[0]
+  if RangeLast is None:
+    RangeLast = Row[1]
+if RangeFirst >= RangeLast:
+  print('bad arguments - the -from date must come before the -to date')
+  sys.exit(1)
+Bucket = max(BUCKET_MIN, (RangeLast - RangeFirst) // PLOT_POINTS)
+
+sql = 'SELECT (id - %d) / %d AS bucket, ' % (RangeFirst, Bucket)
+sql += 'min(power_volt) AS volt_min, avg(power_volt) AS volt_mean, max(power_volt) AS volt_max '
+sql += 'FROM epoch WHERE id >= %d AND id < %d AND power_volt > %f ' % (RangeFirst, RangeLast, VOLT_MIN)
+sql += 'GROUP BY bucket ORDER BY bucket'
+DbCursor.execute(sql)
+Rows = DbCursor.fetchall()
+Start = time.time()
+Data = np.array([tuple(Row) for Row in Rows], dtype=float).reshape(-1, 4)
+DbConnection.close()
+if not len(Data):
+  print('no voltage data in range')
+  sys.exit(1)
+print('%d buckets of %d seconds' % (len(Data), Bucket))
+
+# bucket start times, with a nan row after each bucket followed by a gap
+
+Times = RangeFirst + Data[:,0] * Bucket
+Breaks = np.nonzero(np.diff(Times) > max(GAP_SECS, Bucket))[0] + 1
+Times = np.insert(Times, Breaks, Times[Breaks - 1] + Bucket)
+Data = np.insert(Data, Breaks, np.nan, axis=0)
+Dates = [dt.datetime.fromtimestamp(Time) for Time in Times]
+Start = metrics.Timed('arrays', Start)
+
+plt.figure(figsize=(PLOT_WIDTH, PLOT_HEIGHT), dpi=PLOT_DPI)
+plt.fill_between(Dates, Data[:,1], Data[:,3], color='C0', alpha=0.3, linewidth=0)
+plt.plot(Dates, Data[:,2], color='C0')
+plt.gca().xaxis.set_major_formatter(md.DateFormatter('%Y-%m-%d'))
+plt.gcf().autofmt_xdate()
 plt.xlabel('time')
 plt.ylabel('voltage')
-plt.show()
+Start = metrics.Timed('plot', Start)
+if PngFile:
+  plt.savefig(PngFile, dpi=PLOT_DPI)
+  metrics.Timed('render', Start)
+  print('wrote %s' % (PngFile))
+else:
+  plt.show()
 
 #==============================================================================
 # end
@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+PROGRAM = 'wb4.py'
+VERSION = '2.610.192'
+CONTACT = 'bright.tiger@mail.com' # michael nagy
+
+#==============================================================================
+# the weatherbox4 serial protocol as proxy-logger.py speaks it, and the
+# recordings it can make of that traffic, shared with replay.py so that
+# a recording is replayed through exactly the code that logged it:
+#
+#   json reply        ->  wb dictionary      (JsonParse)
+#   binary frame      ->  wb dictionary      (FrameRead)
+#   wb time fields    ->  utc epoch          (ClockEpoch)
+#   sub-minute samples -> one minute's wb    (SampleOf, ReduceSamples)
+#
+# nothing here touches the serial port itself.  FrameRead is handed the
+# port's read function, or that of a recorded frame.
+#==============================================================================
+
+import calendar, json, os, struct, time, zlib
+
+TimePattern = '%Y-%m-%d %H:%M:%S'
+
+#----------------------------------------------------------------------
+# json reply - whatever lies between the first braces
+#----------------------------------------------------------------------
+
+def JsonParse(Response):
+  try:
+    return json.loads('{%s}' % Response.split('{')[1].split('}')[0])
+  except:
+    return None
+
+#----------------------------------------------------------------------
+# compact binary frame - the 'bin' command asks the weatherbox for a
+# fixed-layout image of its current LogRecord (see weatherbox3.ino,
+# words are big-endian as stored in fram) plus a few log header fields
+# and a fletcher-16 checksum over the payload:
+#
+#   'W' 'B' version length | payload | sum2 sum1
+#
+# the frame is 43 bytes, about 22ms at 19200 bps versus most of a
+# second for the json reply, and because the length is known up front
+# we don't have to wait out the serial read timeout either.  the frame
+# is decoded in place and returned as the same dictionary the json
+# reply would have produced, so nothing downstream changes.  on any
+# problem the dictionary is None and the caller falls back to json.
+#----------------------------------------------------------------------
+
+FRAME_MAGIC    = b'WB'
+FRAME_VERSION  = 1
+FRAME_SCAN_MAX = 64 # bytes of leading noise tolerated before the magic
+
+FrameHeader  = struct.Struct('>2sBB')
+FramePayload = struct.Struct('>14B2h5H2HB2H')
+FrameSum     = struct.Struct('>BB')
+
+VUNIT = 0.081865 # weatherbox power.volt unit
+
+def Fletcher16(Data, Length):
+  Sum1 = Sum2 = 0
+  for Index in range(Length):
+    Sum1 = (Sum1 + Data[Index]) % 255
+    Sum2 = (Sum2 + Sum1) % 255
+  return (Sum2, Sum1)
+
+def FrameDecode(View):
+  (Year, Month, Day, Hour, Minute, Second, Humi, Vane, Volt, Anem, AnemAvg,
+   AnemMax, TauMax, TauSet, Temp, Dewpoint, Rain, RainDay, Pres, BootCount,
+   UptimeMins, LogSize, LogNext, LogFull, TauQueries, TauReplies
+  ) = FramePayload.unpack_from(View)
+  return {
+    'time.year'     : Year + 2000                ,
+    'time.month'    : Month                      ,
+    'time.day'      : Day                        ,
+    'time.hour'     : Hour                       ,
+    'time.minute'   : Minute                     ,
+    'time.second'   : Second                     ,
+    'humidity.pct'  : Humi                       ,
+    'wind.direction': Vane * 22.5                ,
+    'power.volt'    : round(Volt * VUNIT, 3)     ,
+    'wind.mph'      : Anem                       ,
+    'wind.avg.mph'  : AnemAvg                    ,
+    'wind.max.mph'  : AnemMax                    ,
+    'tau.status'    : TauMax                     ,
+    'tau.set'       : TauSet                     ,
+    'temp.c'        : round(Temp     * 0.1, 1)   ,
+    'dewpoint.c'    : round(Dewpoint * 0.1, 1)   ,
+    'rain.in'       : round(Rain     * 0.011, 2) ,
+    'rain.day.in'   : round(RainDay  * 0.011, 2) ,
+    'pressure.inhg' : round(Pres     * 0.001, 3) ,
+    'boot.count'    : BootCount                  ,
+    'uptime.minutes': UptimeMins                 ,
+    'log.size'      : LogSize                    ,
+    'log.next'      : LogNext                    ,
+    'log.full'      : LogFull                    ,
+    'tau.queries'   : TauQueries                 ,
+    'tau.replies'   : TauReplies                 ,
+  }
+
+#----------------------------------------------------------------------
+# read one frame with the given read function, returning the raw bytes
+# read (noise and all, for a recording) and the decoded dictionary
+#----------------------------------------------------------------------
+
+def FrameRead(Read):
+  Raw = bytearray()
+  def Take(Count):
+    Data = Read(Count)
+    Raw.extend(Data)
+    return Data
+  Skipped, Last = 0, b''
+  while Last != FRAME_MAGIC:
+    Byte = Take(1)
+    if not Byte or Skipped > FRAME_SCAN_MAX:
+      return Raw, None
+    Last = Last[-1:] + Byte
+    Skipped += 1
+  Frame = bytearray(FRAME_MAGIC + Take(FrameHeader.size - 2))
+  if len(Frame) < FrameHeader.size:
+    return Raw, None
+  Magic, Version, Length = FrameHeader.unpack_from(Frame)
+  if Version != FRAME_VERSION or Length != FramePayload.size:
+    return Raw, None
+  Frame = bytearray(Take(Length + FrameSum.size))
+  if len(Frame) != Length + FrameSum.size:
+    return Raw, None
+  View = memoryview(Frame)
+  if FrameSum.unpack_from(View, Length) != Fletcher16(Frame, Length):
+    return Raw, None
+  return Raw, FrameDecode(View)
+
+#----------------------------------------------------------------------
+# the weatherbox4 utc time as a string and an epoch
+#----------------------------------------------------------------------
+
+def ClockEpoch(wb):
+  wb['time.utc'] = '%4d-%02d-%02d %02d:%02d:%02d' % (
+    wb['time.year'], wb['time.month' ], wb['time.day'   ],
+    wb['time.hour'], wb['time.minute'], wb['time.second']
+  )
+  wb['time.epoch'] = calendar.timegm(time.strptime(wb['time.utc'], TimePattern))
+  return wb['time.epoch']
+
+#----------------------------------------------------------------------
+# sub-minute samples (see SAMPLE_TIME_SECS in proxy-logger.py) and their
+# reduction into the minute's dictionary: means for temperature, dew
+# point, humidity, pressure and wind speed, the highest wind speed as
+# the gust, min/max temperature, and maxima for hourly rain and tau
+# status
+#----------------------------------------------------------------------
+
+def SampleOf(wb):
+  return (
+    wb['temp.c'       ], wb['dewpoint.c'], wb['humidity.pct'], wb['pressure.inhg'],
+    wb['wind.mph'     ], wb['rain.in'   ], wb['tau.status'  ]
+  )
+
+def ReduceSamples(wb, Samples):
+  Temp, Dewpoint, Humidity, Pressure, Wind, Rain, Tau = zip(*Samples)
+  Count = len(Samples)
+  wb['temp.c'       ] = round(sum(Temp    ) / Count, 1)
+  wb['temp.min.c'   ] =       min(Temp    )
+  wb['temp.max.c'   ] =       max(Temp    )
+  wb['dewpoint.c'   ] = round(sum(Dewpoint) / Count, 1)
+  wb['humidity.pct' ] = int(round(float(sum(Humidity)) / Count))
+  wb['pressure.inhg'] = round(sum(Pressure) / Count, 3)
+  wb['wind.mph'     ] = int(round(float(sum(Wind)) / Count))
+  wb['wind.gust.mph'] =       max(Wind    )
+  wb['rain.in'      ] =       max(Rain    )
+  wb['tau.status'   ] =       max(Tau     )
+  wb['samples'      ] = Count
+  return Count
+
+#----------------------------------------------------------------------
+# recordings.  a recording is a short file header followed by entries
+# of a kind, the time it was written and the payload length, then the
+# payload.  serial replies are kept raw, exactly as read, so a replay
+# parses them again.  payloads longer than RECORD_ZLIB_MIN are deflated
+# (a json reply shrinks to about half), so a day of minute polls takes
+# about half a megabyte, or a third of that with binary frames.  the
+# entries of one poll are:
+#
+#   RECORD_JSON    raw json reply, for every json command sent
+#   RECORD_FRAME   raw bytes read for a binary frame, good or bad
+#   RECORD_SAMPLE  the last reply was kept as a sub-minute sample
+#   RECORD_POLL    the last reply was the minute poll, with the
+#                  actual utc epoch it was logged at
+#   RECORD_WU      weather underground http status, 0 if not reported
+#   RECORD_PS      aeris http status, -1 for either if the request failed
+#   RECORD_DB      database write, whether it worked and how many rows
+#----------------------------------------------------------------------
+
+RECORD_MAGIC    = b'WB4R'
+RECORD_VERSION  = 1
+RECORD_ZLIB     = 0x80 # kind flag, payload is deflated
+RECORD_ZLIB_MIN = 64
+
+RECORD_JSON   = 1
+RECORD_FRAME  = 2
+RECORD_SAMPLE = 3
+RECORD_POLL   = 4
+RECORD_WU     = 5
+RECORD_PS     = 6
+RECORD_DB     = 7
+
+RecordHeader = struct.Struct('>4sB')
+RecordEntry  = struct.Struct('>BdH')
+RecordStatus = struct.Struct('>h')
+RecordEpoch  = struct.Struct('>I')
+RecordWrite  = struct.Struct('>BH')
+
+def RecordScan(File, Offset=0):
+  if File.read(RecordHeader.size) != RecordHeader.pack(RECORD_MAGIC, RECORD_VERSION):
+    raise ValueError('not a wb4 recording')
+  if Offset:
+    File.seek(Offset) # an entry boundary, see Recorder
+  while True:
+    Entry = File.read(RecordEntry.size)
+    if len(Entry) < RecordEntry.size:
+      return
+    Kind, Time, Length = RecordEntry.unpack(Entry)
+    Payload = File.read(Length)
+    if len(Payload) < Length:
+      return # torn last entry
+    if Kind & RECORD_ZLIB:
+      Kind, Payload = Kind & ~RECORD_ZLIB, zlib.decompress(Payload)
+    yield Kind, Time, Payload
+
+def RecordRead(Path):
+  with open(Path, 'rb') as f:
+    for Entry in RecordScan(f):
+      yield Entry
+
+#----------------------------------------------------------------------
+# append to a recording, given the end of its last entry known to be
+# whole (see End) if there is one, so only what follows it is read
+# through to find a torn last entry rather than the whole recording
+#----------------------------------------------------------------------
+
+class Recorder(object):
+
+  def __init__(self, Path, Whole=0):
+    End = 0
+    if os.path.exists(Path) and os.path.getsize(Path):
+      if Whole > os.path.getsize(Path):
+        Whole = 0 # not the recording we were told about
+      with open(Path, 'rb') as f:
+        End = Whole
+        for Entry in RecordScan(f, Whole):
+          End = f.tell()
+    self.File = open(Path, 'r+b' if End else 'wb')
+    if End:
+      self.File.truncate(End) # drop a torn last entry, then append
+      self.File.seek(End)
+    else:
+      self.File.write(RecordHeader.pack(RECORD_MAGIC, RECORD_VERSION))
+
+  def Write(self, Kind, Payload=b''):
+    Payload = bytes(Payload)
+    if len(Payload) > RECORD_ZLIB_MIN:
+      Kind, Payload = Kind | RECORD_ZLIB, zlib.compress(Payload)
+    self.File.write(RecordEntry.pack(Kind, time.time(), len(Payload)) + Payload)
+
+  def Flush(self):
+    self.File.flush()
+
+  def End(self):
+    self.File.flush()
+    return self.File.tell()
+
+  def Close(self):
+    self.File.close()
+
+#==============================================================================
+# end
+#==============================================================================
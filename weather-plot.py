@@ -3,7 +3,7 @@
 
 from __future__ import print_function
 
-VERSION = '1.809.171' # Y.YMM.DDn
+VERSION = '2.610.1910' # Y.YMM.DDn
 PROGRAM = 'weather-plot.py'
 CONTACT = 'bright.tiger@gmail.com' # michael nagy
 
@@ -19,20 +19,51 @@ CONTACT = 'bright.tiger@gmail.com' # michael nagy
 #   rainfall (hourly and daily)
 #   tornado alerts
 #
-# data to plot will be pulled from the postgresql weather database for the time
-# span specified on the command line as start quarter and number of quarters.
+# data to plot will be pulled from the weather database (postgresql or sqlite,
+# see storage.py) for the time span specified on the command line as start
+# quarter and number of quarters.  by default we draw the temperature, wind
+# speed and rainfall graphs; choose any others (all come from the same single
+# query) with:
+#
+#   weather-plot.py -panels temperature,humidity,wind,direction,rain,tau ...
+#
+# in batch mode many ranges are rendered headless in one process (or a small
+# pool of them) from a single query, one png per range:
+#
+#   weather-plot.py -batch quarter:quarters[/span] ... [-jobs n]
+#
+# where /span splits the range into consecutive pieces of that many quarters,
+# so '-batch 17532:35040/96' writes a year of daily plots.
+#
+# in server mode we stay resident and answer http requests on the local network:
+#
+#   weather-plot.py -serve [port]
+#
+#   /plot.png?quarter=q&quarters=n     rendered plot
+#   /plot.svg?quarter=q&quarters=n     rendered plot, scalable
+#   /series.json?quarter=q&quarters=n  the plotted columns by quarter
+#
+# quarter and quarters follow the command line rules, so no arguments (or a
+# quarter of zero) means the most recent day.
 # ===============================================================================
 
-import os, sys, time
+import os, sys, time, glob, shutil, hashlib, itertools, multiprocessing
+import io, json, collections, urlparse, BaseHTTPServer
+
+import numpy as np
 
-import matplotlib.pyplot  as plt
-import matplotlib.patches as patches
+# matplotlib is imported in main, and only if we actually have to render,
+# so that answering from the plot cache stays quick.
 
-Graphics = 3 # number of distinct graphics
+Panels = ['temperature', 'wind', 'rain'] # graphics to draw, top to bottom
 
 HeightEach = 3 # inches - vertical height of each graphic
 WidthEach  = 8 # inches - horizontal width of each graphic
 
+PlotDpi = 100 # dots per inch, matplotlib's default
+
+DecimatePoints = 2 * WidthEach * PlotDpi # points per series, twice the pixels
+
 #----------------------------------------------------------------------
 # convert a quarter to the epoch of the start of the quarter.
 #----------------------------------------------------------------------
@@ -92,22 +123,58 @@ def CalibrateTimeTicks(Quarter, Quarters):
 # of quarters being displayed.
 #----------------------------------------------------------------------
 
-def LocalTimeStr(Quarter, Quarters):
+def TickQuarters(Quarters):
   if Quarters < TickLimit:
     Labels = max(2, Quarters)
   else:
     Labels = TickLimit
-  TickQuarters = (Quarters / Labels) + 1
-  if Quarter % TickQuarters == TickQuarters / 2:
+  return (Quarters / Labels) + 1
+
+def LocalTimeStr(Quarter, Quarters):
+  Ticks = TickQuarters(Quarters)
+  if Quarter % Ticks == Ticks / 2:
     return DayExt(time.strftime(TimePattern, time.localtime(QuarterToEpoch(Quarter))))
   return ''
 
+#----------------------------------------------------------------------
+# return the quarters which carry a tick label, without visiting every
+# quarter in the range.
+#----------------------------------------------------------------------
+
+def TickTimes(Quarter, Quarters):
+  Ticks = TickQuarters(Quarters)
+  First = Quarter + (((Ticks / 2) - Quarter) % Ticks)
+  return np.arange(First, Quarter + Quarters, Ticks)
+
+#----------------------------------------------------------------------
+# reduce a series to a min/max envelope of about decimatepoints points.
+# the series is cut into buckets and each bucket contributes its lowest
+# and highest point in time order, so peaks and troughs survive at any
+# span while matplotlib only ever sees a screenful of points.
+#----------------------------------------------------------------------
+
+def Decimate(Time, Values):
+  Points = len(Time)
+  if Points <= DecimatePoints:
+    return Time, Values
+  Size = -(-Points // (DecimatePoints // 2))
+  Buckets = -(-Points // Size)
+  Padded = np.concatenate((Values, np.repeat(Values[-1], (Buckets * Size) - Points)))
+  Padded = Padded.reshape(Buckets, Size)
+  Low  = Padded.argmin(axis=1)
+  High = Padded.argmax(axis=1)
+  Base = np.arange(Buckets) * Size
+  Index = np.column_stack((Base + np.minimum(Low, High), Base + np.maximum(Low, High))).ravel()
+  Index = np.minimum(Index, Points - 1)
+  return Time[Index], Values[Index]
+
 #----------------------------------------------------------------------
 # weather data to display
 #----------------------------------------------------------------------
 
-Time   = []
-Labels = []
+Time     = []
+TickTime = []
+Labels   = []
 
 TimeMin = 0
 TimeMax = 0
@@ -127,109 +194,414 @@ WindMax = 0
 RainMax = 0
 
 #----------------------------------------------------------------------
-# database support.  we are currently using postgresql, but with minor
-# modifications to this single block of code we could alternately run
-# with sqlite3 or possibly other database engines.
+# database support.  postgresql or sqlite, as configured by WEATHER_DB
+# (see storage.py).
 #----------------------------------------------------------------------
 
-import psycopg2, psycopg2.extras
+import storage, metrics
 
-DbName = 'weather'
+DbPool = None # kept warm in server mode, otherwise connect per use
+
+def DbConnect():
+  if DbPool:
+    return DbPool.getconn()
+  return storage.Connect()
+
+def DbRelease(DbConnection):
+  DbConnection.rollback() # we only ever read
+  if DbPool:
+    DbPool.putconn(DbConnection)
+  else:
+    DbConnection.close()
 
 #----------------------------------------------------------------------
 # load the specified quarter and period in quarters from the database.
-# if quarter is zero on entry, autoselect the most recent day.
+# if quarter is zero on entry, autoselect the most recent day.  one
+# query walks generate_series over the whole span and left joins the
+# quarter table onto it, so missing quarters come back as zero-filled
+# rows and the columns drop straight into numpy arrays.  loadspan
+# keeps the whole span, and selectrange points the plot series at any
+# range within it, so batch mode can render many ranges from one
+# query.  sqlite has no generate_series, so there a recursive common
+# table expression counts out the span instead.  the axis limits are
+# reductions over the quarters that actually have data, which as always
+# are the ones with a nonzero temperature.
 #----------------------------------------------------------------------
 
-def LoadData(Quarter, Quarters):
-  global Labels, Time, Temperature, DewPoint, WindSpeed
-  global Rain, RainTotal
-  global TempMin, TempMax, RainMax, WindMax, TimeMin, TimeMax
-  DbConnection = psycopg2.connect('dbname=weather')
-  DbCursor = DbConnection.cursor(cursor_factory=psycopg2.extras.DictCursor)
+def FirstQuarterSql(Quarter, Quarters):
   if Quarter < 1:
     Offset = ((Quarter - 1) * 96) + 16
     print('offset = %d' % (Offset))
-    DbCursor.execute('SELECT max(id) FROM quarter')
-    Row = DbCursor.fetchone()
-    print('MAX=%d' % (Row[0]))
-    Quarter  = ((Row[0] / 96) * 96) + Offset
-    Quarters =                  96
+    return '(SELECT ((max(id) / 96) * 96) + %d FROM quarter)' % (Offset), 96
+  return '%d' % (Quarter), Quarters
+
+Columns = (
+  'temp_f', 'dewpoint_f', 'humidity_pct', 'wind_mph',
+  'wind_direction', 'rain_in', 'rain_day_in', 'tau_status'
+)
+
+SpanData = None # id column followed by columns, over the loaded span
+
+def LoadSpan(Quarter, Quarters):
+  global SpanData
+  First, Quarters = FirstQuarterSql(Quarter, Quarters)
+  DbConnection = DbConnect()
+  DbCursor = DbConnection.cursor()
+  Select = ', '.join(['coalesce(q.%s, 0)' % (Column) for Column in Columns])
+  if storage.Backend == 'sqlite':
+    DbCursor.execute(
+      'WITH RECURSIVE f(first) AS (SELECT %s), '
+      's(id) AS (SELECT first FROM f UNION ALL SELECT s.id + 1 FROM s, f WHERE s.id < f.first + %d) '
+      'SELECT s.id, %s FROM s LEFT JOIN quarter q ON q.id = s.id ORDER BY s.id' % (
+        First, Quarters - 1, Select))
+  else:
+    DbCursor.execute(
+      'SELECT s.id, %s FROM (SELECT %s AS first) AS f '
+      'CROSS JOIN generate_series(f.first, f.first + %d) AS s(id) '
+      'LEFT JOIN quarter q ON q.id = s.id ORDER BY s.id' % (
+        Select, First, Quarters - 1))
+  Rows = DbCursor.fetchall()
+  Start = time.time()
+  Values = itertools.chain.from_iterable(Rows) # straight from the rows, no tuple per row
+  SpanData = np.fromiter(Values, float, len(Rows) * (len(Columns) + 1)).reshape(-1, len(Columns) + 1).T
+  metrics.Timed('arrays', Start)
+  DbRelease(DbConnection)
+  if len(SpanData[0]):
+    return int(SpanData[0][0]), Quarters
+  return None, Quarters
+
+def SelectRange(Quarter, Quarters):
+  global Labels, Time, TickTime, Temperature, DewPoint, Humidity, WindSpeed
+  global Direction, Rain, RainTotal, Tau
+  global TempMin, TempMax, RainMax, WindMax, TimeMin, TimeMax
+  Start = max(0, Quarter - int(SpanData[0][0])) if len(SpanData[0]) else 0
+  Data = SpanData[:, Start:Start + Quarters]
+  Time = Data[0].astype(int)
+  Temperature, DewPoint, Humidity, WindSpeed, Direction, Rain, RainTotal, Tau = Data[1:]
+  Valid = Temperature != 0
+  if not Valid.any():
+    print('%d..%d no data in range' % (Quarter, Quarters))
+    Temperature = np.zeros(0)
+    return False
   print('%d..%d' % (Quarter, Quarters))
-  Labels      = []
-  Time        = []
-  Temperature = []
-  DewPoint    = []
-  WindSpeed   = []
-  Rain        = []
-  RainTotal   = []
   CalibrateTimeTicks(Quarter, Quarters)
-  DbCursor.execute('SELECT min(id),max(id) FROM quarter WHERE id BETWEEN %d AND %d' % (
-    Quarter, Quarter + Quarters - 1))
-  Row = DbCursor.fetchone()
-  QuarterMin = Row[0]
-  QuarterMax = Row[1]
-  print('%d..%d' % (QuarterMin, QuarterMax))
-  for HotQuarter in range(Quarter,QuarterMin):
-    Time.append(HotQuarter)
-    Labels.append(LocalTimeStr(HotQuarter, Quarters))
-    Temperature.append(0)
-    DewPoint   .append(0)
-    Humidity   .append(0)
-    WindSpeed  .append(0)
-    Direction  .append(0)
-    Rain       .append(0)
-    RainTotal  .append(0)
-    Tau        .append(0)
-  DbCursor.execute('SELECT * FROM quarter WHERE id BETWEEN %d AND %d ORDER BY id ASC' % (
-    Quarter, Quarter + Quarters - 1))
-  QueryCount = FirstIndex = 0
-  for Row in DbCursor.fetchall():
-    QueryCount += 1
-    HotQuarter = Row['id']
-    FirstIndex = len(Temperature)
-    Time.append(HotQuarter)
-    Labels.append(LocalTimeStr(HotQuarter, Quarters))
-    Temperature.append(Row['temp_f'        ])
-    DewPoint   .append(Row['dewpoint_f'    ])
-    Humidity   .append(Row['humidity_pct'  ])
-    WindSpeed  .append(Row['wind_mph'      ])
-    Direction  .append(Row['wind_direction'])
-    Rain       .append(Row['rain_in'       ])
-    RainTotal  .append(Row['rain_day_in'   ])
-    Tau        .append(Row['tau_status'    ])
-  for HotQuarter in range(QuarterMax + 1,Quarter + Quarters):
-    Time.append(HotQuarter)
-    Labels.append(LocalTimeStr(HotQuarter, Quarters))
-    Temperature.append(0)
-    DewPoint   .append(0)
-    Humidity   .append(0)
-    WindSpeed  .append(0)
-    Direction  .append(0)
-    Rain       .append(0)
-    RainTotal  .append(0)
-    Tau        .append(0)
-  if Temperature:
-    TempMax = Temperature[FirstIndex]
-    TempMin = DewPoint   [FirstIndex]
-    WindMax = WindSpeed  [FirstIndex]
-    RainMax = RainTotal  [FirstIndex]
-    TimeMin = Quarter
-    TimeMax = Quarter + Quarters - 1
-    for i in range(1,len(Temperature)):
-      if Temperature[i]:
-        TempMax = max(TempMax, Temperature[i])
-        TempMin = min(TempMin, DewPoint   [i])
-        WindMax = max(WindMax, WindSpeed  [i])
-        RainMax = max(RainMax, RainTotal  [i])
-    TempMax = ((round(TempMax      ) / 5.0) + 1.0) * 5.0
-    TempMin = ((round(TempMin      ) / 5.0) - 2.0) * 5.0
-    WindMax = ((round(WindMax      ) / 5.0) + 1.0) * 5.0
-    RainMax = ( round(RainMax * 2.0)        + 1.0) * 0.5
+  TickTime = TickTimes(Quarter, Quarters)
+  Labels = [LocalTimeStr(int(HotQuarter), Quarters) for HotQuarter in TickTime]
+  TimeMin = Quarter
+  TimeMax = Quarter + Quarters - 1
+  TempMax = Temperature[Valid].max()
+  TempMin = DewPoint   [Valid].min()
+  WindMax = WindSpeed  [Valid].max()
+  RainMax = RainTotal  [Valid].max()
+  TempMax = ((round(TempMax      ) / 5.0) + 1.0) * 5.0
+  TempMin = ((round(TempMin      ) / 5.0) - 2.0) * 5.0
+  WindMax = ((round(WindMax      ) / 5.0) + 1.0) * 5.0
+  RainMax = ( round(RainMax * 2.0)        + 1.0) * 0.5
+  return True
+
+def LoadData(Quarter, Quarters):
+  Quarter, Quarters = LoadSpan(Quarter, Quarters)
+  if Quarter is None:
+    print('no data in range')
+    return False
+  return SelectRange(Quarter, Quarters)
+
+#----------------------------------------------------------------------
+# put ticks on the current axes at the labelled quarters only.  fixed
+# locator and formatter instances mean matplotlib builds one tick per
+# label rather than one per quarter.
+#----------------------------------------------------------------------
+
+def PlotTicks():
+  Axis = plt.gca().xaxis
+  Axis.set_major_locator(ticker.FixedLocator(TickTime))
+  Axis.set_major_formatter(ticker.FixedFormatter(Labels))
+  Axis.set_minor_locator(ticker.NullLocator())
+
+#----------------------------------------------------------------------
+# render cache.  a finished png is kept under a name derived from the
+# resolved quarter range, the plot options and the data version of the
+# range, which is the sum of the per-day counters in quarter_version
+# (bumped by a trigger on every insert, update or delete in quarter,
+# see condense.py).  any change to a row in range changes the name, so
+# nothing ever needs invalidating; stale entries just age out of the
+# size-bounded lru, which uses file modification times as its clock.
+#----------------------------------------------------------------------
+
+PlotFile = 'weather-plot.png'
+
+PlotCacheDir = 'plot-cache'
+PlotCacheMax = 64 * 1024 * 1024 # bytes
+
+def PlotCacheKey(Quarter, Quarters):
+  First, Quarters = FirstQuarterSql(Quarter, Quarters)
+  DbConnection = DbConnect()
+  try:
+    DbCursor = DbConnection.cursor()
+    DbCursor.execute(
+      'SELECT f.first, coalesce(sum(v.version), 0) FROM (SELECT %s AS first) AS f '
+      'LEFT JOIN quarter_version v ON v.day BETWEEN f.first / 96 AND (f.first + %d) / 96 '
+      'GROUP BY f.first' % (First, Quarters - 1))
+    Row = DbCursor.fetchone()
+  except storage.Error as er:
+    print('plot cache unavailable: %s' % (er.message))
+    return None, Quarter, Quarters
+  finally:
+    DbRelease(DbConnection)
+  if not Row or Row[0] is None:
+    return None, Quarter, Quarters
+  Options = (VERSION, tuple(Panels), WidthEach, HeightEach, PlotDpi, DecimatePoints)
+  Key = hashlib.sha1(repr((Row[0], Quarters, Row[1], Options)).encode('ascii')).hexdigest()
+  return Key, Row[0], Quarters
+
+def PlotCachePath(Key):
+  return os.path.join(PlotCacheDir, '%s.png' % (Key))
+
+def PlotCacheGet(Key, Target):
+  if Key and os.path.exists(PlotCachePath(Key)):
+    os.utime(PlotCachePath(Key), None) # most recently used
+    shutil.copyfile(PlotCachePath(Key), Target)
+    return True
+  return False
+
+def PlotCachePut(Key, Source):
+  if Key:
+    with open(Source, 'rb') as f:
+      PlotCacheWrite(Key, f.read())
+
+def PlotCacheWrite(Key, Data):
+  if not os.path.isdir(PlotCacheDir):
+    os.makedirs(PlotCacheDir)
+  with open(PlotCachePath(Key) + '.tmp', 'wb') as f:
+    f.write(Data)
+  os.rename(PlotCachePath(Key) + '.tmp', PlotCachePath(Key))
+  Entries = sorted([(os.path.getmtime(Path), os.path.getsize(Path), Path)
+    for Path in glob.glob(os.path.join(PlotCacheDir, '*.png'))])
+  Total = sum([Size for Time, Size, Path in Entries])
+  for Time, Size, Path in Entries:
+    if Total <= PlotCacheMax:
+      break
+    os.remove(Path)
+    Total -= Size
+
+#----------------------------------------------------------------------
+# the figure, one axes per panel sharing a single x axis, the line
+# artists by series name, each axes with a function returning its
+# current y limits, and any other artists that need redrawing for a
+# new range.  the plot functions fill these in as they build the
+# figure; after that updateplots can point everything at a new range
+# without building anything new.
+#----------------------------------------------------------------------
+
+Figure     = None
+PanelAxes  = []
+Lines      = {}
+AxesLimits = []
+Refreshers = []
+
+def Series():
+  return {
+    'Temperature': Temperature,
+    'DewPoint'   : DewPoint   ,
+    'Humidity'   : Humidity   ,
+    'WindSpeed'  : WindSpeed  ,
+    'Direction'  : Direction  ,
+    'Rain'       : Rain       ,
+    'RainTotal'  : RainTotal  ,
+  }
+
+def UpdatePlots():
+  Data = Series()
+  for Name in Lines:
+    x, y = Decimate(Time, Data[Name])
+    Lines[Name].set_data(x, y)
+  for Axes, Limits in AxesLimits:
+    plt.sca(Axes)
+    plt.axis([TimeMin, TimeMax] + list(Limits()))
+    plt.xlabel(LabelText)
+  for Axes, Refresh in Refreshers:
+    plt.sca(Axes)
+    Refresh()
+  PlotTicks()
+
+#----------------------------------------------------------------------
+# render the currently selected range to a png file, building the
+# figure the first time and reusing it after that.  the panels share
+# one x axis, so its locator and formatter are set just once, but each
+# panel keeps its own row of tick labels as it always has.
+#----------------------------------------------------------------------
+
+def Render(File, Format='png'):
+  global Figure, PanelAxes
+  Start = time.time()
+  if Figure is None:
+    Figure, PanelAxes = plt.subplots(len(Panels), 1, sharex=True, squeeze=False,
+      figsize=(WidthEach, HeightEach * len(Panels)))
+    PanelAxes = list(PanelAxes[:, 0])
+    for PlotIndex, Panel in enumerate(Panels):
+      PanelPlots[Panel](PlotIndex)
+      PanelAxes[PlotIndex].xaxis.set_tick_params(labelbottom=True)
+    PlotTicks()
   else:
+    UpdatePlots()
+  Start = metrics.Timed('plot', Start)
+  plt.savefig(File, format=Format, dpi=PlotDpi, bbox_inches='tight', transparent=True)
+  metrics.Timed('render', Start)
+
+#----------------------------------------------------------------------
+# import matplotlib on demand, using the agg backend when there is no
+# display to show things on.
+#----------------------------------------------------------------------
+
+def ImportPlotting(Headless):
+  global plt, patches, ticker
+  Start = time.time()
+  import matplotlib
+  if Headless:
+    matplotlib.use('Agg')
+  import matplotlib.pyplot  as plt
+  import matplotlib.patches as patches
+  import matplotlib.ticker  as ticker
+  metrics.Timed('import matplotlib', Start)
+
+#----------------------------------------------------------------------
+# batch mode.  parse quarter:quarters[/span] range specifications, load
+# the span covering all of them with one query, then render each range
+# to its own png.  with more than one job the ranges are dealt out to a
+# pool of worker processes, which inherit the loaded data when they
+# fork and each reuse a figure of their own.
+#----------------------------------------------------------------------
+
+def ParseBatch(Args):
+  Ranges, Jobs = [], 1
+  while Args:
+    Arg = Args.pop(0)
+    if Arg.lower().startswith('-j'):
+      Jobs = int(Args.pop(0))
+    else:
+      Span, Slash, Step = Arg.partition('/')
+      Quarter, Quarters = [int(Value) for Value in Span.split(':')]
+      Step = int(Step) if Step else Quarters
+      for First in range(Quarter, Quarter + Quarters, Step):
+        Ranges.append((First, min(Step, Quarter + Quarters - First)))
+  return Ranges, Jobs
+
+def RenderRanges(Ranges):
+  Rendered = 0
+  for Quarter, Quarters in Ranges:
+    if SelectRange(Quarter, Quarters):
+      Render('weather-plot-%d-%d.png' % (Quarter, Quarters))
+      Rendered += 1
+  return Rendered
+
+def RenderBatch(Ranges, Jobs):
+  First = min([Quarter for Quarter, Quarters in Ranges])
+  Last  = max([Quarter + Quarters for Quarter, Quarters in Ranges])
+  if LoadSpan(First, Last - First)[0] is None:
     print('no data in range')
-  DbConnection.commit()
-  DbConnection.close()
+    return 0
+  if Jobs > 1:
+    Pool = multiprocessing.Pool(Jobs)
+    Rendered = sum(Pool.map(RenderRanges, [Ranges[Job::Jobs] for Job in range(Jobs)]))
+    Pool.close()
+    Pool.join()
+    return Rendered
+  return RenderRanges(Ranges)
+
+#----------------------------------------------------------------------
+# server mode.  a single-threaded http server (matplotlib state is not
+# thread safe, and one figure is reused for every plot) with a warm
+# database connection pool.  the etag of a reply is the render cache
+# key plus the format, so a client polling with if-none-match gets a
+# 304 for the price of the data version query.  finished replies are
+# kept in a small in-memory lru, which keeps the most-recent-day view
+# that dashboards poll in memory until its data changes, and pngs also
+# go through the on-disk render cache, which the command line shares.
+#----------------------------------------------------------------------
+
+ServePort = 8080
+
+ServeCacheMax = 16 # replies
+
+ServeCache = collections.OrderedDict()
+
+ServeTypes = {
+  '/plot.png'   : ('png' , 'image/png'       ),
+  '/plot.svg'   : ('svg' , 'image/svg+xml'   ),
+  '/series.json': ('json', 'application/json'),
+}
+
+def ServeJson():
+  Reply = {'quarter': TimeMin, 'quarters': len(Time), 'id': Time.tolist()}
+  Values = (Temperature, DewPoint, Humidity, WindSpeed, Direction, Rain, RainTotal, Tau)
+  for Column, Value in zip(Columns, Values):
+    Reply[Column] = Value.tolist()
+  return json.dumps(Reply)
+
+def ServeBody(Key, Format, Quarter, Quarters):
+  if Format == 'png' and Key and os.path.exists(PlotCachePath(Key)):
+    os.utime(PlotCachePath(Key), None) # most recently used
+    with open(PlotCachePath(Key), 'rb') as f:
+      return f.read()
+  if not LoadData(Quarter, Quarters):
+    return None
+  if Format == 'json':
+    return ServeJson()
+  Buffer = io.BytesIO()
+  Render(Buffer, Format)
+  if Format == 'png' and Key:
+    PlotCacheWrite(Key, Buffer.getvalue())
+  return Buffer.getvalue()
+
+class ServeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+  def Reply(self, Code, Type, Body, ETag=None):
+    self.send_response(Code)
+    if ETag:
+      self.send_header('ETag', ETag)
+      self.send_header('Cache-Control', 'no-cache')
+    if Body is None:
+      self.end_headers()
+      return
+    self.send_header('Content-Type', Type)
+    self.send_header('Content-Length', str(len(Body)))
+    self.end_headers()
+    self.wfile.write(Body)
+
+  def do_GET(self):
+    Url = urlparse.urlparse(self.path)
+    if Url.path not in ServeTypes:
+      return self.Reply(404, 'text/plain', 'not found\n')
+    Format, Type = ServeTypes[Url.path]
+    Query = urlparse.parse_qs(Url.query)
+    try:
+      Quarter  = int(Query.get('quarter' , ['0'])[0])
+      Quarters = int(Query.get('quarters', ['0'])[0])
+      if Quarter > 0 and Quarters < 1:
+        raise ValueError('bad quarters')
+    except ValueError:
+      return self.Reply(400, 'text/plain', 'specify quarter and quarters\n')
+    Key, Quarter, Quarters = PlotCacheKey(Quarter, Quarters)
+    ETag = '"%s.%s"' % (Key, Format) if Key else None
+    if ETag and ETag in self.headers.get('If-None-Match', ''):
+      return self.Reply(304, Type, None, ETag)
+    Body = ServeCache.pop(ETag, None)
+    if Body is None:
+      Body = ServeBody(Key, Format, Quarter, Quarters)
+      if Body is None:
+        return self.Reply(404, 'text/plain', 'no data in range\n')
+    if ETag:
+      ServeCache[ETag] = Body # most recently used last
+      while len(ServeCache) > ServeCacheMax:
+        ServeCache.popitem(last=False)
+    self.Reply(200, Type, Body, ETag)
+
+def Serve(Port):
+  global DbPool
+  ImportPlotting(True)
+  DbPool = storage.Pool(1, 2)
+  print('serving on port %d' % (Port))
+  BaseHTTPServer.HTTPServer(('', Port), ServeHandler).serve_forever()
 
 #----------------------------------------------------------------------
 # plot the temperature and dew point
@@ -237,21 +609,17 @@ def LoadData(Quarter, Quarters):
 
 def PlotTemperature(PlotIndex):
 
-  # logical grid has 1 column
+  # draw on this panel's axes
 
-  plt.subplot((Graphics * 100) + 11 + PlotIndex)
+  plt.sca(PanelAxes[PlotIndex])
 
   # plot temperature in red and dew point in green.  Don't specify any
   # labels here, we will do that in the legend definitions below.
 
-  plt.plot(Time, Temperature, 'r-', linewidth=1.0)
-  plt.plot(Time, DewPoint   , 'g-', linewidth=1.0)
-
-  # the xticks literals need to align with the time list (same
-  # number of elements).  Used empty strings to skip labels.
-
-  if Labels:
-    plt.xticks(Time,Labels)
+  x, y = Decimate(Time, Temperature)
+  Lines['Temperature'], = plt.plot(x, y, 'r-', linewidth=1.0)
+  x, y = Decimate(Time, DewPoint   )
+  Lines['DewPoint'   ], = plt.plot(x, y, 'g-', linewidth=1.0)
 
   if LabelText:
     plt.xlabel(LabelText)
@@ -259,6 +627,7 @@ def PlotTemperature(PlotIndex):
   # Define the range of time and temperature axis.
 
   plt.axis([TimeMin, TimeMax, TempMin, TempMax])
+  AxesLimits.append((plt.gca(), lambda: (TempMin, TempMax)))
 
   # make some graphics color blocks for use in the legend.
 
@@ -286,20 +655,15 @@ def PlotTemperature(PlotIndex):
 
 def PlotWind(PlotIndex):
 
-  # logical grid has 1 column
+  # draw on this panel's axes
 
-  plt.subplot((Graphics * 100) + 11 + PlotIndex)
+  plt.sca(PanelAxes[PlotIndex])
 
   # plot temperature in red and dew point in green.  Don't specify any
   # labels here, we will do that in the legend definitions below.
 
-  plt.plot(Time, WindSpeed, 'b-', linewidth=1.0)
-
-  # the xticks literals need to align with the time list (same
-  # number of elements).  Used empty strings to skip labels.
-
-  if Labels:
-    plt.xticks(Time,Labels)
+  x, y = Decimate(Time, WindSpeed)
+  Lines['WindSpeed'], = plt.plot(x, y, 'b-', linewidth=1.0)
 
   if LabelText:
     plt.xlabel(LabelText)
@@ -307,6 +671,7 @@ def PlotWind(PlotIndex):
   # define the range of time and temperature axis
 
   plt.axis([TimeMin, TimeMax, 0, WindMax])
+  AxesLimits.append((plt.gca(), lambda: (0, WindMax)))
 
   # make a graphics color blocks for use in the legend
 
@@ -333,21 +698,17 @@ def PlotWind(PlotIndex):
 
 def PlotRain(PlotIndex):
 
-  # logical grid has 1 column
+  # draw on this panel's axes
 
-  plt.subplot((Graphics * 100) + 11 + PlotIndex)
+  plt.sca(PanelAxes[PlotIndex])
 
   # plot temperature in red and dew point in green.  Don't specify any
   # labels here, we will do that in the legend definitions below.
 
-  plt.plot(Time, Rain     , 'g-', linewidth=1.0)
-  plt.plot(Time, RainTotal, 'b-', linewidth=1.0)
-
-  # the xticks literals need to align with the time list (same
-  # number of elements).  Used empty strings to skip labels.
-
-  if Labels:
-    plt.xticks(Time,Labels)
+  x, y = Decimate(Time, Rain     )
+  Lines['Rain'     ], = plt.plot(x, y, 'g-', linewidth=1.0)
+  x, y = Decimate(Time, RainTotal)
+  Lines['RainTotal'], = plt.plot(x, y, 'b-', linewidth=1.0)
 
   if LabelText:
     plt.xlabel(LabelText)
@@ -355,6 +716,7 @@ def PlotRain(PlotIndex):
   # Define the range of time and temperature axis.
 
   plt.axis([TimeMin, TimeMax, 0, RainMax])
+  AxesLimits.append((plt.gca(), lambda: (0, RainMax)))
 
   # make some graphics color blocks for use in the legend.
 
@@ -376,13 +738,197 @@ def PlotRain(PlotIndex):
 
   plt.tick_params(bottom=False)
 
+#----------------------------------------------------------------------
+# plot the relative humidity
+#----------------------------------------------------------------------
+
+def PlotHumidity(PlotIndex):
+
+  # draw on this panel's axes
+
+  plt.sca(PanelAxes[PlotIndex])
+
+  # plot humidity in cyan.  Don't specify any labels here, we will do
+  # that in the legend definitions below.
+
+  x, y = Decimate(Time, Humidity)
+  Lines['Humidity'], = plt.plot(x, y, 'c-', linewidth=1.0)
+
+  if LabelText:
+    plt.xlabel(LabelText)
+
+  # humidity is always on a 0-100 scale.
+
+  plt.axis([TimeMin, TimeMax, 0, 100])
+  AxesLimits.append((plt.gca(), lambda: (0, 100)))
+
+  # make a graphics color block for use in the legend.
+
+  patch1 = patches.Patch(color='cyan', label=u'Humidity (%)')
+
+  # display the legend in lower right with no frame.
+
+  plt.legend(loc='lower right', frameon=False, ncol=2, handles=[patch1])
+
+  # turn off the top and right borders of the figure.
+
+  plt.gca().spines.values()[1].set_visible(False) # right
+  plt.gca().spines.values()[3].set_visible(False) # top
+
+  # turn off ticks on the bottom axis.
+
+  plt.tick_params(bottom=False)
+
+#----------------------------------------------------------------------
+# plot the wind direction
+#----------------------------------------------------------------------
+
+def PlotDirection(PlotIndex):
+
+  # draw on this panel's axes
+
+  plt.sca(PanelAxes[PlotIndex])
+
+  # plot the direction as dots, since a line joining 350 to 10 degrees
+  # would sweep across the whole graph.
+
+  x, y = Decimate(Time, Direction)
+  Lines['Direction'], = plt.plot(x, y, 'b.', markersize=1.0)
+
+  if LabelText:
+    plt.xlabel(LabelText)
+
+  # compass bearings, with the cardinal points marked.
+
+  plt.axis([TimeMin, TimeMax, 0, 360])
+  AxesLimits.append((plt.gca(), lambda: (0, 360)))
+  plt.yticks([0, 90, 180, 270, 360], ['N', 'E', 'S', 'W', 'N'])
+
+  # make a graphics color block for use in the legend.
+
+  patch1 = patches.Patch(color='blue', label=u'Wind Direction')
+
+  # display the legend in lower right with no frame.
+
+  plt.legend(loc='lower right', frameon=False, ncol=2, handles=[patch1])
+
+  # turn off the top and right borders of the figure.
+
+  plt.gca().spines.values()[1].set_visible(False) # right
+  plt.gca().spines.values()[3].set_visible(False) # top
+
+  # turn off ticks on the bottom axis.
+
+  plt.tick_params(bottom=False)
+
+#----------------------------------------------------------------------
+# plot tornado alerts.  the runs of quarters where the tau was alerting
+# (status 9) or not answering (status 0, in quarters that have data)
+# are found in one vectorized pass over the status column and drawn as
+# shaded spans, each set as a single collection.
+#----------------------------------------------------------------------
+
+TAU_ALERT = 9
+
+TauArtists = []
+
+def TauSpans(Mask):
+  Edges = np.flatnonzero(np.diff(np.concatenate(([0], Mask.astype(int), [0]))))
+  Starts, Ends = Edges[0::2], Edges[1::2]
+  return list(zip(Time[Starts], Ends - Starts))
+
+def TauShade():
+  for Artist in TauArtists:
+    Artist.remove()
+  del TauArtists[:]
+  Offline = (Tau == 0) & (Temperature != 0)
+  TauArtists.append(plt.broken_barh(TauSpans(Tau >= TAU_ALERT), (0, 1), facecolors='red' , alpha=0.5))
+  TauArtists.append(plt.broken_barh(TauSpans(Offline         ), (0, 1), facecolors='gray', alpha=0.3))
+
+def PlotTau(PlotIndex):
+
+  # draw on this panel's axes
+
+  plt.sca(PanelAxes[PlotIndex])
+
+  # shade the alert and offline spans, and redo them for each new range.
+
+  TauShade()
+  Refreshers.append((plt.gca(), TauShade))
+
+  if LabelText:
+    plt.xlabel(LabelText)
+
+  # the spans fill the panel, so the vertical axis means nothing.
+
+  plt.axis([TimeMin, TimeMax, 0, 1])
+  AxesLimits.append((plt.gca(), lambda: (0, 1)))
+  plt.yticks([])
+
+  # make some graphics color blocks for use in the legend.
+
+  patch1 = patches.Patch(color='red' , alpha=0.5, label=u'Tornado Alert')
+  patch2 = patches.Patch(color='gray', alpha=0.3, label=u'TAU Offline')
+
+  # display the legend on one line in lower right with no frame.
+
+  plt.legend(loc='lower right', frameon=False, ncol=2, handles=[patch1,patch2])
+
+  # turn off the top and right borders of the figure.
+
+  plt.gca().spines.values()[1].set_visible(False) # right
+  plt.gca().spines.values()[3].set_visible(False) # top
+
+  # turn off ticks on the bottom axis.
+
+  plt.tick_params(bottom=False)
+
+#----------------------------------------------------------------------
+# the panels we know how to draw, by name
+#----------------------------------------------------------------------
+
+PanelPlots = {
+  'temperature': PlotTemperature,
+  'humidity'   : PlotHumidity   ,
+  'wind'       : PlotWind       ,
+  'direction'  : PlotDirection  ,
+  'rain'       : PlotRain       ,
+  'tau'        : PlotTau        ,
+}
+
 #----------------------------------------------------------------------
 # main - pull time span from command line parameters, then pull supporting
 # datasets from postgresql, then graph the various values.
 #----------------------------------------------------------------------
 
+metrics.RunStart(PROGRAM, VERSION)
+
+for Index, Arg in enumerate(sys.argv):
+  if Arg.lower().startswith('-p'):
+    Panels = sys.argv[Index + 1].lower().split(',') if Index + 1 < len(sys.argv) else []
+    if not Panels or [Panel for Panel in Panels if Panel not in PanelPlots]:
+      print('bad arguments - specify -panels %s' % (','.join(sorted(PanelPlots))))
+      os._exit(1)
+    del sys.argv[Index:Index + 2]
+    break
+
 Quarter = Quarters = 0
-if len(sys.argv) > 1:
+Batch, Jobs = [], 1
+if len(sys.argv) > 1 and sys.argv[1].lower().startswith('-b'):
+  try:
+    Batch, Jobs = ParseBatch(sys.argv[2:])
+    if not Batch:
+      raise ValueError('no ranges')
+  except:
+    print('bad arguments - specify -batch quarter:quarters[/span] ... [-jobs n]')
+    os._exit(1)
+elif len(sys.argv) > 1 and sys.argv[1].lower().startswith('-s'):
+  try:
+    Serve(int(sys.argv[2]) if len(sys.argv) > 2 else ServePort)
+  except KeyboardInterrupt:
+    pass
+  os._exit(0)
+elif len(sys.argv) > 1:
   try:
     Quarter = int(sys.argv[1])
     if Quarter > 0:
@@ -391,19 +937,30 @@ if len(sys.argv) > 1:
     print('bad arguments - specify start quarter and quarter count')
     os._exit(1)
 
-# load data over specified range, reducing range to cover actual data
+if Batch:
+
+  # render every range headless from a single load
+
+  ImportPlotting(True)
+  Start = time.time()
+  Rendered = RenderBatch(Batch, Jobs)
+  print('rendered %d of %d plots in %0.1fs' % (Rendered, len(Batch), time.time() - Start))
+
+else:
+
+  # answer from the plot cache if we can, otherwise load data over the
+  # specified range, render it and remember the result
 
-LoadData(Quarter, Quarters)
+  Key, Quarter, Quarters = PlotCacheKey(Quarter, Quarters)
 
-if Temperature:
- #plt.ioff()
-  plt.figure(figsize=(WidthEach, HeightEach * Graphics))
-  PlotTemperature(0)
-  PlotWind(1)
-  PlotRain(2)
-  plt.savefig('weather-plot.png', bbox_inches='tight', transparent=True)
-  plt.show()
-  plt.close()
+  if PlotCacheGet(Key, PlotFile):
+    print('cached %s' % (Key))
+  elif LoadData(Quarter, Quarters):
+    ImportPlotting(False)
+    Render(PlotFile)
+    PlotCachePut(Key, PlotFile)
+    plt.show()
+    plt.close()
 
 # ===============================================================================
 # end